@@ -7,7 +7,9 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_cors import CORS
 import sqlite3
 from datetime import datetime
-from models.database import Database
+from models.database import get_shards, close_all_databases, DatabaseJSONProvider, DatabaseError
+from models.maintenance import start_maintenance
+from models.replicas import start_replica
 
 # Configure logging
 logging.basicConfig(
@@ -50,6 +52,26 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY=os.environ.get('SECRET_KEY', 'dev_key_highly_secret'),
         DATABASE_PATH=os.path.join(app.instance_path, 'poh.sqlite'),
+        DATABASE_READ_WRITE_SPLIT=False,  # One writer + read-only readers (WAL)
+        DATABASE_READERS=4,
+        DATABASE_PROFILE='auto',  # PRAGMA profile; 'auto' sizes cache/mmap from memory and cgroup limits
+        DATABASE_ROW_MODE='dict',  # 'row' returns compact sqlite3.Row results
+        DATABASE_GROUP_COMMIT=False,  # Batch concurrent writes into shared commits
+        DATABASE_GROUP_COMMIT_WINDOW=0.002,  # Seconds a batch stays open
+        DATABASE_GROUP_COMMIT_BATCH=64,
+        DATABASE_QUERY_STATS=True,  # Per-statement latency stats (see /dev)
+        DATABASE_SLOW_QUERY_MS=100,  # EXPLAIN QUERY PLAN captured above this
+        DATABASE_USER_CACHE_SIZE=1024,  # Users cached by get_user_by_id/email (0 disables)
+        DATABASE_USER_CACHE_TTL=30,  # Seconds a cached user is served
+        DATABASE_SHARDS=1,  # Database files partitioned by user id
+        DATABASE_AUTO_MIGRATE=False,  # Apply pending schema migrations at startup
+        DATABASE_REPLICA=False,  # Snapshot replica for the /dev dashboard, refreshed in the background
+        DATABASE_REPLICA_INTERVAL=60,  # Seconds between snapshot replica refreshes
+        DATABASE_REPLICA_PAGES=1024,  # Pages copied per backup step
+        DATABASE_MAINTENANCE=True,  # Background checkpoint/optimize/ANALYZE/vacuum
+        DATABASE_MAINTENANCE_INTERVAL=3600,  # Seconds between maintenance runs
+        DATABASE_WAL_CHECKPOINT_MB=64,  # WAL size that triggers a checkpoint at once
+        DATABASE_FAMILY_GRAPH=True,  # Serve family trees from an in-memory graph index
         MAX_CONTENT_LENGTH=8 * 1024 * 1024,  # 8MB max upload
         TEMPLATES_AUTO_RELOAD=True,
         JSON_SORT_KEYS=False,  # Preserve order of keys in JSON responses
@@ -67,21 +89,45 @@ def create_app(test_config=None):
         # load the test config if passed in
         app.config.from_mapping(test_config)
         
-    # Initialize database
-    db = Database(app.config['DATABASE_PATH'])
+    # Initialize database (shared process-wide per database path)
+    # (inside an app context so the remaining DATABASE_* settings are read
+    # from app.config). With DATABASE_SHARDS > 1 the per-user helpers route
+    # to the shards and g.db is shard 0.
+    with app.app_context():
+        shards = get_shards(
+            app.config['DATABASE_PATH'],
+            shards=app.config['DATABASE_SHARDS'],
+            read_write_split=app.config['DATABASE_READ_WRITE_SPLIT'],
+            readers=app.config['DATABASE_READERS'],
+            track_leaks=app.config.get('DEBUG', False),
+            row_mode=app.config['DATABASE_ROW_MODE'],
+            group_commit=app.config['DATABASE_GROUP_COMMIT']
+        )
+        db = shards.primary
+        if app.config['DATABASE_AUTO_MIGRATE']:
+            shards.migrate()
+        if app.config['DATABASE_MAINTENANCE']:
+            for shard in shards.shards:
+                start_maintenance(shard)
+        if app.config['DATABASE_REPLICA']:
+            start_replica(app.config['DATABASE_PATH'])
+        if app.config['DATABASE_FAMILY_GRAPH']:
+            try:
+                shards.family_graph()
+            except (DatabaseError, sqlite3.Error) as e:
+                # Schema not created yet; the index loads on first use instead
+                app.logger.warning(f"Family graph not loaded at startup: {e}")
+    # Serialize sqlite3.Row results in jsonify() like plain dicts
+    app.json = DatabaseJSONProvider(app)
     
     # Before request - ensure db connection is available
     @app.before_request
     def before_request():
         g.request_start_time = time.time()
+        # Queries check connections out per operation; anything pinned with
+        # g.db.get_db() is returned in teardown_request
         g.db = db
         
-        # Ensure we have an active database connection for this request
-        try:
-            g.db.get_db()
-        except Exception as e:
-            logger.error(f"Database connection error: {e}")
-        
         # Log request details for debugging
         app.logger.debug('Request URL: %s', request.url)
         app.logger.debug('Request method: %s', request.method)
@@ -113,7 +159,7 @@ def create_app(test_config=None):
             logger.error(f"Error in after_request: {e}")
             return response
         
-    # Teardown request - close db connection
+    # Teardown request - return connections pinned during the request
     @app.teardown_request
     def teardown_request(exception):
         if hasattr(g, 'db'):
@@ -530,6 +576,7 @@ if __name__ == '__main__':
         print('Shutting down gracefully...')
         if active_server:
             active_server.shutdown()
+        close_all_databases()
         sys.exit(0)
 
     signal.signal(signal.SIGINT, signal_handler)
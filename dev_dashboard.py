@@ -1,9 +1,10 @@
-from flask import Blueprint, render_template, current_app
-import sqlite3
+from flask import Blueprint, render_template, current_app, jsonify, request
 import os
 import platform
 import psutil
 import time
+from models.database import get_database
+from models.replicas import get_replica
 
 bp = Blueprint('dev_dashboard', __name__, url_prefix='/dev')
 
@@ -25,21 +26,17 @@ def index():
     db_path = current_app.config.get('DATABASE_PATH', 'instance/poh.sqlite')
     db_stats = {}
     
-    if os.path.exists(db_path):
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Get table list
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+    # Count rows on the snapshot replica so the dashboard never holds read
+    # locks on the live database (or copies it within a request)
+    replica = get_replica(db_path)
+    if os.path.exists(db_path) and replica is not None and replica.ready:
+        tables = replica.fetch_all("SELECT name FROM sqlite_master WHERE type='table';")
         
         # Get row counts for each table
         table_counts = {}
         for table in tables:
-            table_name = table[0]
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
-            count = cursor.fetchone()[0]
+            table_name = table['name']
+            count = replica.fetch_one(f'SELECT COUNT(*) AS count FROM "{table_name}";')['count']
             table_counts[table_name] = count
         
         # Get database file size
@@ -48,10 +45,9 @@ def index():
         db_stats = {
             'tables': len(tables),
             'table_counts': table_counts,
-            'size': f"{db_size / (1024 ** 2):.2f} MB"
+            'size': f"{db_size / (1024 ** 2):.2f} MB",
+            'replica': replica.stats()
         }
-        
-        conn.close()
     
     # Application statistics
     routes = []
@@ -64,10 +60,40 @@ def index():
     
     blueprints = list(current_app.blueprints.keys())
     
+    # Query statistics recorded by the shared database
+    query_stats = get_database(db_path).query_stats
+    queries = query_stats.snapshot(limit=25) if query_stats else None
+    
     return render_template(
         'dev_dashboard.html',
         system_info=system_info,
         db_stats=db_stats,
         routes=routes,
-        blueprints=blueprints
-    ) 
\ No newline at end of file
+        blueprints=blueprints,
+        queries=queries,
+        slow_query_ms=query_stats.slow_threshold * 1000 if query_stats else None
+    )
+
+@bp.route('/queries')
+def queries():
+    """Aggregated per-statement query statistics as JSON."""
+    query_stats = get_database(current_app.config.get('DATABASE_PATH')).query_stats
+    if query_stats is None:
+        return jsonify({'enabled': False, 'queries': []})
+    
+    sort_by = request.args.get('sort', 'total_time')
+    if sort_by not in ('total_time', 'avg_time', 'max_time', 'count', 'total_rows', 'slow_count'):
+        sort_by = 'total_time'
+    return jsonify({
+        'enabled': True,
+        'slow_threshold_ms': query_stats.slow_threshold * 1000,
+        'queries': query_stats.snapshot(sort_by=sort_by, limit=request.args.get('limit', type=int))
+    })
+
+@bp.route('/queries/reset', methods=['POST'])
+def reset_queries():
+    """Discard the recorded query statistics."""
+    query_stats = get_database(current_app.config.get('DATABASE_PATH')).query_stats
+    if query_stats is not None:
+        query_stats.reset()
+    return jsonify({'success': True}) 
\ No newline at end of file
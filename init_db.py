@@ -2,15 +2,15 @@
 """
 Database initialization script for Proof of Humanity.
 This script:
-1. Creates all database tables based on the models
+1. Creates (or upgrades) the database schema by applying migrations
 2. Adds initial/seed data to the database
 3. Creates admin user if specified
 """
 
 import os
 import sys
-import sqlite3
-import datetime
+import json
+import time
 import getpass
 import hashlib
 import uuid
@@ -26,286 +26,129 @@ try:
 except ImportError:
     print("python-dotenv not installed. Environment variables from .env file will not be loaded.")
 
+from models.database import Database
+from models.migrations import apply_migrations, current_version
+
 # Database file path
 DB_PATH = os.getenv('DATABASE_URI', 'sqlite:///poh.db')
 if DB_PATH.startswith('sqlite:///'):
     DB_PATH = DB_PATH[len('sqlite:///'):]
 
-def create_schema(conn):
-    """Create the database schema."""
+def create_schema(db):
+    """Create or upgrade the database schema."""
     print(f"Creating database schema in {DB_PATH}...")
     
-    cursor = conn.cursor()
-    
-    # Create users table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        username TEXT UNIQUE NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        first_name TEXT,
-        last_name TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        is_active BOOLEAN DEFAULT 1,
-        is_admin BOOLEAN DEFAULT 0,
-        avatar TEXT,
-        verification_level INTEGER DEFAULT 0,
-        did TEXT UNIQUE
-    )
-    ''')
-    
-    # Create family_relationships table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS family_relationships (
-        id INTEGER PRIMARY KEY,
-        user_id INTEGER NOT NULL,
-        related_user_id INTEGER NOT NULL,
-        relationship_type TEXT NOT NULL,
-        is_verified BOOLEAN DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        verified_at TIMESTAMP,
-        verification_method TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (id),
-        FOREIGN KEY (related_user_id) REFERENCES users (id),
-        UNIQUE (user_id, related_user_id)
-    )
-    ''')
-    
-    # Create verification_requests table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS verification_requests (
-        id INTEGER PRIMARY KEY,
-        user_id INTEGER NOT NULL,
-        verifier_id INTEGER,
-        request_type TEXT NOT NULL,
-        status TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        expires_at TIMESTAMP,
-        metadata TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (id),
-        FOREIGN KEY (verifier_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # Create did_documents table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS did_documents (
-        id INTEGER PRIMARY KEY,
-        user_id INTEGER UNIQUE NOT NULL,
-        did TEXT UNIQUE NOT NULL,
-        document TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        private_key_encrypted TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # Create sessions table for WebRTC sessions
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS video_sessions (
-        id INTEGER PRIMARY KEY,
-        session_id TEXT UNIQUE NOT NULL,
-        user_id INTEGER NOT NULL,
-        peer_id INTEGER,
-        status TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        ice_servers TEXT,
-        session_data TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (id),
-        FOREIGN KEY (peer_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # Add indexes for better performance
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_did ON users (did)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_family_relationships_user_id ON family_relationships (user_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_family_relationships_related_user_id ON family_relationships (related_user_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_verification_requests_user_id ON verification_requests (user_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_verification_requests_status ON verification_requests (status)')
+    # Tables created by older versions of this script are rebuilt in place
+    applied = apply_migrations(db)
     
-    conn.commit()
-    print("Database schema created successfully.")
+    print(f"Database schema is at version {current_version(db)} "
+          f"({len(applied)} migration(s) applied).")
 
-def add_demo_data(conn):
+def add_demo_data(db):
     """Add demo data to the database."""
     print("Adding demo data to the database...")
     
-    cursor = conn.cursor()
-    
     # Check if users table is empty
-    cursor.execute('SELECT COUNT(*) FROM users')
-    if cursor.fetchone()[0] > 0:
+    if db.fetch_one('SELECT COUNT(*) AS count FROM users')['count'] > 0:
         print("Database already contains data. Skipping demo data creation.")
         return
     
-    # Create demo users
     # Hash passwords for demo users (in production, use proper password hashing like bcrypt)
     demo_password_hash = hashlib.sha256("demo123".encode()).hexdigest()
+    now = int(time.time())
     
     users = [
-        (
-            'johndoe', 
-            'john.doe@example.com', 
-            demo_password_hash, 
-            'John', 
-            'Doe', 
-            datetime.datetime.now().isoformat(), 
-            datetime.datetime.now().isoformat(), 
-            1,
-            0,
-            '/static/images/default-avatar.png',
-            2,  # Verification level
-            f'did:poh:{uuid.uuid4().hex}'
-        ),
-        (
-            'janedoe', 
-            'jane.doe@example.com', 
-            demo_password_hash, 
-            'Jane', 
-            'Doe', 
-            datetime.datetime.now().isoformat(), 
-            datetime.datetime.now().isoformat(), 
-            1,
-            0,
-            '/static/images/default-avatar.png',
-            1,  # Verification level
-            f'did:poh:{uuid.uuid4().hex}'
-        ),
-        (
-            'samsmith', 
-            'sam.smith@example.com', 
-            demo_password_hash, 
-            'Sam', 
-            'Smith', 
-            datetime.datetime.now().isoformat(), 
-            datetime.datetime.now().isoformat(), 
-            1,
-            0,
-            '/static/images/default-avatar.png',
-            0,  # Verification level
-            f'did:poh:{uuid.uuid4().hex}'
-        )
-    ]
-    
-    cursor.executemany('''
-    INSERT INTO users 
-    (username, email, password_hash, first_name, last_name, created_at, updated_at, is_active, is_admin, avatar, verification_level, did) 
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', users)
-    
-    # Create demo family relationships
-    family_relationships = [
-        (
-            1,  # John Doe
-            2,  # Jane Doe
-            'spouse',
-            1,  # Verified
-            datetime.datetime.now().isoformat(),
-            'video'
-        ),
-        (
-            2,  # Jane Doe
-            1,  # John Doe
-            'spouse',
-            1,  # Verified
-            datetime.datetime.now().isoformat(),
-            'video'
-        ),
-        (
-            1,  # John Doe
-            3,  # Sam Smith
-            'friend',
-            0,  # Not verified
-            None,
-            None
-        )
+        ('John Doe', 'john.doe@example.com', 2),
+        ('Jane Doe', 'jane.doe@example.com', 1),
+        ('Sam Smith', 'sam.smith@example.com', 0),
     ]
     
-    cursor.executemany('''
-    INSERT INTO family_relationships 
-    (user_id, related_user_id, relationship_type, is_verified, verified_at, verification_method) 
-    VALUES (?, ?, ?, ?, ?, ?)
-    ''', family_relationships)
-    
-    # Create demo verification requests
-    verification_requests = [
-        (
-            3,  # Sam Smith
-            1,  # John Doe (verifier)
-            'family',
-            'pending',
-            datetime.datetime.now().isoformat(),
-            datetime.datetime.now().isoformat(),
-            (datetime.datetime.now() + datetime.timedelta(days=7)).isoformat(),
-            '{"relationship": "friend", "message": "Please verify our friendship!"}'
-        ),
-        (
-            3,  # Sam Smith
-            None,  # No specific verifier
-            'document',
-            'pending',
-            datetime.datetime.now().isoformat(),
-            datetime.datetime.now().isoformat(),
-            (datetime.datetime.now() + datetime.timedelta(days=7)).isoformat(),
-            '{"document_type": "passport", "status": "submitted"}'
-        )
-    ]
-    
-    cursor.executemany('''
-    INSERT INTO verification_requests 
-    (user_id, verifier_id, request_type, status, created_at, updated_at, expires_at, metadata) 
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', verification_requests)
-    
-    # Create demo DID documents
-    for i in range(1, 4):
-        cursor.execute('SELECT did FROM users WHERE id = ?', (i,))
-        user_did = cursor.fetchone()[0]
+    with db.transaction():
+        # Create demo users
+        john, jane, sam = db.bulk_insert('users', [
+            {
+                'name': name,
+                'email': email,
+                'password_hash': demo_password_hash,
+                'verification_level': verification_level,
+                'email_verified': 1,
+                'created_at': now,
+                'updated_at': now
+            }
+            for name, email, verification_level in users
+        ], return_ids=True)
+        
+        # Create demo family relationships
+        db.bulk_insert('family_relationships', [
+            {'user_id': user_id, 'relative_id': relative_id, 'relationship_type': relationship_type,
+             'verified': verified, 'created_at': now, 'updated_at': now}
+            for user_id, relative_id, relationship_type, verified in (
+                (john, jane, 'spouse', 1),
+                (jane, john, 'spouse', 1),
+                (john, sam, 'friend', 0),
+            )
+        ])
         
-        # Simple DID document structure
-        did_document = {
-            "@context": "https://www.w3.org/ns/did/v1",
-            "id": user_did,
-            "verificationMethod": [
-                {
-                    "id": f"{user_did}#keys-1",
-                    "type": "Ed25519VerificationKey2018",
-                    "controller": user_did,
-                    "publicKeyBase58": f"mock_public_key_for_user_{i}"
-                }
-            ],
-            "authentication": [
-                f"{user_did}#keys-1"
-            ],
-            "assertionMethod": [
-                f"{user_did}#keys-1"
-            ]
-        }
+        # Create demo verification requests
+        db.bulk_insert('verification_requests', [
+            {
+                'user_id': sam,
+                'verifier_id': john,
+                'type': 'family',
+                'status': 'pending',
+                'data': json.dumps({"relationship": "friend", "message": "Please verify our friendship!"}),
+                'created_at': now,
+                'updated_at': now
+            },
+            {
+                'user_id': sam,
+                'verifier_id': None,
+                'type': 'document',
+                'status': 'pending',
+                'data': json.dumps({"document_type": "passport", "status": "submitted"}),
+                'created_at': now,
+                'updated_at': now
+            }
+        ])
         
-        cursor.execute('''
-        INSERT INTO did_documents 
-        (user_id, did, document, created_at, updated_at, private_key_encrypted) 
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            i, 
-            user_did, 
-            str(did_document), 
-            datetime.datetime.now().isoformat(), 
-            datetime.datetime.now().isoformat(),
-            f"mock_encrypted_private_key_for_user_{i}"
-        ))
+        # Create demo DID documents
+        did_documents = []
+        for i, user_id in enumerate((john, jane, sam), start=1):
+            user_did = f'did:poh:{uuid.uuid4().hex}'
+            
+            # Simple DID document structure
+            did_document = {
+                "@context": "https://www.w3.org/ns/did/v1",
+                "id": user_did,
+                "verificationMethod": [
+                    {
+                        "id": f"{user_did}#keys-1",
+                        "type": "Ed25519VerificationKey2018",
+                        "controller": user_did,
+                        "publicKeyBase58": f"mock_public_key_for_user_{i}"
+                    }
+                ],
+                "authentication": [
+                    f"{user_did}#keys-1"
+                ],
+                "assertionMethod": [
+                    f"{user_did}#keys-1"
+                ]
+            }
+            
+            did_documents.append({
+                'user_id': user_id,
+                'identifier': user_did,
+                'document': json.dumps(did_document),
+                'keys': json.dumps([f"mock_public_key_for_user_{i}"]),
+                'created_at': now,
+                'updated_at': now
+            })
+        db.bulk_insert('did_documents', did_documents)
     
-    conn.commit()
     print("Demo data added successfully.")
 
-def create_admin_user(conn):
+def create_admin_user(db):
     """Create an admin user if needed."""
     print("\nDo you want to create an admin user? (y/n)")
     create_admin = input().strip().lower()
@@ -314,17 +157,9 @@ def create_admin_user(conn):
         print("Skipping admin user creation.")
         return
     
-    cursor = conn.cursor()
-    
-    # Check if admin user already exists
-    cursor.execute('SELECT COUNT(*) FROM users WHERE is_admin = 1')
-    if cursor.fetchone()[0] > 0:
-        print("Admin user already exists. Skipping admin user creation.")
-        return
-    
     # Get admin user details
-    username = input("Enter admin username: ").strip()
-    email = input("Enter admin email: ").strip()
+    name = input("Enter admin name: ").strip() or 'Admin User'
+    email = input("Enter admin email: ").strip().lower()
     password = getpass.getpass("Enter admin password: ")
     confirm_password = getpass.getpass("Confirm admin password: ")
     
@@ -332,23 +167,22 @@ def create_admin_user(conn):
         print("Passwords don't match. Skipping admin user creation.")
         return
     
+    # Check if the user already exists
+    if db.fetch_one('SELECT id FROM users WHERE email = ?', (email,)):
+        print("A user with that email already exists. Skipping admin user creation.")
+        return
+    
     # Hash password (in production, use proper password hashing like bcrypt)
     password_hash = hashlib.sha256(password.encode()).hexdigest()
+    now = int(time.time())
     
-    # Create admin user
-    cursor.execute('''
-    INSERT INTO users 
-    (username, email, password_hash, first_name, last_name, created_at, updated_at, is_active, is_admin, verification_level) 
-    VALUES (?, ?, ?, 'Admin', 'User', ?, ?, 1, 1, 3)
-    ''', (
-        username, 
-        email, 
-        password_hash, 
-        datetime.datetime.now().isoformat(), 
-        datetime.datetime.now().isoformat()
-    ))
+    # Create admin user with the highest verification level
+    db.execute_query('''
+    INSERT INTO users
+    (name, email, password_hash, verification_level, email_verified, created_at, updated_at)
+    VALUES (?, ?, ?, 3, 1, ?, ?)
+    ''', (name, email, password_hash, now, now))
     
-    conn.commit()
     print("Admin user created successfully.")
 
 def initialize_database():
@@ -360,21 +194,23 @@ def initialize_database():
     # Check if database already exists
     db_exists = os.path.exists(DB_PATH)
     
-    # Connect to the database (creates the file if it doesn't exist)
-    conn = sqlite3.connect(DB_PATH)
-    
-    # Create schema
-    create_schema(conn)
+    # Open the database (creates the file if it doesn't exist)
+    db = Database(os.path.abspath(DB_PATH), track_leaks=False, query_stats=False)
     
-    # Add demo data if it's a new database
-    if not db_exists:
-        add_demo_data(conn)
-    
-    # Optionally create admin user
-    create_admin_user(conn)
+    try:
+        # Create schema
+        create_schema(db)
+        
+        # Add demo data if it's a new database
+        if not db_exists:
+            add_demo_data(db)
+        
+        # Optionally create admin user
+        create_admin_user(db)
+    finally:
+        db.close_pools()
     
-    conn.close()
     print(f"\nDatabase initialization complete. Database located at: {DB_PATH}")
 
 if __name__ == '__main__':
-    initialize_database() 
\ No newline at end of file
+    initialize_database()
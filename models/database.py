@@ -1,13 +1,24 @@
 import sqlite3
+import atexit
 import os
 import re
 import threading
 import time
 import logging
+import traceback
+import uuid
+import zlib
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+from itertools import islice
 from functools import wraps
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
 from typing import List, Dict, Any, Optional, Tuple, Union, Callable
-from flask import current_app, g
+from flask import current_app, g, has_app_context
+from flask.json.provider import DefaultJSONProvider
+
+from models.hardware import resolve_profile
+from models.family_graph import FamilyGraph
 
 # Configure logging
 logging.basicConfig(
@@ -20,12 +31,74 @@ class DatabaseError(Exception):
     """Custom exception for database-related errors."""
     pass
 
+# Statements that can be served by a read-only connection
+_READ_QUERY_RE = re.compile(r'^\s*(?:--[^\n]*\n\s*)*(SELECT|WITH|VALUES|EXPLAIN)\b', re.IGNORECASE)
+_WRITE_KEYWORD_RE = re.compile(r'\b(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+_INSERT_QUERY_RE = re.compile(r'^\s*(INSERT|REPLACE)\b', re.IGNORECASE)
+
+def is_read_query(query: str) -> bool:
+    """
+    Check whether a statement only reads data.
+    
+    Args:
+        query: SQL statement
+        
+    Returns:
+        True if the statement can run on a read-only connection
+    """
+    return bool(_READ_QUERY_RE.match(query)) and not _WRITE_KEYWORD_RE.search(query)
+
+# Table and column names interpolated into generated statements
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def _quote_identifier(name: str) -> str:
+    """
+    Validate and quote a table or column name for use in generated SQL.
+    
+    Args:
+        name: Identifier to quote
+        
+    Returns:
+        The double-quoted identifier
+        
+    Raises:
+        ValueError: If the name is not a plain SQL identifier
+    """
+    if not isinstance(name, str) or not _IDENTIFIER_RE.match(name):
+        raise ValueError(f"Invalid SQL identifier: {name!r}")
+    return f'"{name}"'
+
+# Parameters per multi-row INSERT, within every SQLite build's
+# SQLITE_MAX_VARIABLE_NUMBER (999 before 3.32)
+BULK_INSERT_PARAMS = 999
+
+def _chunks(rows, size: int):
+    """Yield lists of up to ``size`` items from any iterable of rows."""
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+class _Waiter:
+    """A thread queued in ConnectionPool.get_connection."""
+    __slots__ = ('condition', 'connection')
+    
+    def __init__(self, condition: threading.Condition):
+        self.condition = condition
+        self.connection = None
+
 class ConnectionPool:
     """
     A simple connection pool for SQLite connections.
     Manages a configurable number of connections for thread-safe database access.
     """
-    def __init__(self, database_path: str, max_connections: int = 5, timeout: int = 10):
+    def __init__(self, database_path: str, max_connections: int = 5, timeout: int = 10,
+                 validate_after: float = 30.0, max_idle_time: float = 300.0,
+                 reap_interval: float = 60.0, read_only: bool = False,
+                 track_checkouts: bool = False, foreign_keys: bool = True,
+                 profile: Optional[str] = None):
         """
         Initialize the connection pool.
         
@@ -33,17 +106,59 @@ class ConnectionPool:
             database_path: Path to the SQLite database file
             max_connections: Maximum number of connections to keep in the pool
             timeout: Timeout in seconds for acquiring a connection
+            validate_after: Idle seconds after which a connection is re-validated on checkout
+            max_idle_time: Idle seconds after which the reaper closes a connection (0 disables)
+            reap_interval: Seconds between reaper runs
+            read_only: Open connections with PRAGMA query_only so they can never write
+            track_checkouts: Record the owning thread and stack of every checkout
+                so leaked connections can be reported (debug mode)
+            foreign_keys: Enforce foreign key constraints
+            profile: Hardware PRAGMA profile, or 'auto' to size the page cache and
+                memory map from usable memory (defaults to DATABASE_PROFILE)
         """
         self.database_path = database_path
+        self.read_only = read_only
+        self.foreign_keys = foreign_keys
         self.max_connections = max_connections
         self.timeout = timeout
+        self.validate_after = validate_after
+        self.max_idle_time = max_idle_time
+        self.reap_interval = reap_interval
+        # Resolved once so every connection of the pool gets the same settings
+        self.profile = resolve_profile(profile, connections=max_connections)
         self.connections = []
         self.in_use = set()
         self.lock = threading.RLock()
         self.connection_count = 0
         
+        # Health-check bookkeeping: when each idle connection was returned,
+        # and which connections saw an error and must be validated
+        self.idle_since = {}
+        self.suspect = set()
+        self.validations = 0
+        self.reaped = 0
+        self._reaper = None
+        self._reaper_stop = threading.Event()
+        
+        # Who holds each checked-out connection, for leak detection
+        self.track_checkouts = track_checkouts
+        self.checkout_info = {}
+        
+        # FIFO queue of threads waiting for a connection
+        self.waiters = deque()
+        
+        # Wait statistics, exported through stats()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.max_queue_depth = 0
+        
+        self.memory = is_memory_database(database_path)
+        
         # Only create directories if not using in-memory database
-        if database_path != ":memory:":
+        if not self.memory and not database_path.startswith("file:"):
             os.makedirs(os.path.dirname(database_path), exist_ok=True)
 
     def _create_connection(self) -> sqlite3.Connection:
@@ -53,18 +168,29 @@ class ConnectionPool:
                 self.database_path,
                 detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
                 check_same_thread=False,
-                timeout=self.timeout
+                timeout=self.timeout,
+                # Autocommit: single statements commit on their own and
+                # Database.transaction() issues BEGIN/SAVEPOINT explicitly
+                isolation_level=None,
+                uri=self.database_path.startswith("file:")
             )
-            # Enable foreign keys
-            conn.execute("PRAGMA foreign_keys = ON")
-            # Enable extended result codes for better error messages
-            conn.execute("PRAGMA full_column_names = ON")
+            # Enable foreign keys (shards turn them off: references cross shards)
+            conn.execute(f"PRAGMA foreign_keys = {'ON' if self.foreign_keys else 'OFF'}")
             # Configure for better concurrency and less lock contention
             conn.execute("PRAGMA journal_mode = WAL")
-            conn.execute("PRAGMA synchronous = NORMAL")
-            conn.execute("PRAGMA cache_size = 10000")
             conn.execute("PRAGMA temp_store = MEMORY")
             conn.execute("PRAGMA busy_timeout = 10000")  # 10 second busy timeout
+            # Page cache, memory map and durability from the hardware profile
+            for pragma, value in self.profile['pragmas'].items():
+                conn.execute(f"PRAGMA {pragma} = {value}")
+            if self.read_only:
+                # Reader connections reject writes at the SQLite level
+                conn.execute("PRAGMA query_only = ON")
+            if self.memory and self.read_only:
+                # Shared-cache connections take table locks the busy timeout
+                # does not retry; readers skip them instead of failing with
+                # "database table is locked" while a write is in progress
+                conn.execute("PRAGMA read_uncommitted = ON")
             # Row factory returns results as dictionaries
             conn.row_factory = self._dict_factory
             
@@ -82,75 +208,200 @@ class ConnectionPool:
             return {}
         return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
     
-    def get_connection(self) -> sqlite3.Connection:
+    def _validate(self, conn: sqlite3.Connection) -> bool:
+        """
+        Check that a connection is still usable.
+        
+        Args:
+            conn: The connection to test
+            
+        Returns:
+            True if the connection answered, False if it is broken
+        """
+        self.validations += 1
+        try:
+            conn.execute("SELECT 1").fetchone()
+            self.suspect.discard(conn)
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        """Close a connection and forget everything the pool knows about it."""
+        self.in_use.discard(conn)
+        self.checkout_info.pop(conn, None)
+        self.suspect.discard(conn)
+        self.idle_since.pop(conn, None)
+        try:
+            conn.close()
+        except:
+            pass
+    
+    def _acquire_nowait(self) -> Optional[sqlite3.Connection]:
+        """
+        Take an idle connection or open a new one if the pool has capacity.
+        Must be called with the lock held.
+        
+        Idle connections are only validated when they have been idle longer
+        than validate_after or were flagged by report_error.
+        
+        Returns:
+            An SQLite connection, or None if the pool is exhausted
+        """
+        now = time.monotonic()
+        while self.connections:
+            conn = self.connections.pop()
+            idle_time = now - self.idle_since.pop(conn, now)
+            if (idle_time > self.validate_after or conn in self.suspect) and not self._validate(conn):
+                # Connection is broken, close it and try the next one
+                self._discard(conn)
+                continue
+            self.in_use.add(conn)
+            return conn
+        
+        # Create a new connection if we haven't reached the limit
+        if len(self.in_use) < self.max_connections:
+            conn = self._create_connection()
+            self.in_use.add(conn)
+            self._start_reaper()
+            return conn
+        
+        return None
+    
+    def get_connection(self, timeout: Optional[float] = None) -> sqlite3.Connection:
         """
         Get a connection from the pool or create a new one if necessary.
         
+        When the pool is exhausted the caller joins a FIFO wait queue and is
+        handed a connection directly by return_connection, so threads are
+        served in arrival order and late arrivals cannot barge ahead.
+        
+        Args:
+            timeout: Seconds to wait for a connection (defaults to the pool timeout)
+        
         Returns:
             An SQLite connection
         
         Raises:
             DatabaseError: If no connection is available within the timeout period
         """
-        attempt = 0
-        max_attempts = 3
+        if timeout is None:
+            timeout = self.timeout
         
-        while attempt < max_attempts:
-            try:
-                with self.lock:
-                    # Try to reuse an existing connection
-                    if self.connections:
-                        conn = self.connections.pop()
-                        # Test the connection before returning it
-                        try:
-                            conn.execute("SELECT 1").fetchone()
-                            self.in_use.add(conn)
-                            return conn
-                        except sqlite3.Error:
-                            # Connection is broken, close it and create a new one
-                            try:
-                                conn.close()
-                            except:
-                                pass
-                    
-                    # Create a new connection if we haven't reached the limit
-                    if len(self.in_use) < self.max_connections:
-                        conn = self._create_connection()
-                        self.in_use.add(conn)
-                        return conn
-                
-                # Wait for a connection to become available
-                start_time = time.time()
-                while time.time() - start_time < self.timeout / max_attempts:
-                    with self.lock:
-                        if self.connections:
-                            conn = self.connections.pop()
-                            try:
-                                conn.execute("SELECT 1").fetchone()
-                                self.in_use.add(conn)
-                                return conn
-                            except sqlite3.Error:
-                                # Connection is broken, close it and try again
-                                try:
-                                    conn.close()
-                                except:
-                                    pass
-                    time.sleep(0.05)
-                
-                attempt += 1
-                
-            except Exception as e:
-                logger.error(f"Error in get_connection (attempt {attempt}): {e}")
-                attempt += 1
-                time.sleep(0.1)
+        with self.lock:
+            self.checkouts += 1
+            
+            # Only take the fast path when nobody is queued ahead of us
+            if not self.waiters:
+                conn = self._acquire_nowait()
+                if conn is not None:
+                    self._record_checkout(conn)
+                    return conn
+            
+            waiter = _Waiter(threading.Condition(self.lock))
+            self.waiters.append(waiter)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.waiters))
+            
+            start_time = time.monotonic()
+            deadline = start_time + timeout
+            while waiter.connection is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                waiter.condition.wait(remaining)
+            
+            waited = time.monotonic() - start_time
+            self.waits += 1
+            self.total_wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            
+            if waiter.connection is None:
+                self.waiters.remove(waiter)
+                self.timeouts += 1
+                logger.warning(
+                    f"Timed out after {waited:.2f}s waiting for a database connection "
+                    f"({len(self.waiters)} still queued)"
+                )
+                raise DatabaseError(f"Could not acquire a database connection within {timeout}s")
+            
+            self._record_checkout(waiter.connection)
+            return waiter.connection
+    
+    def _record_checkout(self, conn: sqlite3.Connection) -> None:
+        """Remember which thread took a connection, and from where, when tracking is on."""
+        if self.track_checkouts:
+            self.checkout_info[conn] = {
+                'thread_id': threading.get_ident(),
+                'thread_name': threading.current_thread().name,
+                'acquired_at': time.monotonic(),
+                'stack': ''.join(traceback.format_stack()[:-2])
+            }
+    
+    def checked_out(self, thread_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        List tracked checkouts, optionally only those made by one thread.
+        
+        Args:
+            thread_id: Thread identifier to filter by
+            
+        Returns:
+            List of checkout records with thread, age in seconds and acquisition stack
+        """
+        with self.lock:
+            now = time.monotonic()
+            return [
+                {
+                    'thread_id': info['thread_id'],
+                    'thread_name': info['thread_name'],
+                    'age': now - info['acquired_at'],
+                    'stack': info['stack']
+                }
+                for conn, info in self.checkout_info.items()
+                if thread_id is None or info['thread_id'] == thread_id
+            ]
+    
+    def _hand_off(self, conn: Optional[sqlite3.Connection] = None) -> bool:
+        """
+        Hand a connection to the longest-waiting thread, if any.
+        Must be called with the lock held.
+        
+        Args:
+            conn: A checked-out connection to transfer, or None to open a new one
+            
+        Returns:
+            True if a waiter was served
+        """
+        if not self.waiters:
+            return False
+        
+        if conn is None:
+            conn = self._create_connection()
+            self.in_use.add(conn)
+        
+        waiter = self.waiters.popleft()
+        waiter.connection = conn
+        waiter.condition.notify()
+        return True
+    
+    def report_error(self, conn: sqlite3.Connection) -> None:
+        """
+        Flag a connection that raised an error so it is validated before reuse.
         
-        # If we've reached here, we couldn't get a connection
-        raise DatabaseError("Could not acquire a database connection after multiple attempts")
+        Args:
+            conn: The connection that saw the error
+        """
+        if conn is None:
+            return
+        with self.lock:
+            self.suspect.add(conn)
     
     def return_connection(self, conn: sqlite3.Connection) -> None:
         """
         Return a connection to the pool.
         
+        If threads are waiting, the connection is passed straight to the
+        head of the queue instead of going back on the idle list.
+        
         Args:
             conn: The connection to return
         """
@@ -159,23 +410,34 @@ class ConnectionPool:
             
         try:
             with self.lock:
+                self.checkout_info.pop(conn, None)
                 if conn in self.in_use:
-                    # Test connection before returning to pool
+                    healthy = True
                     try:
-                        conn.execute("SELECT 1").fetchone()
-                        self.in_use.remove(conn)
-                        # Only keep connections up to max_connections
-                        if len(self.connections) < self.max_connections:
-                            self.connections.append(conn)
-                        else:
-                            conn.close()
+                        # Never hand out a connection with an open transaction
+                        if conn.in_transaction:
+                            conn.rollback()
                     except sqlite3.Error:
+                        healthy = False
+                    
+                    # Only connections that saw an error pay for a round trip
+                    if not healthy or (conn in self.suspect and not self._validate(conn)):
                         # Connection is broken, remove and close
-                        self.in_use.remove(conn)
-                        try:
-                            conn.close()
-                        except:
-                            pass
+                        self._discard(conn)
+                        # The freed slot goes to the next waiter
+                        self._hand_off()
+                        return
+                    
+                    if self._hand_off(conn):
+                        return
+                    
+                    self.in_use.remove(conn)
+                    # Only keep connections up to max_connections
+                    if len(self.connections) < self.max_connections:
+                        self.connections.append(conn)
+                        self.idle_since[conn] = time.monotonic()
+                    else:
+                        self._discard(conn)
                 else:
                     # If the connection isn't tracked, close it
                     try:
@@ -189,8 +451,81 @@ class ConnectionPool:
             except:
                 pass
     
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get pool usage statistics for sizing and monitoring.
+        
+        Returns:
+            Dictionary with connection counts, queue depth and wait times
+        """
+        with self.lock:
+            return {
+                'read_only': self.read_only,
+                'profile': self.profile,
+                'max_connections': self.max_connections,
+                'in_use': len(self.in_use),
+                'idle': len(self.connections),
+                'queue_depth': len(self.waiters),
+                'max_queue_depth': self.max_queue_depth,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'total_wait_time': round(self.total_wait_time, 6),
+                'avg_wait_time': round(self.total_wait_time / self.waits, 6) if self.waits else 0.0,
+                'max_wait_time': round(self.max_wait_time, 6),
+                'validations': self.validations,
+                'reaped': self.reaped
+            }
+    
+    def _start_reaper(self) -> None:
+        """Start the background idle-connection reaper if it isn't running."""
+        if self.max_idle_time <= 0 or (self._reaper is not None and self._reaper.is_alive()):
+            return
+        self._reaper_stop.clear()
+        self._reaper = threading.Thread(
+            target=self._reap_loop,
+            name=f"db-pool-reaper-{os.path.basename(self.database_path)}",
+            daemon=True
+        )
+        self._reaper.start()
+    
+    def _reap_loop(self) -> None:
+        """Reaper thread body: periodically close stale idle connections."""
+        while not self._reaper_stop.wait(self.reap_interval):
+            try:
+                self.reap_idle()
+            except Exception as e:
+                logger.error(f"Error reaping idle connections: {e}")
+    
+    def reap_idle(self, max_idle_time: Optional[float] = None) -> int:
+        """
+        Close idle connections that have not been used for too long.
+        
+        Args:
+            max_idle_time: Idle threshold in seconds (defaults to the pool setting)
+            
+        Returns:
+            Number of connections closed
+        """
+        if max_idle_time is None:
+            max_idle_time = self.max_idle_time
+        
+        with self.lock:
+            now = time.monotonic()
+            stale = [conn for conn in self.connections
+                     if now - self.idle_since.get(conn, now) > max_idle_time]
+            for conn in stale:
+                self.connections.remove(conn)
+                self._discard(conn)
+            self.reaped += len(stale)
+        
+        if stale:
+            logger.debug(f"Reaped {len(stale)} idle connections")
+        return len(stale)
+    
     def close_all(self) -> None:
         """Close all connections in the pool."""
+        self._reaper_stop.set()
         with self.lock:
             # Close all available connections
             for conn in self.connections:
@@ -207,6 +542,9 @@ class ConnectionPool:
                 except Exception as e:
                     logger.error(f"Error closing in-use connection: {e}")
             self.in_use = set()
+            self.idle_since.clear()
+            self.suspect.clear()
+            self.checkout_info.clear()
             
             logger.info("All database connections closed")
 
@@ -218,164 +556,1037 @@ class ConnectionPool:
                 connection.close()
 
 
-class Database:
-    """Database class for managing SQLite database connections and operations."""
+# Row representations returned by query methods. The module-level helpers
+# below always return dicts, because their callers use dict methods.
+ROW_MODES = ('dict', 'row')
+
+def row_to_dict(row) -> Optional[Dict[str, Any]]:
+    """
+    Convert a result row of either row mode to a plain dictionary.
     
-    def __init__(self, database_path=None):
-        """Initialize database connection."""
-        # If database_path is provided, use it directly
-        if database_path:
-            self.database_path = database_path
-        else:
-            # Try to get from Flask app context, or use a default
-            try:
-                from flask import current_app
-                self.database_path = current_app.config['DATABASE_PATH']
-            except (RuntimeError, ImportError):
-                # Working outside of application context, use a default path
-                self.database_path = os.environ.get('DATABASE_PATH', 'instance/poh.sqlite')
+    Args:
+        row: A dict row, an sqlite3.Row, or None
         
-        # Ensure directory exists
-        if self.database_path != ":memory:":
-            os.makedirs(os.path.dirname(self.database_path), exist_ok=True)
+    Returns:
+        Dictionary with column names as keys, or None
+    """
+    if row is None or isinstance(row, dict):
+        return row
+    return dict(zip(row.keys(), row))
+
+class DatabaseJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes compact sqlite3.Row results as objects."""
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, sqlite3.Row):
+            return row_to_dict(o)
+        return DefaultJSONProvider.default(o)
+
+def resolve_database_path(database_path: Optional[str] = None) -> str:
+    """
+    Work out which database file to use.
+    
+    Args:
+        database_path: Explicit path, if any
         
-        # Create a connection pool for this database
-        self.pool = ConnectionPool(self.database_path)
+    Returns:
+        The explicit path, else DATABASE_PATH from the Flask config or environment
+    """
+    if database_path:
+        return database_path
+    try:
+        from flask import current_app
+        configured = current_app.config.get('DATABASE_PATH')
+        if configured:
+            return configured
+    except (RuntimeError, ImportError):
+        # Working outside of application context, use a default path
+        pass
+    return os.environ.get('DATABASE_PATH', 'instance/poh.sqlite')
+
+def is_memory_database(database_path: str) -> bool:
+    """
+    Check whether a database path names an in-memory database.
+    
+    Args:
+        database_path: Path or SQLite URI
         
-        # Thread-local storage for connections outside Flask context
-        self.local = threading.local()
+    Returns:
+        True for ':memory:' and for file: URIs with mode=memory or ':memory:'
+    """
+    if database_path == ":memory:":
+        return True
+    return database_path.startswith("file:") and (
+        "mode=memory" in database_path or database_path.startswith("file::memory:")
+    )
+
+def memory_database_uri(name: Optional[str] = None) -> str:
+    """
+    Build the URI of a named, shared-cache in-memory database.
     
-    def get_db(self):
-        """
-        Get a database connection.
-        If we're in a Flask context, use g, otherwise use the connection pool.
-        """
-        try:
-            # Try to get db from Flask's g object
-            from flask import g, current_app
-            if 'db' not in g:
-                g.db = self.pool.get_connection()
-            return g.db
-        except (RuntimeError, ImportError):
-            # Working outside of Flask context, use thread-local storage
-            if not hasattr(self.local, 'db'):
-                self.local.db = self.pool.get_connection()
-            return self.local.db
+    Every connection in the process that opens the URI sees the same
+    database, which lives until the last of those connections closes.
+    
+    Args:
+        name: Database name (defaults to a unique one)
+        
+    Returns:
+        A file: URI for Database/ConnectionPool
+    """
+    return f"file:{name or 'poh-' + uuid.uuid4().hex}?mode=memory&cache=shared"
 
-    def cursor(self):
-        """Get a cursor for the current database connection."""
-        return self.get_db().cursor()
+# Literals stripped from statements to group them by shape
+_FINGERPRINT_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_FINGERPRINT_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_FINGERPRINT_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_FINGERPRINT_SPACE_RE = re.compile(r'\s+')
+# Statements EXPLAIN QUERY PLAN can describe
+_EXPLAINABLE_QUERY_RE = re.compile(r'^\s*(SELECT|WITH|VALUES|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+def query_fingerprint(query: str) -> str:
+    """
+    Normalize a statement so executions that differ only in literals,
+    IN-list length or whitespace share one fingerprint.
+    
+    Args:
+        query: SQL statement
+        
+    Returns:
+        Normalized SQL
+    """
+    fingerprint = _FINGERPRINT_STRING_RE.sub('?', query)
+    fingerprint = _FINGERPRINT_NUMBER_RE.sub('?', fingerprint)
+    fingerprint = _FINGERPRINT_LIST_RE.sub('(?+)', fingerprint)
+    return _FINGERPRINT_SPACE_RE.sub(' ', fingerprint).strip()
 
-    def execute_query(self, query: str, params: tuple = None) -> None:
+class QueryStats:
+    """
+    Per-statement latency and row statistics, aggregated by fingerprint.
+    
+    Executions slower than ``slow_threshold`` seconds are logged and have
+    their EXPLAIN QUERY PLAN captured on the connection that ran them.
+    """
+    
+    # Distinct statement texts whose fingerprints are memoized
+    FINGERPRINT_CACHE_SIZE = 1024
+    
+    def __init__(self, slow_threshold: float = 0.1):
         """
-        Execute a query without returning results.
+        Initialize query statistics.
         
         Args:
-            query: SQL query to execute
-            params: Query parameters (optional)
+            slow_threshold: Seconds above which a query is considered slow
         """
-        try:
-            with self.get_db() as conn:
-                cursor = conn.cursor()
-                if params:
-                    cursor.execute(query, params)
-                else:
-                    cursor.execute(query)
-                conn.commit()
-        except sqlite3.Error as e:
-            logger.error(f"Error executing query: {e}")
-            raise DatabaseError(f"Failed to execute query: {e}")
-
-    def execute_query_fetch_one(self, query: str, params: tuple = None) -> Optional[dict]:
+        self.slow_threshold = slow_threshold
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.fingerprints = {}
+    
+    def fingerprint(self, query: str) -> str:
+        """Get the (memoized) fingerprint of a statement."""
+        fingerprint = self.fingerprints.get(query)
+        if fingerprint is None:
+            fingerprint = query_fingerprint(query)
+            if len(self.fingerprints) < self.FINGERPRINT_CACHE_SIZE:
+                self.fingerprints[query] = fingerprint
+        return fingerprint
+    
+    def record(self, query: str, elapsed: float, rows: int,
+               conn: Optional[sqlite3.Connection] = None, params=None) -> None:
         """
-        Execute a query and return a single result.
+        Record one execution of a statement.
         
         Args:
-            query: SQL query to execute
-            params: Query parameters (optional)
+            query: SQL statement that ran
+            elapsed: Seconds spent executing and fetching
+            rows: Rows returned (or affected, for writes)
+            conn: Connection the statement ran on, used to EXPLAIN slow queries
+            params: Parameters the statement ran with
+        """
+        fingerprint = self.fingerprint(query)
+        slow = elapsed >= self.slow_threshold
+        
+        with self.lock:
+            entry = self.queries.get(fingerprint)
+            if entry is None:
+                entry = self.queries[fingerprint] = {
+                    'fingerprint': fingerprint,
+                    'count': 0,
+                    'total_time': 0.0,
+                    'max_time': 0.0,
+                    'total_rows': 0,
+                    'max_rows': 0,
+                    'slow_count': 0,
+                    'plan': None,
+                }
+            entry['count'] += 1
+            entry['total_time'] += elapsed
+            entry['max_time'] = max(entry['max_time'], elapsed)
+            entry['total_rows'] += rows
+            entry['max_rows'] = max(entry['max_rows'], rows)
+            if slow:
+                entry['slow_count'] += 1
+            capture_plan = slow and entry['plan'] is None
+        
+        if slow:
+            logger.warning(f"Slow query ({elapsed * 1000:.1f} ms, {rows} rows): {fingerprint}")
+        if capture_plan and conn is not None:
+            plan = self.explain(conn, query, params)
+            if plan is not None:
+                with self.lock:
+                    entry['plan'] = plan
+    
+    @staticmethod
+    def explain(conn: sqlite3.Connection, query: str, params=None) -> Optional[List[str]]:
+        """
+        Get the EXPLAIN QUERY PLAN of a statement.
+        
+        Args:
+            conn: Connection to explain the statement on
+            query: SQL statement
+            params: Statement parameters
             
         Returns:
-            A single row as a dictionary, or None if no results
+            Plan steps, indented by depth, or None if the statement cannot be explained
         """
+        if not _EXPLAINABLE_QUERY_RE.match(query):
+            return None
         try:
-            with self.get_db() as conn:
-                cursor = conn.cursor()
-                if params:
-                    cursor.execute(query, params)
-                else:
-                    cursor.execute(query)
-                result = cursor.fetchone()
-                return result
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(f"EXPLAIN QUERY PLAN {query}", params or ())
+            depth = {0: -1}
+            plan = []
+            for node_id, parent, _, detail in cursor.fetchall():
+                depth[node_id] = depth.get(parent, -1) + 1
+                plan.append("  " * depth[node_id] + detail)
+            return plan
         except sqlite3.Error as e:
-            logger.error(f"Error executing query: {e}")
-            raise DatabaseError(f"Failed to execute query: {e}")
-
-    def execute_query_fetch_all(self, query: str, params: tuple = None) -> List[dict]:
+            logger.debug(f"Could not explain query: {e}")
+            return None
+    
+    def snapshot(self, sort_by: str = 'total_time', limit: Optional[int] = None) -> List[Dict[str, Any]]:
         """
-        Execute a query and return all results.
+        Get the aggregated statistics.
         
         Args:
-            query: SQL query to execute
-            params: Query parameters (optional)
+            sort_by: Field to sort by, descending (e.g. 'total_time', 'max_time', 'count')
+            limit: Maximum number of fingerprints to return
             
         Returns:
-            List of rows as dictionaries
+            List of per-fingerprint statistics with averages filled in
         """
-        try:
-            with self.get_db() as conn:
-                cursor = conn.cursor()
-                if params:
-                    cursor.execute(query, params)
-                else:
-                    cursor.execute(query)
-                return cursor.fetchall()
-        except sqlite3.Error as e:
-            logger.error(f"Error executing query: {e}")
-            raise DatabaseError(f"Failed to execute query: {e}")
+        with self.lock:
+            entries = [dict(entry) for entry in self.queries.values()]
+        for entry in entries:
+            entry['avg_time'] = entry['total_time'] / entry['count']
+            entry['avg_rows'] = entry['total_rows'] / entry['count']
+        entries.sort(key=lambda entry: entry[sort_by], reverse=True)
+        return entries[:limit] if limit else entries
+    
+    def reset(self) -> None:
+        """Discard all recorded statistics."""
+        with self.lock:
+            self.queries.clear()
+
+class UserCache:
+    """
+    Thread-safe LRU cache of user rows with a time-to-live.
     
-    def __enter__(self):
-        """Context manager entry."""
-        self.conn = self.get_db()
-        return self.conn
+    Rows are keyed by id, with a secondary email -> id index so both lookup
+    helpers share one entry per user. Only found users are cached. Every
+    invalidation bumps a generation counter, and a row loaded while the
+    counter moved is not stored: it may predate the write that invalidated
+    it.
+    """
     
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Context manager exit."""
-        if hasattr(self, 'conn'):
-            self.pool.return_connection(self.conn)
-            del self.conn
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0):
+        """
+        Initialize the cache.
+        
+        Args:
+            max_size: Users kept before the least recently used is evicted
+            ttl: Seconds a cached row is served before it is reloaded
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # user id -> (row, expires_at)
+        self.emails = {}  # lower-cased email -> user id
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def _lookup(self, user_id: int):
+        """Get a live entry's row and mark it recently used (lock held)."""
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        row, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(user_id)
+            return None
+        self.entries.move_to_end(user_id)
+        return row
     
-    def close(self):
-        """Close the database connection."""
-        try:
-            # Try to use Flask application context if available
-            from flask import g
-            if hasattr(g, 'db_conn') and g.db_conn is not None:
-                g.db_conn.close()
-                g.db_conn = None
-        except (RuntimeError, ImportError):
-            # Not in Flask context, return connection to pool if we have one
-            if hasattr(self.local, 'conn') and self.local.conn is not None:
-                self.pool.return_connection(self.local.conn)
-                self.local.conn = None
-        except Exception as e:
-            # Log but don't raise - closing should be silent
-            logger.error(f"Error closing database connection: {e}")
+    @staticmethod
+    def _email(row) -> Optional[str]:
+        """Get a row's email, if it was selected."""
+        return row['email'] if 'email' in row.keys() else None
     
-    def init_db(self, schema_path=None):
-        """Initialize the database with the schema."""
-        connection = None
-        try:
-            connection = self.get_db()
-            
-            if schema_path is None:
-                schema_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'schema.sql')
+    def _remove(self, user_id: int) -> None:
+        """Drop an entry and its email index (lock held)."""
+        row, _ = self.entries.pop(user_id, (None, None))
+        if row is not None and self.emails.get(self._email(row)) == user_id:
+            del self.emails[self._email(row)]
+    
+    def _copy(self, row):
+        """Give each caller its own dict so cached rows cannot be mutated."""
+        return dict(row) if isinstance(row, dict) else row
+    
+    def get(self, key, loader: Callable, by_email: bool = False):
+        """
+        Get a user row, loading and caching it on a miss.
+        
+        Args:
+            key: User id, or lower-cased email when by_email is set
+            loader: Callable returning the row (or None) from the database
+            by_email: Whether key is an email
             
-            with open(schema_path, 'r') as f:
-                connection.executescript(f.read())
-                connection.commit()
-                
-            logger.info("Database initialized successfully")
-        except Exception as e:
+        Returns:
+            User row or None if not found
+        """
+        with self.lock:
+            user_id = self.emails.get(key) if by_email else key
+            row = self._lookup(user_id) if user_id is not None else None
+            if row is not None:
+                self.hits += 1
+                return self._copy(row)
+            self.misses += 1
+            generation = self.generation
+        
+        row = loader()
+        if row is None:
+            return None
+        
+        with self.lock:
+            if self.generation == generation:
+                user_id = row['id']
+                self._remove(user_id)
+                self.entries[user_id] = (row, time.monotonic() + self.ttl)
+                email = self._email(row)
+                if email is not None:
+                    self.emails[email] = user_id
+                while len(self.entries) > self.max_size:
+                    self._remove(next(iter(self.entries)))
+                    self.evictions += 1
+        return self._copy(row)
+    
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """
+        Drop a user (or, with no id, every user) from the cache.
+        
+        Args:
+            user_id: User to drop
+        """
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            if user_id is None:
+                self.entries.clear()
+                self.emails.clear()
+            else:
+                self._remove(user_id)
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache counters.
+        
+        Returns:
+            Dictionary with size, hits, misses, hit_rate, evictions and invalidations
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+class _GroupCommitItem:
+    """A write queued in GroupCommitWriter.submit."""
+    __slots__ = ('func', 'args', 'kwargs', 'future')
+    
+    def __init__(self, func: Callable, args: tuple, kwargs: dict):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+class GroupCommitWriter:
+    """
+    Coalesce concurrent writes into shared transactions.
+    
+    Writes submitted from any thread are queued. A background thread collects
+    them for up to ``window`` seconds (or until ``max_batch`` are queued) and
+    applies the batch in one transaction on the database's writer, so a burst
+    of small writes pays for one commit instead of one each. Every write runs
+    in its own SAVEPOINT: a failing write is rolled back on its own and only
+    its caller sees the error. Callers are resolved after the commit, so a
+    successful result is durable.
+    """
+    
+    def __init__(self, database: 'Database', window: float = 0.002, max_batch: int = 64):
+        """
+        Initialize the group commit writer.
+        
+        Args:
+            database: Database whose transactions the batches run in
+            window: Seconds to wait for more writes after the first one arrives
+            max_batch: Maximum number of writes applied per transaction
+        """
+        self.database = database
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = None
+        
+        # Counters exposed through stats()
+        self.batches = 0
+        self.writes = 0
+        self.failed_writes = 0
+        self.max_batch_seen = 0
+    
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Queue a write for the next batch.
+        
+        ``func`` runs on the writer thread inside the batch transaction, so any
+        Database method or helper it calls joins that transaction.
+        
+        Args:
+            func: Callable performing the write
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+            
+        Returns:
+            Future resolved with func's return value (or exception) after commit
+        """
+        item = _GroupCommitItem(func, args, kwargs)
+        with self.condition:
+            if self.stopping:
+                raise DatabaseError("Group commit writer is stopped")
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="db-group-commit", daemon=True)
+                self.thread.start()
+            self.pending.append(item)
+            self.condition.notify()
+        return item.future
+    
+    def _next_batch(self) -> List[_GroupCommitItem]:
+        """Wait for writes and collect the next batch (empty when stopping)."""
+        with self.condition:
+            while not self.pending and not self.stopping:
+                self.condition.wait()
+            
+            # Give concurrent writers a short window to join this batch
+            deadline = time.time() + self.window
+            while len(self.pending) < self.max_batch and not self.stopping:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            
+            return [self.pending.popleft() for _ in range(min(len(self.pending), self.max_batch))]
+    
+    def _run(self) -> None:
+        """Writer thread: apply batches until stopped and drained."""
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._commit(batch)
+    
+    def _commit(self, batch: List[_GroupCommitItem]) -> None:
+        """Apply one batch in a single transaction and resolve its futures."""
+        outcomes = []
+        try:
+            with self.database.transaction():
+                for item in batch:
+                    if not item.future.set_running_or_notify_cancel():
+                        outcomes.append(None)
+                        continue
+                    try:
+                        with self.database.transaction():
+                            outcomes.append((True, item.func(*item.args, **item.kwargs)))
+                    except Exception as e:
+                        outcomes.append((False, e))
+        except Exception as e:
+            logger.error(f"Group commit of {len(batch)} writes failed: {e}")
+            error = e if isinstance(e, DatabaseError) else DatabaseError(f"Group commit failed: {e}")
+            for item in batch:
+                if item.future.running():
+                    item.future.set_exception(error)
+            self.failed_writes += len(batch)
+            return
+        
+        self.batches += 1
+        self.writes += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        for item, outcome in zip(batch, outcomes):
+            if outcome is None:
+                continue
+            ok, value = outcome
+            if ok:
+                item.future.set_result(value)
+            else:
+                self.failed_writes += 1
+                item.future.set_exception(value)
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get batching statistics.
+        
+        Returns:
+            Dictionary with batch and write counters
+        """
+        with self.condition:
+            queued = len(self.pending)
+        return {
+            'window': self.window,
+            'max_batch': self.max_batch,
+            'queued': queued,
+            'batches': self.batches,
+            'writes': self.writes,
+            'failed_writes': self.failed_writes,
+            'avg_batch_size': self.writes / self.batches if self.batches else 0.0,
+            'max_batch_size': self.max_batch_seen,
+        }
+    
+    def stop(self) -> None:
+        """Apply any queued writes and stop the writer thread."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+            thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+class Database:
+    """Database class for managing SQLite database connections and operations."""
+    
+    def __init__(self, database_path=None, read_write_split=None, readers=None, track_leaks=None,
+                 row_mode=None, group_commit=None, query_stats=None, user_cache=None,
+                 foreign_keys=True, profile=None):
+        """
+        Initialize database connection.
+        
+        An in-memory database (':memory:' or a memory_database_uri()) is opened
+        in shared-cache mode so every pooled connection sees the same data, and
+        is kept alive by an anchor connection until close_pools(). It always
+        runs in read/write split mode, and its readers use read_uncommitted
+        (they see writes in progress) since shared-cache locks are not retried.
+        
+        Args:
+            database_path: Path to the SQLite database file
+            read_write_split: Use one dedicated writer connection plus read-only
+                reader connections (defaults to DATABASE_READ_WRITE_SPLIT)
+            readers: Number of reader connections in split mode (defaults to DATABASE_READERS)
+            track_leaks: Record checkout stacks and report connections still held
+                when a request or thread scope closes (defaults to DEBUG)
+            row_mode: 'dict' for a dict per row, or 'row' for compact tuple-backed
+                sqlite3.Row results with named access (defaults to DATABASE_ROW_MODE)
+            group_commit: Coalesce writes from concurrent callers into shared
+                transactions (defaults to DATABASE_GROUP_COMMIT)
+            query_stats: Record per-statement latency and rows, and EXPLAIN slow
+                statements (defaults to DATABASE_QUERY_STATS)
+            user_cache: Number of users kept by the read-through user cache behind
+                get_user_by_id()/get_user_by_email(), 0 to disable (defaults to
+                DATABASE_USER_CACHE_SIZE)
+            foreign_keys: Enforce foreign key constraints (off for shards of a
+                sharded database, whose rows reference users on other shards)
+            profile: Hardware PRAGMA profile for the pools, or 'auto' to size it
+                from usable memory (defaults to DATABASE_PROFILE)
+        """
+        try:
+            from flask import current_app
+            config = current_app.config
+        except (RuntimeError, ImportError):
+            # Working outside of application context
+            config = {}
+        
+        self.database_path = resolve_database_path(database_path)
+        
+        # Every pooled connection to ':memory:' would open its own empty
+        # database, so use a named shared-cache database instead
+        self.anchor = None
+        if self.database_path == ":memory:":
+            self.database_path = memory_database_uri()
+        if is_memory_database(self.database_path):
+            self.anchor = sqlite3.connect(self.database_path, uri=True, check_same_thread=False)
+        
+        if read_write_split is None:
+            read_write_split = config.get(
+                'DATABASE_READ_WRITE_SPLIT',
+                os.environ.get('DATABASE_READ_WRITE_SPLIT', '').lower() in ('1', 'true', 'yes')
+            )
+        if readers is None:
+            readers = int(config.get('DATABASE_READERS', os.environ.get('DATABASE_READERS', 4)))
+        if track_leaks is None:
+            track_leaks = config.get('DEBUG', False)
+        self.track_leaks = bool(track_leaks)
+        if row_mode is None:
+            row_mode = config.get('DATABASE_ROW_MODE', os.environ.get('DATABASE_ROW_MODE', 'dict'))
+        if row_mode not in ROW_MODES:
+            raise ValueError(f"Unknown row mode {row_mode!r}, expected one of {ROW_MODES}")
+        self.row_mode = row_mode
+        # Rows fetched per round trip by the streaming fetch_iter()/iter_query()
+        self.arraysize = int(config.get('DATABASE_ARRAYSIZE', os.environ.get('DATABASE_ARRAYSIZE', 500)))
+        # Rows handed to each executemany() call by bulk_insert()/bulk_update()
+        self.bulk_chunk_size = int(config.get('DATABASE_BULK_CHUNK_SIZE', os.environ.get('DATABASE_BULK_CHUNK_SIZE', 500)))
+        if query_stats is None:
+            query_stats = config.get(
+                'DATABASE_QUERY_STATS',
+                os.environ.get('DATABASE_QUERY_STATS', 'true').lower() in ('1', 'true', 'yes')
+            )
+        self.query_stats = None
+        if query_stats:
+            slow_ms = float(config.get('DATABASE_SLOW_QUERY_MS', os.environ.get('DATABASE_SLOW_QUERY_MS', 100)))
+            self.query_stats = QueryStats(slow_threshold=slow_ms / 1000.0)
+        if user_cache is None:
+            user_cache = int(config.get('DATABASE_USER_CACHE_SIZE', os.environ.get('DATABASE_USER_CACHE_SIZE', 1024)))
+        self.user_cache = None
+        if user_cache:
+            ttl = float(config.get('DATABASE_USER_CACHE_TTL', os.environ.get('DATABASE_USER_CACHE_TTL', 30)))
+            self.user_cache = UserCache(max_size=int(user_cache), ttl=ttl)
+        
+        # Ensure directory exists
+        if self.anchor is None and not self.database_path.startswith("file:"):
+            os.makedirs(os.path.dirname(self.database_path), exist_ok=True)
+        
+        # Shared-cache writers fail on each other's table locks instead of
+        # waiting, so an in-memory database always queues for a single writer
+        self.read_write_split = bool(read_write_split) or self.anchor is not None
+        if self.read_write_split:
+            # A single writer connection; writers queue for it in FIFO order,
+            # which serializes writes without SQLITE_BUSY contention
+            self.pool = ConnectionPool(self.database_path, max_connections=1,
+                                       track_checkouts=self.track_leaks, foreign_keys=foreign_keys,
+                                       profile=profile)
+            # WAL readers never block the writer or each other
+            self.read_pool = ConnectionPool(self.database_path, max_connections=readers,
+                                            read_only=True, track_checkouts=self.track_leaks,
+                                            foreign_keys=foreign_keys, profile=profile)
+        else:
+            # Create a connection pool for this database
+            self.pool = ConnectionPool(self.database_path, track_checkouts=self.track_leaks,
+                                       foreign_keys=foreign_keys, profile=profile)
+            self.read_pool = self.pool
+        
+        # Thread-local storage for transactions and for connections outside Flask context
+        self.local = threading.local()
+        
+        if group_commit is None:
+            group_commit = config.get(
+                'DATABASE_GROUP_COMMIT',
+                os.environ.get('DATABASE_GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+            )
+        self.group_commit = None
+        if group_commit:
+            self.group_commit = GroupCommitWriter(
+                self,
+                window=float(config.get('DATABASE_GROUP_COMMIT_WINDOW', 0.002)),
+                max_batch=int(config.get('DATABASE_GROUP_COMMIT_BATCH', 64))
+            )
+        
+        # The options this instance was opened with, after applying the
+        # config defaults, so get_database() can refuse conflicting requests
+        self.settings = {
+            'read_write_split': bool(read_write_split),
+            'readers': int(readers),
+            'track_leaks': self.track_leaks,
+            'row_mode': self.row_mode,
+            'group_commit': bool(group_commit),
+            'query_stats': bool(query_stats),
+            'user_cache': int(user_cache),
+            'foreign_keys': bool(foreign_keys),
+            'profile': profile
+        }
+    
+    def _scoped_connections(self) -> Dict[str, sqlite3.Connection]:
+        """
+        Get the connections pinned to the current scope by get_db().
+        
+        Inside a Flask app context the scope is the request (stored on g,
+        keyed by this database so g.db is left alone); otherwise it is the
+        current thread.
+        
+        Returns:
+            Mutable mapping of role ('write' or 'read') to connection
+        """
+        if has_app_context():
+            scopes = g.setdefault('_database_connections', {})
+            return scopes.setdefault(id(self), {})
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+        return self.local.connections
+    
+    def get_db(self, readonly: bool = False):
+        """
+        Get a database connection pinned to the current request or thread.
+        
+        The connection stays checked out until close() is called, which the
+        app does at request teardown. Prefer the query methods, which only
+        hold a connection for the duration of one operation.
+        
+        Args:
+            readonly: Pin a reader instead of the writer (split mode)
+        """
+        connections = self._scoped_connections()
+        role = 'read' if readonly else 'write'
+        if role not in connections:
+            pool = self.read_pool if readonly else self.pool
+            connections[role] = pool.get_connection()
+        return connections[role]
+    
+    @contextmanager
+    def _connection(self, readonly: bool = False):
+        """
+        Provide the connection a single operation should run on.
+        
+        An open transaction pins its connection to the thread so the
+        transaction sees its own writes. Otherwise reads check out a reader,
+        writes check out (or, in split mode, queue for) the writer, and the
+        connection goes back to its pool as soon as the operation finishes.
+        Database instances are shared process-wide, so operations must never
+        hold on to a pooled connection.
+        
+        Args:
+            readonly: Whether the operation only reads data
+        """
+        pool = self.pool
+        if getattr(self.local, 'writer', None) is not None:
+            conn, pinned = self.local.writer, True
+        else:
+            if readonly:
+                pool = self.read_pool
+            conn, pinned = pool.get_connection(), False
+        
+        try:
+            yield conn
+        except sqlite3.Error:
+            # Have the pool validate this connection before it is reused
+            pool.report_error(conn)
+            raise
+        finally:
+            if not pinned:
+                pool.return_connection(conn)
+    
+    def _cursor(self, conn: sqlite3.Connection, row_mode: Optional[str] = None) -> sqlite3.Cursor:
+        """
+        Open a cursor that produces rows in the requested representation.
+        
+        Args:
+            conn: Connection to open the cursor on
+            row_mode: Override for this database's row mode
+        """
+        cursor = conn.cursor()
+        if (row_mode or self.row_mode) == 'row':
+            # sqlite3.Row keeps the values in a tuple and shares the column
+            # names with the cursor, instead of building a dict per row
+            cursor.row_factory = sqlite3.Row
+        return cursor
+    
+    def _record_query(self, conn: sqlite3.Connection, query: str, params, start: float, rows: int) -> None:
+        """
+        Record a finished statement in the query statistics (if enabled).
+        
+        Args:
+            conn: Connection the statement ran on
+            query: SQL statement
+            params: Statement parameters
+            start: time.perf_counter() value taken before execution
+            rows: Rows returned (or affected, for writes)
+        """
+        if self.query_stats is not None:
+            self.query_stats.record(query, time.perf_counter() - start, rows, conn=conn, params=params)
+    
+    def close_pools(self) -> None:
+        """
+        Close every connection held by this database's pools.
+        
+        For an in-memory database this also closes the anchor connection,
+        which discards the database.
+        """
+        if self.group_commit is not None:
+            self.group_commit.stop()
+        self.pool.close_all()
+        if self.read_pool is not self.pool:
+            self.read_pool.close_all()
+        if self.anchor is not None:
+            self.anchor.close()
+            self.anchor = None
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Get usage statistics for the pools behind this database.
+        
+        Returns:
+            Dictionary with writer pool stats and, in split mode, reader pool
+            stats, in group commit mode, batching stats and, with the user
+            cache enabled, its counters
+        """
+        stats = {'pool': self.pool.stats()}
+        if self.read_write_split:
+            stats['read_pool'] = self.read_pool.stats()
+        if self.group_commit is not None:
+            stats['group_commit'] = self.group_commit.stats()
+        if self.user_cache is not None:
+            stats['user_cache'] = self.user_cache.stats()
+        return stats
+    
+    def invalidate_user(self, user_id: Optional[int] = None) -> None:
+        """
+        Drop a user from the user cache after a write to the users table.
+        
+        Inside a transaction the invalidation is deferred until the outer
+        transaction ends, so other threads cannot reload the row before the
+        write is visible to them.
+        
+        Args:
+            user_id: User that changed (None drops every cached user)
+        """
+        if self.user_cache is None:
+            return
+        if getattr(self.local, 'writer', None) is not None:
+            self.local.invalidations.append(user_id)
+        else:
+            self.user_cache.invalidate(user_id)
+    
+    def submit_write(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Run a write, batched with concurrent writes when group commit is enabled.
+        
+        Without group commit (or when already inside a transaction on this
+        thread) func runs immediately in its own transaction.
+        
+        Args:
+            func: Callable performing the write
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+            
+        Returns:
+            Future resolved with func's return value (or exception) after commit
+        """
+        if self.group_commit is not None and getattr(self.local, 'writer', None) is None:
+            return self.group_commit.submit(func, *args, **kwargs)
+        
+        future = Future()
+        try:
+            with self.transaction():
+                future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def cursor(self):
+        """Get a cursor for the current database connection."""
+        return self.get_db().cursor()
+
+    def execute_query(self, query: str, params: tuple = None) -> Optional[int]:
+        """
+        Execute a query without returning results.
+        
+        Outside a transaction the statement commits on its own; inside
+        transaction() it becomes part of that transaction.
+        
+        Args:
+            query: SQL query to execute
+            params: Query parameters (optional)
+            
+        Returns:
+            The first value of a RETURNING clause, the new row id for an
+            INSERT, or the number of affected rows otherwise
+        """
+        if self.group_commit is not None and not is_read_query(query) \
+                and getattr(self.local, 'writer', None) is None:
+            # Commit together with writes from concurrent callers
+            return self.group_commit.submit(self.execute_query, query, params).result()
+        
+        try:
+            with self._connection(is_read_query(query)) as conn:
+                cursor = conn.cursor()
+                start = time.perf_counter()
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                if cursor.description is not None:
+                    row = cursor.fetchone()
+                    # Drain the statement so it completes before commit
+                    rest = cursor.fetchall()
+                    self._record_query(conn, query, params, start, len(rest) + (row is not None))
+                    if row is None:
+                        return None
+                    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+                self._record_query(conn, query, params, start, max(cursor.rowcount, 0))
+                if _INSERT_QUERY_RE.match(query):
+                    return cursor.lastrowid
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Error executing query: {e}")
+            raise DatabaseError(f"Failed to execute query: {e}")
+
+    def execute_query_fetch_one(self, query: str, params: tuple = None, row_mode: str = None) -> Optional[dict]:
+        """
+        Execute a query and return a single result.
+        
+        Args:
+            query: SQL query to execute
+            params: Query parameters (optional)
+            row_mode: Row representation override (optional)
+            
+        Returns:
+            A single row as a dictionary, or None if no results
+        """
+        try:
+            with self._connection(is_read_query(query)) as conn:
+                cursor = self._cursor(conn, row_mode)
+                start = time.perf_counter()
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                result = cursor.fetchone()
+                self._record_query(conn, query, params, start, int(result is not None))
+                return result
+        except sqlite3.Error as e:
+            logger.error(f"Error executing query: {e}")
+            raise DatabaseError(f"Failed to execute query: {e}")
+
+    def execute_query_fetch_all(self, query: str, params: tuple = None, row_mode: str = None) -> List[dict]:
+        """
+        Execute a query and return all results.
+        
+        Args:
+            query: SQL query to execute
+            params: Query parameters (optional)
+            row_mode: Row representation override (optional)
+            
+        Returns:
+            List of rows as dictionaries
+        """
+        try:
+            with self._connection(is_read_query(query)) as conn:
+                cursor = self._cursor(conn, row_mode)
+                start = time.perf_counter()
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                rows = cursor.fetchall()
+                self._record_query(conn, query, params, start, len(rows))
+                return rows
+        except sqlite3.Error as e:
+            logger.error(f"Error executing query: {e}")
+            raise DatabaseError(f"Failed to execute query: {e}")
+    
+    def iter_query(self, query: str, params: tuple = None, arraysize: int = None,
+                   row_mode: str = None):
+        """
+        Execute a query and yield its results without materializing them.
+        
+        Same as fetch_iter(), but errors are raised as DatabaseError like the
+        other execute_query_* methods.
+        
+        Args:
+            query: SQL query to execute
+            params: Query parameters (optional)
+            arraysize: Rows fetched per batch (defaults to DATABASE_ARRAYSIZE)
+            row_mode: Row representation override (optional)
+            
+        Yields:
+            Rows as dictionaries
+        """
+        try:
+            yield from self.fetch_iter(query, params, arraysize=arraysize, row_mode=row_mode)
+        except sqlite3.Error as e:
+            logger.error(f"Error executing query: {e}")
+            raise DatabaseError(f"Failed to execute query: {e}")
+    
+    def __enter__(self):
+        """Context manager entry."""
+        return self.get_db()
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Context manager exit."""
+        self.close()
+    
+    def close(self):
+        """
+        Return every connection pinned to the current request or thread.
+        
+        In leak-tracking mode, connections this thread still holds afterwards
+        are reported together with the stack that acquired them.
+        """
+        try:
+            connections = self._scoped_connections()
+            for role, conn in list(connections.items()):
+                pool = self.read_pool if role == 'read' else self.pool
+                pool.return_connection(conn)
+            connections.clear()
+        except Exception as e:
+            # Log but don't raise - closing should be silent
+            logger.error(f"Error closing database connection: {e}")
+        
+        if self.track_leaks and getattr(self.local, 'writer', None) is None:
+            self.report_leaks(threading.get_ident())
+    
+    def report_leaks(self, thread_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Log connections that are still checked out (requires track_leaks).
+        
+        Args:
+            thread_id: Only report connections acquired by this thread
+            
+        Returns:
+            List of leaked checkout records
+        """
+        leaks = self.pool.checked_out(thread_id)
+        if self.read_pool is not self.pool:
+            leaks += self.read_pool.checked_out(thread_id)
+        for leak in leaks:
+            logger.warning(
+                f"Leaked database connection held by thread {leak['thread_name']} "
+                f"for {leak['age']:.2f}s, acquired at:\n{leak['stack']}"
+            )
+        return leaks
+    
+    def init_db(self, schema_path=None):
+        """Initialize the database with the schema."""
+        connection = None
+        try:
+            connection = self.get_db()
+            
+            if schema_path is None:
+                schema_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'schema.sql')
+            
+            with open(schema_path, 'r') as f:
+                connection.executescript(f.read())
+                connection.commit()
+                
+            logger.info("Database initialized successfully")
+        except Exception as e:
             logger.error(f"Error initializing database: {e}")
             if connection:
                 connection.rollback()
@@ -385,34 +1596,220 @@ class Database:
     
     @contextmanager
     def transaction(self):
-        """Context manager for database transactions."""
-        connection = None
+        """
+        Context manager for database transactions.
+        
+        The transaction runs on a writer connection that stays pinned to the
+        current thread until it commits or rolls back, and every query method
+        called inside it joins the transaction instead of committing on its
+        own. The write lock is taken up front (BEGIN IMMEDIATE) so the
+        transaction cannot fail half way through on a lock upgrade.
+        
+        Transactions are re-entrant: a nested transaction() opens a SAVEPOINT
+        that is released into the outer transaction on success or rolled back
+        on its own on error, leaving the outer transaction usable.
+        """
+        connection = getattr(self.local, 'writer', None)
+        if connection is not None:
+            depth = getattr(self.local, 'savepoints', 0) + 1
+            self.local.savepoints = depth
+            savepoint = f"sp_{depth}"
+            pending = len(self.local.after_commit)
+            connection.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield connection
+            except Exception:
+                # Work rolled back with the savepoint must not run on commit
+                del self.local.after_commit[pending:]
+                if connection.in_transaction:
+                    connection.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                    connection.execute(f"RELEASE SAVEPOINT {savepoint}")
+                raise
+            else:
+                connection.execute(f"RELEASE SAVEPOINT {savepoint}")
+            finally:
+                self.local.savepoints = depth - 1
+            return
+        
+        connection = self.pool.get_connection()
+        self.local.writer = connection
+        self.local.savepoints = 0
+        self.local.invalidations = []
+        self.local.after_commit = []
+        committed = False
         try:
-            connection = self.get_db()
+            connection.execute("BEGIN IMMEDIATE")
             yield connection
             connection.commit()
+            committed = True
         except Exception as e:
             logger.error(f"Transaction error: {e}")
-            if connection:
-                connection.rollback()
+            if isinstance(e, sqlite3.Error):
+                self.pool.report_error(connection)
+            connection.rollback()
             raise
         finally:
-            self.close()
+            self.local.writer = None
+            self.pool.return_connection(connection)
+            invalidations, self.local.invalidations = self.local.invalidations, None
+            for user_id in invalidations:
+                self.user_cache.invalidate(user_id)
+            callbacks, self.local.after_commit = self.local.after_commit, None
+            if committed:
+                for callback in callbacks:
+                    self._run_after_commit(callback)
+    
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Run a callback once the current transaction commits.
+        
+        Outside a transaction the callback runs at once. Inside one it runs
+        after the outer transaction commits, and is dropped if the
+        transaction (or the savepoint it was registered in) rolls back, so
+        in-process state derived from the database never sees rolled back
+        writes.
+        
+        Args:
+            callback: Function called without arguments
+        """
+        if getattr(self.local, 'writer', None) is not None:
+            self.local.after_commit.append(callback)
+        else:
+            self._run_after_commit(callback)
     
-    def fetch_one(self, query, params=None):
-        """Execute a query and fetch one result."""
-        connection = None
-        cursor = None
+    @staticmethod
+    def _run_after_commit(callback: Callable[[], None]) -> None:
         try:
-            connection = self.get_db()
-            cursor = connection.cursor()
+            callback()
+        except Exception as e:
+            # The data is committed; a failed follow-up must not fail the caller
+            logger.error(f"Error in after-commit callback: {e}")
+    
+    def bulk_insert(self, table: str, rows, chunk_size: int = None,
+                    return_ids: bool = False) -> Union[int, List[int]]:
+        """
+        Insert many rows in a single transaction.
+        
+        Rows are written with executemany() in chunks of ``chunk_size``, so a
+        generator of rows is never fully materialized and the whole batch
+        costs one commit instead of one per row. When ``return_ids`` is set
+        each chunk is written as multi-row ``INSERT ... RETURNING rowid``
+        statements of up to BULK_INSERT_PARAMS parameters instead. SQLite
+        returns those rows in no particular order, but the ids it generates
+        ascend as rows are inserted, so each statement's ids are sorted back
+        into input order. Rows that set their own id should not ask for ids.
+        
+        Args:
+            table: Table to insert into
+            rows: Iterable of dictionaries mapping column names to values; every
+                row must have the same columns as the first
+            chunk_size: Rows per executemany() call (defaults to DATABASE_BULK_CHUNK_SIZE)
+            return_ids: Return the generated row ids instead of a count
             
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
+        Returns:
+            Number of rows inserted, or the list of new row ids in input order
+        """
+        chunk_size = chunk_size or self.bulk_chunk_size
+        ids = []
+        count = 0
+        columns = None
+        query = None
+        try:
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                for chunk in _chunks(rows, chunk_size):
+                    if columns is None:
+                        columns = list(chunk[0].keys())
+                        insert = "INSERT INTO {} ({})".format(
+                            _quote_identifier(table),
+                            ", ".join(_quote_identifier(column) for column in columns)
+                        )
+                        placeholders = "({})".format(", ".join("?" for _ in columns))
+                        query = f"{insert} VALUES {placeholders}"
+                    params = [tuple(row[column] for column in columns) for row in chunk]
+                    if return_ids:
+                        per_statement = max(1, BULK_INSERT_PARAMS // max(1, len(columns)))
+                        for start in range(0, len(params), per_statement):
+                            batch = params[start:start + per_statement]
+                            values_list = ", ".join([placeholders] * len(batch))
+                            cursor.execute(
+                                f"{insert} VALUES {values_list} RETURNING rowid AS id",
+                                [value for values in batch for value in values]
+                            )
+                            ids.extend(sorted(row['id'] for row in cursor.fetchall()))
+                    else:
+                        cursor.executemany(query, params)
+                    count += len(params)
+        except sqlite3.Error as e:
+            logger.error(f"Error bulk inserting into {table}: {e}")
+            raise DatabaseError(f"Failed to bulk insert into {table}: {e}")
+        except KeyError as e:
+            raise DatabaseError(f"Bulk insert into {table} is missing column {e}")
+        
+        logger.debug(f"Bulk inserted {count} rows into {table}")
+        return ids if return_ids else count
+    
+    def bulk_update(self, table: str, rows, key: str = 'id', chunk_size: int = None) -> int:
+        """
+        Update many rows by key in a single transaction.
+        
+        Args:
+            table: Table to update
+            rows: Iterable of dictionaries holding ``key`` and the columns to set;
+                every row must have the same columns as the first
+            key: Column identifying the row to update
+            chunk_size: Rows per executemany() call (defaults to DATABASE_BULK_CHUNK_SIZE)
             
-            return cursor.fetchone()
+        Returns:
+            Number of rows updated
+        """
+        chunk_size = chunk_size or self.bulk_chunk_size
+        count = 0
+        columns = None
+        query = None
+        try:
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                for chunk in _chunks(rows, chunk_size):
+                    if columns is None:
+                        columns = [column for column in chunk[0].keys() if column != key]
+                        if not columns:
+                            raise ValueError(f"Bulk update of {table} has no columns to set")
+                        query = "UPDATE {} SET {} WHERE {} = ?".format(
+                            _quote_identifier(table),
+                            ", ".join(f"{_quote_identifier(column)} = ?" for column in columns),
+                            _quote_identifier(key)
+                        )
+                    cursor.executemany(
+                        query,
+                        [tuple(row[column] for column in columns) + (row[key],) for row in chunk]
+                    )
+                    count += cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Error bulk updating {table}: {e}")
+            raise DatabaseError(f"Failed to bulk update {table}: {e}")
+        except KeyError as e:
+            raise DatabaseError(f"Bulk update of {table} is missing column {e}")
+        
+        logger.debug(f"Bulk updated {count} rows in {table}")
+        return count
+    
+    def fetch_one(self, query, params=None, row_mode=None):
+        """Execute a query and fetch one result."""
+        cursor = None
+        try:
+            with self._connection(is_read_query(query)) as connection:
+                cursor = self._cursor(connection, row_mode)
+                start = time.perf_counter()
+                
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                
+                result = cursor.fetchone()
+                self._record_query(connection, query, params, start, int(result is not None))
+                return result
         except sqlite3.Error as e:
             logger.error(f"Database error fetching one row: {e}")
             logger.error(f"Query was: {query}")
@@ -425,31 +1822,613 @@ class Database:
                     cursor.close()
                 except:
                     pass
-            self.close()
     
-    def fetch_all(self, query, params=None):
+    def fetch_all(self, query, params=None, row_mode=None):
+        """
+        Execute a query and return all results.
+        
+        Args:
+            query: SQL query string
+            params: Query parameters
+            row_mode: Row representation override ('dict' or 'row')
+            
+        Returns:
+            List of dictionaries (or sqlite3.Row objects in 'row' mode) containing the results
+        """
+        with self._connection(is_read_query(query)) as connection:
+            cursor = self._cursor(connection, row_mode)
+            try:
+                start = time.perf_counter()
+                cursor.execute(query, params or ())
+                rows = cursor.fetchall()
+                self._record_query(connection, query, params, start, len(rows))
+                return rows
+            except sqlite3.Error as e:
+                logger.error(f"Error executing query: {e}")
+                raise
+    
+    def fetch_iter(self, query, params=None, arraysize=None, row_mode=None):
+        """
+        Execute a query and yield its results in batches of ``arraysize`` rows.
+        
+        The connection stays checked out while the generator is alive and is
+        returned to its pool when the results are exhausted, the generator is
+        closed, or it is garbage collected, so consumers may stop early. Flask
+        views can stream from it directly:
+        
+            rows = db.fetch_iter("SELECT * FROM users")
+            return Response(stream_with_context(json.dumps(row) + "\n" for row in rows))
+        
+        Args:
+            query: SQL query string
+            params: Query parameters
+            arraysize: Rows fetched per batch (defaults to DATABASE_ARRAYSIZE)
+            row_mode: Row representation override ('dict' or 'row')
+            
+        Yields:
+            Dictionaries (or sqlite3.Row objects in 'row' mode) for each result row
+        """
+        with self._connection(is_read_query(query)) as connection:
+            cursor = self._cursor(connection, row_mode)
+            cursor.arraysize = arraysize or self.arraysize
+            # Only time spent in SQLite counts, not time spent by the consumer
+            elapsed = 0.0
+            count = 0
+            executed = False
+            try:
+                start = time.perf_counter()
+                cursor.execute(query, params or ())
+                executed = True
+                while True:
+                    rows = cursor.fetchmany()
+                    elapsed += time.perf_counter() - start
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield from rows
+                    start = time.perf_counter()
+            except sqlite3.Error as e:
+                logger.error(f"Error executing query: {e}")
+                raise
+            finally:
+                if executed and self.query_stats is not None:
+                    self.query_stats.record(query, elapsed, count, conn=connection, params=params)
+                cursor.close()
+
+
+# Process-wide registry of shared Database instances, keyed by database path
+_databases: Dict[str, 'Database'] = {}
+# Shard routers, keyed by shard 0's path
+_routers: Dict[str, 'ShardRouter'] = {}
+_databases_lock = threading.Lock()
+
+def _registry_key(database_path: str) -> str:
+    """Normalize a database path so equivalent paths share one registry entry."""
+    if database_path == ":memory:" or database_path.startswith("file:"):
+        return database_path
+    return os.path.abspath(database_path)
+
+def _check_settings(database: Database, options: Dict[str, Any]) -> None:
+    """
+    Make sure a shared Database was opened with the options a caller asks for.
+    
+    Args:
+        database: Registered Database
+        options: Database options passed by the caller; None means any
+        
+    Raises:
+        DatabaseError: If an option differs from the one the instance was opened with
+    """
+    conflicts = []
+    for name, value in options.items():
+        current = database.settings.get(name)
+        if value is None or current is None:
+            continue
+        if isinstance(current, bool):
+            value = bool(value)
+        if value != current:
+            conflicts.append(f"{name}={current!r} (requested {value!r})")
+    if conflicts:
+        raise DatabaseError(
+            f"Database {database.database_path} is already open with other settings: {', '.join(conflicts)}"
+        )
+
+def get_database(database_path: Optional[str] = None, **kwargs) -> Database:
+    """
+    Get the shared Database (and its connection pools) for a database path.
+    
+    The first call for a path creates the Database; later calls return the
+    same instance, so connections and their PRAGMA setup are reused for the
+    life of the process instead of being rebuilt per call. Create it from
+    the application's settings (create_app() does) before anything else
+    asks for it.
+    
+    Args:
+        database_path: Path to the SQLite database file (defaults to DATABASE_PATH)
+        **kwargs: Database options, used when the instance is first created
+        
+    Returns:
+        The shared Database instance
+        
+    Raises:
+        DatabaseError: If the instance already exists with different options
+    """
+    database_path = resolve_database_path(database_path)
+    key = _registry_key(database_path)
+    
+    with _databases_lock:
+        database = _databases.get(key)
+        if database is None:
+            database = Database(database_path, **kwargs)
+            _databases[key] = database
+            logger.debug(f"Registered shared database for {key}")
+            return database
+    _check_settings(database, kwargs)
+    return database
+
+def close_all_databases() -> None:
+    """Stop the replica refreshers, close every registered database pool and clear the registry."""
+    # Replicas copy registered databases (imported here, as they import this module)
+    from models.replicas import stop_all_replicas
+    stop_all_replicas()
+    
+    with _databases_lock:
+        databases = list(_databases.values())
+        _databases.clear()
+        _routers.clear()
+    
+    for database in databases:
+        try:
+            database.close_pools()
+        except Exception as e:
+            logger.error(f"Error closing database {database.database_path}: {e}")
+
+# Make sure pooled connections are closed cleanly when the process exits
+atexit.register(close_all_databases)
+
+# Each shard hands out row ids (from every AUTOINCREMENT table) in its own
+# range of 2**SHARD_ID_BITS ids, so any user, relationship or notification id
+# identifies the shard holding the row. Shard 0's range starts at 0, which
+# makes an existing unsharded database shard 0 as is.
+SHARD_ID_BITS = 40
+
+# Relationships per path kept in the family_closure table
+FAMILY_CLOSURE_DEPTH = 3
+
+# Change log rows a family tree delta may undo; clients further behind reload
+FAMILY_DELTA_LIMIT = 10000
+
+def shard_paths(database_path: str, count: int) -> List[str]:
+    """
+    Get the file of every shard.
+    
+    Args:
+        database_path: Path of shard 0 (the unsharded database path)
+        count: Number of shards
+        
+    Returns:
+        Shard 0's path followed by sibling files named <stem>.shard<N><ext>
+    """
+    root, ext = os.path.splitext(database_path)
+    return [database_path] + [f"{root}.shard{index}{ext or '.sqlite'}" for index in range(1, count)]
+
+class ShardRouter:
+    """
+    Routes per-user work to one of N shard databases partitioned by user id.
+    
+    Each shard is an ordinary Database with its own pools and writer, so
+    writes for users on different shards run in parallel. A user lives on
+    the shard chosen by hashing their email when they are created; their
+    relationships, requests, DID documents and notifications live with them.
+    Relationship rows reference users on other shards, so foreign keys are
+    not enforced across a sharded database.
+    
+    With a single shard every method resolves to the one Database, so the
+    helpers below behave exactly as in an unsharded deployment.
+    """
+    
+    def __init__(self, database_path: str = None, shards: int = None, **kwargs):
+        """
+        Initialize the router.
+        
+        Args:
+            database_path: Path of shard 0 (defaults to DATABASE_PATH)
+            shards: Number of shards (defaults to DATABASE_SHARDS)
+            **kwargs: Database options for every shard
+        """
+        try:
+            config = current_app.config
+        except RuntimeError:
+            config = {}
+        if shards is None:
+            shards = int(config.get('DATABASE_SHARDS', os.environ.get('DATABASE_SHARDS', 1)))
+        if shards < 1 or shards > 1 << (63 - SHARD_ID_BITS):
+            raise ValueError(f"Invalid shard count {shards}")
+        
+        database_path = resolve_database_path(database_path)
+        self.count = shards
+        if shards > 1:
+            kwargs['foreign_keys'] = False
+        # A shard already opened with other options raises here
+        self.shards = [get_database(path, **kwargs) for path in shard_paths(database_path, shards)]
+        
+        # In-memory index of family_relationships over all shards, loaded on first use
+        self.family_graph_enabled = config.get(
+            'DATABASE_FAMILY_GRAPH',
+            os.environ.get('DATABASE_FAMILY_GRAPH', 'true').lower() in ('1', 'true', 'yes')
+        )
+        self._family_graph = FamilyGraph()
+        self._family_graph_lock = threading.Lock()
+    
+    def family_graph(self) -> Optional[FamilyGraph]:
+        """
+        Get the family graph index, brought up to date with the shards.
+        
+        The first call loads the graph. Every call then replays the rows
+        added to each shard's family_changes log since the last one (an
+        indexed range scan that is empty while nothing changes), so writes
+        made by other processes or outside the query helpers show up on the
+        next use. A graph that fell behind the trimmed log is reloaded.
+        
+        Inside a transaction the graph is not used: reads there see the
+        transaction's uncommitted changes, which must not reach the shared
+        graph, and the query helpers read the tables instead.
+        
+        Returns:
+            The current FamilyGraph, or None if the index is disabled
+            (DATABASE_FAMILY_GRAPH), the shards lack the change log or a
+            transaction is open
+        """
+        if not self.family_graph_enabled or \
+                any(getattr(shard.local, 'writer', None) is not None for shard in self.shards):
+            return None
+        with self._family_graph_lock:
+            graph = self._family_graph
+            if graph.loaded and self._sync_family_graph(graph):
+                return graph
+            if not all(shard.fetch_one(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'family_changes'"
+            ) for shard in self.shards):
+                logger.warning("Family graph disabled: family_changes is missing, apply migration 6")
+                return None
+            start = time.perf_counter()
+            # Positions first: changes made while the edges are read are
+            # replayed again, which is harmless
+            positions = [self._family_change_position(shard) for shard in self.shards]
+            graph.build(self.fetch_all(
+                "SELECT id, user_id, relative_id, relationship_type, verified FROM family_relationships",
+                row_mode='dict'
+            ), positions)
+            self._sync_family_graph(graph)
+            logger.info(f"Loaded family graph ({len(graph)} relationships) "
+                        f"in {time.perf_counter() - start:.3f}s")
+            return graph
+    
+    @staticmethod
+    def _family_change_position(shard: Database) -> int:
+        """Last version written to a shard's family_changes log."""
+        row = shard.fetch_one(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'family_changes'", row_mode='dict'
+        )
+        return row['seq'] if row else 0
+    
+    def _sync_family_graph(self, graph: FamilyGraph) -> bool:
+        """
+        Replay the shards' family_changes logs into the graph.
+        
+        Returns:
+            False if a log was trimmed past the graph's position, so the
+            graph missed changes and must be reloaded
+        """
+        for index, shard in enumerate(self.shards):
+            position = graph.positions[index]
+            changes = shard.fetch_all(
+                "SELECT * FROM family_changes WHERE version > ? ORDER BY version",
+                (position,),
+                row_mode='dict'
+            )
+            # Versions are consecutive, as rolled back inserts roll back the sequence too
+            if changes and changes[0]['version'] != position + 1:
+                return False
+            graph.apply(index, changes)
+        return True
+    
+    def family_changes_since(self, user_id: int, since: str, max_depth: int = 3) -> Optional[Dict[str, Any]]:
+        """
+        Get how a user's neighbourhood changed after a family graph version.
+        
+        The shards' family_changes rows between ``since`` and the graph's
+        positions are read with the graph locked, so it cannot move past
+        them, and undone by FamilyGraph.changes_since(). Versions come from
+        the database, so a version handed out by another process is as good
+        as one of this process.
+        
+        Args:
+            user_id: Root user ID
+            since: ``version`` of the caller's copy of the neighbourhood
+            max_depth: Maximum number of hops
+            
+        Returns:
+            Dictionary with the current 'version', the changed 'edges', and
+            the 'removed_edges' and 'removed_nodes' ids; or None if the
+            caller must reload, because the graph is not used, ``since`` is
+            not a version of these shards or is ahead of this process, or the
+            changes are trimmed from the log or more than FAMILY_DELTA_LIMIT
+        """
+        graph = self.family_graph()
+        if graph is None:
+            return None
+        try:
+            since = [int(part) for part in since.split('.')]
+        except (AttributeError, ValueError):
+            return None
+        with graph.lock:
+            positions = list(graph.positions)
+            if len(since) != len(positions) or \
+                    not all(index << SHARD_ID_BITS <= start <= end
+                            for index, (start, end) in enumerate(zip(since, positions))) or \
+                    sum(end - start for start, end in zip(since, positions)) > FAMILY_DELTA_LIMIT:
+                return None
+            changes = []
+            for index, (start, end) in enumerate(zip(since, positions)):
+                if start == end:
+                    continue
+                rows = self.shards[index].fetch_all(
+                    "SELECT * FROM family_changes WHERE version > ? AND version <= ? ORDER BY version",
+                    (start, end),
+                    row_mode='dict'
+                )
+                # Versions are consecutive, so missing rows were trimmed
+                if len(rows) != end - start:
+                    return None
+                changes.extend(rows)
+            result = graph.changes_since(user_id, changes, max_depth)
+        result['version'] = '.'.join(str(position) for position in positions)
+        return result
+    
+    def reset_family_graph(self) -> None:
+        """Discard the family graph index so the next use reloads it from the shards."""
+        with self._family_graph_lock:
+            self._family_graph = FamilyGraph()
+    
+    @property
+    def primary(self) -> Database:
+        """Shard 0, which also holds everything that is not per user."""
+        return self.shards[0]
+    
+    def shard_of(self, row_id: int) -> int:
+        """
+        Get the shard holding a row.
+        
+        Args:
+            row_id: Id of a user, relationship, request, DID document or notification
+            
+        Returns:
+            Shard index
+        """
+        if self.count == 1:
+            return 0
+        index = int(row_id) >> SHARD_ID_BITS
+        if index >= self.count:
+            raise DatabaseError(f"Id {row_id} belongs to shard {index}, but there are only {self.count} shards")
+        return index
+    
+    def for_id(self, row_id: int) -> Database:
+        """Get the shard database holding a row (see shard_of)."""
+        return self.shards[self.shard_of(row_id)]
+    
+    def home_shard(self, email: str) -> int:
+        """
+        Get the shard a new user with this email is created on.
+        
+        Args:
+            email: User email
+            
+        Returns:
+            Shard index
+        """
+        if self.count == 1:
+            return 0
+        return zlib.crc32(email.lower().encode('utf-8')) % self.count
+    
+    def for_email(self, email: str) -> Database:
+        """Get the shard database a new user with this email is created on."""
+        return self.shards[self.home_shard(email)]
+    
+    def by_shard(self, row_ids) -> Dict[int, List[int]]:
+        """
+        Group row ids by the shard holding them.
+        
+        Args:
+            row_ids: Iterable of row ids
+            
+        Returns:
+            Dictionary mapping shard index to the ids on that shard
+        """
+        groups = {}
+        for row_id in row_ids:
+            groups.setdefault(self.shard_of(row_id), []).append(row_id)
+        return groups
+    
+    def fetch_by_ids(self, query: str, row_ids, row_mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Run a query with an ``IN ({ids})`` placeholder on every shard holding some of the ids.
+        
+        Args:
+            query: SQL with an ``{ids}`` placeholder for the id list
+            row_ids: Ids to look up
+            row_mode: Override for the shards' row mode
+            
+        Returns:
+            Rows from all shards, in shard order
+        """
+        rows = []
+        for index, ids in sorted(self.by_shard(set(row_ids)).items()):
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows.extend(self.shards[index].fetch_all(
+                    query.format(ids=', '.join('?' * len(chunk))), tuple(chunk), row_mode=row_mode
+                ))
+        return rows
+    
+    def fetch_all(self, query: str, params: tuple = (), row_mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Run a query on every shard (scatter-gather).
+        
+        Args:
+            query: SQL query
+            params: Query parameters
+            row_mode: Override for the shards' row mode
+            
+        Returns:
+            Rows from all shards, in shard order
+        """
+        rows = []
+        for shard in self.shards:
+            rows.extend(shard.fetch_all(query, params, row_mode=row_mode))
+        return rows
+    
+    @contextmanager
+    def transaction(self, *indexes: int):
+        """
+        Open one transaction on each of the given shards.
+        
+        Transactions are begun in ascending shard order, so two coordinators
+        can never wait on each other's write locks, and all shards roll back
+        if the block raises. The commits are not atomic across shards: if a
+        later commit fails after an earlier one succeeded the shards
+        disagree, which is logged for repair.
+        
+        Args:
+            *indexes: Shard indexes taking part (duplicates are fine)
+            
+        Yields:
+            Dictionary mapping shard index to its Database
+        """
+        participants = sorted(set(indexes))
+        committed = []
+        try:
+            with ExitStack() as stack:
+                for index in participants:
+                    stack.enter_context(self._shard_transaction(index, committed))
+                yield {index: self.shards[index] for index in participants}
+        except BaseException:
+            if committed:
+                logger.error(
+                    f"Cross-shard transaction committed on shards {committed} "
+                    f"but failed on the others of {participants}"
+                )
+            raise
+    
+    @contextmanager
+    def _shard_transaction(self, index: int, committed: List[int]):
+        """One shard's part of transaction(), recording the shard once it commits."""
+        with self.shards[index].transaction():
+            yield
+        committed.append(index)
+    
+    def migrate(self, target: Optional[int] = None) -> Dict[int, List[int]]:
         """
-        Execute a query and return all results.
+        Apply pending migrations to every shard and reserve each shard's id range.
         
         Args:
-            query: SQL query string
-            params: Query parameters
+            target: Highest migration version to apply (defaults to the latest)
             
         Returns:
-            List of dictionaries containing the results
+            Dictionary mapping shard index to the versions applied
         """
-        with self.get_db() as db:
-            cursor = db.cursor()
-            try:
-                cursor.execute(query, params or ())
-                return cursor.fetchall()
-            except sqlite3.Error as e:
-                logger.error(f"Error executing query: {e}")
-                raise
+        from models.migrations import apply_migrations
+        
+        applied = {}
+        for index, shard in enumerate(self.shards):
+            applied[index] = apply_migrations(shard, target)
+            self._reserve_id_range(index)
+        # Each shard backfilled family_closure from its own relationships only
+        if self.count > 1 and any(5 in versions for versions in applied.values()):
+            rebuild_family_closure(self)
+        # Migrations may rebuild family_relationships
+        self.reset_family_graph()
+        return applied
+    
+    def _reserve_id_range(self, index: int) -> None:
+        """Start every AUTOINCREMENT table of a shard at the bottom of its id range."""
+        base = index << SHARD_ID_BITS
+        if not base:
+            return
+        shard = self.shards[index]
+        with shard.transaction() as conn:
+            tables = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE '%AUTOINCREMENT%'"
+            ).fetchall()
+            for table in tables:
+                name = table['name']
+                updated = conn.execute(
+                    "UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?", (base, name, base)
+                ).rowcount
+                exists = conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = ?", (name,)).fetchone()
+                if not updated and not exists:
+                    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (name, base))
+    
+    def pool_stats(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Get pool statistics for every shard.
+        
+        Returns:
+            Dictionary mapping shard index to its Database.pool_stats()
+        """
+        return {index: shard.pool_stats() for index, shard in enumerate(self.shards)}
+
+def get_shards(database_path: Optional[str] = None, shards: Optional[int] = None, **kwargs) -> ShardRouter:
+    """
+    Get the shared ShardRouter for a database path.
+    
+    Args:
+        database_path: Path of shard 0 (defaults to DATABASE_PATH)
+        shards: Number of shards (defaults to DATABASE_SHARDS)
+        **kwargs: Database options, used when the shards are first created
+        
+    Returns:
+        The shared ShardRouter
+        
+    Raises:
+        DatabaseError: If the router already exists with a different shard
+            count or its shards with different options
+    """
+    database_path = resolve_database_path(database_path)
+    key = _registry_key(database_path)
+    
+    with _databases_lock:
+        router = _routers.get(key)
+    if router is None:
+        # Created outside the lock: opening the shards registers them with get_database()
+        router = ShardRouter(database_path, shards, **kwargs)
+        with _databases_lock:
+            router = _routers.setdefault(key, router)
+        return router
+    
+    if shards is not None and shards != router.count:
+        raise DatabaseError(f"Database {database_path} is already open with {router.count} shards, not {shards}")
+    for shard in router.shards:
+        _check_settings(shard, kwargs)
+    return router
 
 
 # Specialized query functions for the Proof of Humanity application
 
+def _cached_user(db: Database, key, query: str, by_email: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Look a user up through the database's user cache.
+    
+    Inside a transaction the cache is bypassed, so the transaction sees its
+    own uncommitted changes to the user.
+    """
+    def load():
+        return db.fetch_one(query, (key,), row_mode='dict')
+    
+    if db.user_cache is None or getattr(db.local, 'writer', None) is not None:
+        return load()
+    return db.user_cache.get(key, load, by_email=by_email)
+
 def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
     """
     Get a user by ID.
@@ -460,11 +2439,7 @@ def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
     Returns:
         User data or None if not found
     """
-    db = Database()
-    return db.fetch_one(
-        "SELECT * FROM users WHERE id = ?",
-        (user_id,)
-    )
+    return _cached_user(get_shards().for_id(user_id), user_id, "SELECT * FROM users WHERE id = ?")
 
 def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     """
@@ -476,11 +2451,15 @@ def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     Returns:
         User data or None if not found
     """
-    db = Database()
-    return db.fetch_one(
-        "SELECT * FROM users WHERE email = ?",
-        (email.lower(),)
-    )
+    router = get_shards()
+    email = email.lower()
+    home = router.home_shard(email)
+    # Users created before sharding was enabled may live on any shard
+    for index in [home] + [index for index in range(router.count) if index != home]:
+        user = _cached_user(router.shards[index], email, "SELECT * FROM users WHERE email = ?", by_email=True)
+        if user:
+            return user
+    return None
 
 def create_user(name: str, email: str, password_hash: str) -> int:
     """
@@ -494,7 +2473,7 @@ def create_user(name: str, email: str, password_hash: str) -> int:
     Returns:
         User ID
     """
-    db = Database()
+    db = get_shards().for_email(email)
     user_data = {
         'name': name,
         'email': email.lower(),
@@ -523,11 +2502,12 @@ def update_user_verification_level(user_id: int, level: int) -> bool:
     Returns:
         True if successful, False otherwise
     """
-    db = Database()
+    db = get_shards().for_id(user_id)
     rows_affected = db.execute_query(
         "UPDATE users SET verification_level = ?, updated_at = ? WHERE id = ?",
         (level, int(time.time()), user_id)
     )
+    db.invalidate_user(user_id)
     return rows_affected > 0
 
 def mark_email_verified(user_id: int) -> bool:
@@ -540,13 +2520,491 @@ def mark_email_verified(user_id: int) -> bool:
     Returns:
         True if successful, False otherwise
     """
-    db = Database()
+    db = get_shards().for_id(user_id)
     rows_affected = db.execute_query(
         "UPDATE users SET email_verified = TRUE, updated_at = ? WHERE id = ?",
         (int(time.time()), user_id)
     )
+    db.invalidate_user(user_id)
     return rows_affected > 0
 
+def _users_by_id(router: ShardRouter, user_ids) -> Dict[int, Dict[str, Any]]:
+    """
+    Fetch the public fields of users spread over shards.
+    
+    Args:
+        router: Shard router
+        user_ids: User IDs to fetch
+        
+    Returns:
+        Dictionary mapping user ID to its name, email and verification level
+    """
+    rows = router.fetch_by_ids(
+        "SELECT id, name, email, verification_level FROM users WHERE id IN ({ids})",
+        user_ids,
+        row_mode='dict'
+    )
+    return {row['id']: row for row in rows}
+
+def _sharded_family_edges(router: ShardRouter, user_id: int, max_depth: int = 3) -> List[Dict[str, Any]]:
+    """
+    Collect family tree edges across shards, one batched query per shard and level.
+    
+    Mirrors the recursive query used on a single database: relationships up
+    to max_depth hops from the user, skipping edges back to users reached
+    on an earlier level.
+    
+    Args:
+        router: Shard router
+        user_id: Root user ID
+        max_depth: Maximum number of hops
+        
+    Returns:
+        Edge rows with the same columns as the single-database query, in
+        (depth, relationship id) order
+    """
+    edges = []
+    reached = {user_id}
+    frontier = [user_id]
+    for depth in range(1, max_depth + 1):
+        if not frontier:
+            break
+        known = set(reached)
+        frontier_next = []
+        rows = router.fetch_by_ids(
+            "SELECT id AS relation_id, user_id, relative_id, relationship_type, verified "
+            "FROM family_relationships WHERE user_id IN ({ids})",
+            frontier,
+            row_mode='dict'
+        )
+        # Shards answer in any order; pages are cut by (depth, relationship id)
+        for row in sorted(rows, key=lambda row: row['relation_id']):
+            if row['relative_id'] in known:
+                continue
+            row['depth'] = depth
+            edges.append(row)
+            if row['relative_id'] not in reached:
+                reached.add(row['relative_id'])
+                frontier_next.append(row['relative_id'])
+        frontier = frontier_next
+    return _with_edge_users(router, edges, reached)
+
+def _with_edge_users(router: ShardRouter, edges: List[Dict[str, Any]], user_ids) -> List[Dict[str, Any]]:
+    """
+    Add the name, email and verification level of both ends to family tree edges.
+    
+    Args:
+        router: Shard router
+        edges: Edge rows with user_id and relative_id
+        user_ids: Every user at either end of an edge
+        
+    Returns:
+        The edges whose users exist, with user_* and relative_* columns added
+    """
+    users = _users_by_id(router, user_ids)
+    tree = []
+    for edge in edges:
+        source, target = users.get(edge['user_id']), users.get(edge['relative_id'])
+        if source is None or target is None:
+            continue
+        edge.update({
+            'user_name': source['name'],
+            'user_email': source['email'],
+            'user_verification_level': source['verification_level'],
+            'relative_name': target['name'],
+            'relative_email': target['email'],
+            'relative_verification_level': target['verification_level']
+        })
+        tree.append(edge)
+    return tree
+
+def _family_edges_to(router: ShardRouter, user_ids) -> List[Dict[str, Any]]:
+    """
+    Get the relationships leading to some users, from every shard.
+    
+    Args:
+        router: Shard router
+        user_ids: Users at the relative end
+        
+    Returns:
+        Rows with user_id, relative_id and relationship_type
+    """
+    ids = list(set(user_ids))
+    rows = []
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        rows.extend(router.fetch_all(
+            f"SELECT user_id, relative_id, relationship_type FROM family_relationships "
+            f"WHERE relative_id IN ({', '.join('?' * len(chunk))})",
+            tuple(chunk),
+            row_mode='dict'
+        ))
+    return rows
+
+def _family_closure_edge_paths(router: ShardRouter, edges) -> Dict[Tuple[int, int, str], int]:
+    """
+    Count the family_closure paths that run over some relationships.
+    
+    Every simple path of up to FAMILY_CLOSURE_DEPTH relationships over an
+    edge is a walk of relationships leading to its user, the edge, and a
+    walk leaving its relative, so only the neighbourhood of the edge is
+    read. A path cannot run over an edge and its inverse, so the paths of
+    a relationship pair are counted once.
+    
+    Args:
+        router: Shard router
+        edges: (user_id, relative_id, relationship_type) of each relationship
+        
+    Returns:
+        Dictionary mapping (ancestor_id, descendant_id, path_type) to the
+        number of paths over the edges
+    """
+    counts = {}
+    for user_id, relative_id, relationship_type in edges:
+        # Walks as (users along the walk, relationship types)
+        prefixes, frontier = [((user_id,), ())], [((user_id,), ())]
+        for _ in range(FAMILY_CLOSURE_DEPTH - 1):
+            into = {}
+            for edge in _family_edges_to(router, {users[0] for users, _ in frontier}):
+                into.setdefault(edge['relative_id'], []).append(edge)
+            frontier = [
+                ((edge['user_id'],) + users, (edge['relationship_type'],) + types)
+                for users, types in frontier for edge in into.get(users[0], ())
+                if edge['user_id'] not in users and edge['user_id'] != relative_id
+            ]
+            prefixes += frontier
+        
+        suffixes, frontier = [((relative_id,), ())], [((relative_id,), ())]
+        for _ in range(FAMILY_CLOSURE_DEPTH - 1):
+            out = {}
+            for edge in router.fetch_by_ids(
+                "SELECT user_id, relative_id, relationship_type FROM family_relationships WHERE user_id IN ({ids})",
+                {users[-1] for users, _ in frontier},
+                row_mode='dict'
+            ):
+                out.setdefault(edge['user_id'], []).append(edge)
+            frontier = [
+                (users + (edge['relative_id'],), types + (edge['relationship_type'],))
+                for users, types in frontier for edge in out.get(users[-1], ())
+                if edge['relative_id'] not in users and edge['relative_id'] != user_id
+            ]
+            suffixes += frontier
+        
+        for head, head_types in prefixes:
+            for tail, tail_types in suffixes:
+                if len(head_types) + len(tail_types) >= FAMILY_CLOSURE_DEPTH or not set(head).isdisjoint(tail):
+                    continue
+                key = (head[0], tail[-1], ','.join(head_types + (relationship_type,) + tail_types))
+                counts[key] = counts.get(key, 0) + 1
+    return counts
+
+@contextmanager
+def _family_closure_transaction(router: ShardRouter, edges):
+    """
+    Open a transaction for adding or removing relationships and their closure rows.
+    
+    The closure paths over the relationships are counted after BEGIN
+    IMMEDIATE, so a concurrent change cannot add one in between. Closure
+    rows live on their ancestor's shard; when those are beyond the users'
+    own shards, the transaction is reopened with them as well, keeping
+    shards locked in ascending order.
+    
+    Args:
+        router: Shard router
+        edges: (user_id, relative_id, relationship_type) of each relationship
+        
+    Yields:
+        The paths over the relationships (see _family_closure_edge_paths),
+        for _update_family_closure()
+    """
+    edges = list(edges)
+    shards = {router.shard_of(user_id) for edge in edges for user_id in edge[:2]}
+    while True:
+        with router.transaction(*shards):
+            paths = _family_closure_edge_paths(router, edges)
+            needed = {router.shard_of(ancestor_id) for ancestor_id, _, _ in paths}
+            if needed <= shards:
+                yield paths
+                return
+        shards |= needed
+
+def _update_family_closure(router: ShardRouter, paths: Dict[Tuple[int, int, str], int], sign: int) -> None:
+    """
+    Add or subtract path counts in the family_closure table.
+    
+    Call inside the transaction that adds or removes the relationships the
+    paths run over. A row goes away when no path is left for it.
+    
+    Args:
+        router: Shard router
+        paths: (ancestor_id, descendant_id, path_type) -> number of paths
+        sign: 1 when the paths were added, -1 when they were removed
+    """
+    by_shard = {}
+    for (ancestor_id, descendant_id, path_type), count in paths.items():
+        by_shard.setdefault(router.shard_of(ancestor_id), []).append(
+            (ancestor_id, descendant_id, path_type, count)
+        )
+    for index, rows in by_shard.items():
+        with router.shards[index].transaction() as conn:
+            if sign > 0:
+                conn.executemany(
+                    "INSERT INTO family_closure (ancestor_id, descendant_id, depth, path_type, paths) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (ancestor_id, descendant_id, path_type) DO UPDATE SET paths = paths + excluded.paths",
+                    [(a, d, path_type.count(',') + 1, path_type, count) for a, d, path_type, count in rows]
+                )
+            else:
+                conn.executemany(
+                    "UPDATE family_closure SET paths = paths - ? "
+                    "WHERE ancestor_id = ? AND descendant_id = ? AND path_type = ?",
+                    [(count, a, d, path_type) for a, d, path_type, count in rows]
+                )
+                conn.executemany(
+                    "DELETE FROM family_closure "
+                    "WHERE ancestor_id = ? AND descendant_id = ? AND path_type = ? AND paths <= 0",
+                    [(a, d, path_type) for a, d, path_type, _ in rows]
+                )
+
+def _family_closure_paths(router: ShardRouter, sources) -> Dict[Tuple[int, int, str], int]:
+    """
+    Count the family_closure paths leaving some users.
+    
+    Args:
+        router: Shard router
+        sources: Users whose paths are counted
+        
+    Returns:
+        Dictionary mapping (ancestor_id, descendant_id, path_type) to the
+        number of simple paths of up to FAMILY_CLOSURE_DEPTH relationships
+    """
+    counts = {}
+    # (source, last user, relationship types, users on the path)
+    paths = [(source, source, (), (source,)) for source in sources]
+    for _ in range(FAMILY_CLOSURE_DEPTH):
+        if not paths:
+            break
+        edges = {}
+        for edge in router.fetch_by_ids(
+            "SELECT user_id, relative_id, relationship_type FROM family_relationships WHERE user_id IN ({ids})",
+            {path[1] for path in paths},
+            row_mode='dict'
+        ):
+            edges.setdefault(edge['user_id'], []).append(edge)
+        extended = []
+        for source, user_id, types, visited in paths:
+            for edge in edges.get(user_id, ()):
+                relative_id = edge['relative_id']
+                if relative_id in visited:
+                    continue
+                path_types = types + (edge['relationship_type'],)
+                key = (source, relative_id, ','.join(path_types))
+                counts[key] = counts.get(key, 0) + 1
+                extended.append((source, relative_id, path_types, visited + (relative_id,)))
+        paths = extended
+    return counts
+
+def rebuild_family_closure(router: Optional[ShardRouter] = None, batch_size: int = 500) -> int:
+    """
+    Rebuild the family_closure table of every shard from family_relationships.
+    
+    Args:
+        router: Shard router (defaults to get_shards())
+        batch_size: Users whose paths are counted and written at a time
+        
+    Returns:
+        Number of users whose paths were counted
+    """
+    router = router or get_shards()
+    with router.transaction(*range(router.count)):
+        for shard in router.shards:
+            shard.execute_query("DELETE FROM family_closure")
+        sources = sorted({row['user_id'] for row in router.fetch_all(
+            "SELECT DISTINCT user_id FROM family_relationships", row_mode='dict'
+        )})
+        for start in range(0, len(sources), batch_size):
+            _update_family_closure(router, _family_closure_paths(router, sources[start:start + batch_size]), 1)
+    logger.info(f"Rebuilt family closure for {len(sources)} users")
+    return len(sources)
+
+def get_kinship_distance(user_id: int, other_id: int) -> Optional[int]:
+    """
+    Get the number of relationships between two users.
+    
+    Args:
+        user_id: User ID
+        other_id: Other user's ID
+        
+    Returns:
+        Length of the shortest path between them, or None if it is longer
+        than FAMILY_CLOSURE_DEPTH (or there is none)
+    """
+    row = get_shards().for_id(user_id).fetch_one(
+        "SELECT MIN(depth) AS depth FROM family_closure WHERE ancestor_id = ? AND descendant_id = ?",
+        (user_id, other_id),
+        row_mode='dict'
+    )
+    return row['depth'] if row else None
+
+def get_relatives_by_path(user_id: int, *relationship_types: str) -> List[Dict[str, Any]]:
+    """
+    Get the users reached over a sequence of relationship types.
+    
+    For example ``get_relatives_by_path(user_id, 'parent', 'parent')`` returns
+    the user's grandparents through their parents.
+    
+    Args:
+        user_id: User ID
+        *relationship_types: Relationship types along the path, at most
+            FAMILY_CLOSURE_DEPTH of them
+        
+    Returns:
+        List of the reached users' id, name, email and verification level
+    """
+    if not 0 < len(relationship_types) <= FAMILY_CLOSURE_DEPTH:
+        raise ValueError(f"Expected 1 to {FAMILY_CLOSURE_DEPTH} relationship types, got {len(relationship_types)}")
+    
+    router = get_shards()
+    rows = router.for_id(user_id).fetch_all(
+        "SELECT descendant_id FROM family_closure WHERE ancestor_id = ? AND path_type = ? ORDER BY descendant_id",
+        (user_id, ','.join(relationship_types)),
+        row_mode='dict'
+    )
+    users = _users_by_id(router, [row['descendant_id'] for row in rows])
+    return [users[row['descendant_id']] for row in rows if row['descendant_id'] in users]
+
+def _family_neighbors(router: ShardRouter, user_ids) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Get the relationships of some users, from the graph index when it is enabled.
+    
+    Args:
+        router: Shard router
+        user_ids: Users to look up
+        
+    Returns:
+        Dictionary mapping each user with relationships to its edges
+    """
+    graph = router.family_graph()
+    if graph is not None:
+        return graph.neighbors(user_ids)
+    edges = {}
+    for row in router.fetch_by_ids(
+        "SELECT id AS relation_id, user_id, relative_id, relationship_type, verified "
+        "FROM family_relationships WHERE user_id IN ({ids})",
+        user_ids,
+        row_mode='dict'
+    ):
+        edges.setdefault(row['user_id'], []).append(row)
+    return edges
+
+def find_relationship_path(user_id: int, other_id: int, max_depth: int = 6) -> Optional[Dict[str, Any]]:
+    """
+    Find how two users are related: the shortest chain of relationships between them.
+    
+    The search runs breadth first from both users at once, always growing
+    the smaller frontier by one level, and stops at the level where the two
+    searches meet. It visits the neighbourhoods of both users to about half
+    the distance instead of one user's neighbourhood to the full distance.
+    
+    Args:
+        user_id: User the path starts at
+        other_id: User the path ends at
+        max_depth: Maximum number of relationships on the path
+        
+    Returns:
+        Dictionary with the path's ``length``, the ``users`` along it (id
+        and name only, as the path reaches users the caller may not know)
+        and its ``steps``, each with
+        relation_id, user_id, relative_id, the relationship_type of the
+        relative to the user and verified; or None if the users are not
+        connected within max_depth relationships
+    """
+    router = get_shards()
+    if user_id == other_id:
+        users = _users_by_id(router, [user_id])
+        if user_id not in users:
+            return None
+        return {"length": 0, "users": [{"id": user_id, "name": users[user_id]["name"]}], "steps": []}
+    
+    # Per side: user -> (previous user towards that side's root, edge between them, distance)
+    sides = ({user_id: (None, None, 0)}, {other_id: (None, None, 0)})
+    frontiers = [[user_id], [other_id]]
+    depths = [0, 0]
+    while frontiers[0] and frontiers[1] and depths[0] + depths[1] < max_depth:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        reached, opposite = sides[side], sides[1 - side]
+        depths[side] += 1
+        meet = None
+        frontier_next = []
+        edges = _family_neighbors(router, frontiers[side])
+        for source in frontiers[side]:
+            for edge in edges.get(source, ()):
+                target = edge['relative_id']
+                if target in reached:
+                    continue
+                reached[target] = (source, edge, depths[side])
+                frontier_next.append(target)
+                # Finish the level: another meeting point may be closer to the other root
+                if target in opposite and (meet is None or opposite[target][2] < opposite[meet][2]):
+                    meet = target
+        if meet is not None:
+            return _relationship_path(router, sides, meet)
+        frontiers[side] = frontier_next
+    return None
+
+def _relationship_path(router: ShardRouter, sides, meet: int) -> Dict[str, Any]:
+    """
+    Join the two halves of a bidirectional search at the user where they met.
+    
+    Args:
+        router: Shard router
+        sides: Search state of both sides (see find_relationship_path)
+        meet: User reached by both sides
+        
+    Returns:
+        The path, as returned by find_relationship_path
+    """
+    forward, backward = sides
+    users = [meet]
+    steps = []
+    user = meet
+    while forward[user][0] is not None:
+        previous, edge, _ = forward[user]
+        users.insert(0, previous)
+        steps.insert(0, edge)
+        user = previous
+    
+    # The other side's edges point back towards its root; report the
+    # relationship stored in the path's direction instead
+    reverse = []
+    user = meet
+    while backward[user][0] is not None:
+        previous, edge, _ = backward[user]
+        users.append(previous)
+        reverse.append(edge)
+        user = previous
+    outgoing = _family_neighbors(router, [edge['relative_id'] for edge in reverse])
+    for edge in reverse:
+        stored = next(
+            (e for e in outgoing.get(edge['relative_id'], ()) if e['relative_id'] == edge['user_id']), None
+        )
+        steps.append(stored or dict(
+            edge,
+            user_id=edge['relative_id'],
+            relative_id=edge['user_id'],
+            relationship_type=get_inverse_relationship(edge['relationship_type'])
+        ))
+    
+    details = _users_by_id(router, users)
+    return {
+        "length": len(steps),
+        "users": [{"id": user, "name": details[user]["name"] if user in details else None} for user in users],
+        "steps": [
+            {key: step[key] for key in ('relation_id', 'user_id', 'relative_id', 'relationship_type', 'verified')}
+            for step in steps
+        ]
+    }
+
 def get_family_relationships(user_id: int) -> List[Dict[str, Any]]:
     """
     Get all family relationships for a user.
@@ -557,88 +3015,186 @@ def get_family_relationships(user_id: int) -> List[Dict[str, Any]]:
     Returns:
         List of relationship data
     """
-    db = Database()
-    return db.fetch_all(
-        """
-        SELECT r.*, u.name, u.email, u.verification_level 
-        FROM family_relationships r
-        JOIN users u ON r.relative_id = u.id
-        WHERE r.user_id = ?
-        ORDER BY r.verified DESC, r.created_at DESC
-        """,
-        (user_id,)
+    router = get_shards()
+    db = router.for_id(user_id)
+    if router.count == 1:
+        return db.fetch_all(
+            """
+            SELECT r.*, u.name, u.email, u.verification_level 
+            FROM family_relationships r
+            JOIN users u ON r.relative_id = u.id
+            WHERE r.user_id = ?
+            ORDER BY r.verified DESC, r.created_at DESC
+            """,
+            (user_id,),
+            row_mode='dict'
+        )
+    
+    # Relatives may live on other shards: join them in from their own shards
+    relationships = db.fetch_all(
+        "SELECT r.* FROM family_relationships r WHERE r.user_id = ? ORDER BY r.verified DESC, r.created_at DESC",
+        (user_id,),
+        row_mode='dict'
     )
+    relatives = _users_by_id(router, (r['relative_id'] for r in relationships))
+    return [
+        dict(r, **{column: relatives[r['relative_id']][column] for column in ('name', 'email', 'verification_level')})
+        for r in relationships if r['relative_id'] in relatives
+    ]
+
+def _page_edges(edges: List[Dict[str, Any]], user_id: int, after: Optional[Tuple[int, int]] = None,
+                max_nodes: Optional[int] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Cut one page out of a family tree walk, like FamilyGraph.page().
+    
+    Args:
+        edges: Edges of the whole walk in (depth, relation_id) order
+        user_id: Root user ID
+        after: (depth, relation_id) of the last edge delivered by earlier
+            pages, or None for the first page
+        max_nodes: Maximum number of new users on the page (None for no limit)
+        
+    Returns:
+        Tuple of the page's edges, each with ``discovered`` set, and whether
+        edges remain after the page
+    """
+    after = after or (0, 0)
+    seen = {user_id}
+    page = []
+    discovered = 0
+    for edge in edges:
+        new = edge['relative_id'] not in seen
+        seen.add(edge['relative_id'])
+        if (edge['depth'], edge['relation_id']) <= after:
+            continue
+        if new:
+            if max_nodes is not None and discovered >= max_nodes:
+                return page, True
+            discovered += 1
+        page.append(dict(edge, discovered=new))
+    return page, False
 
-def get_family_tree(user_id: int) -> Dict[str, Any]:
+def get_family_tree(user_id: int, depth: int = 3, max_nodes: Optional[int] = None,
+                    cursor: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
     """
-    Get the family tree for a user.
+    Get the family tree for a user, or one page of it.
+    
+    The tree is walked breadth first in (depth, relationship id) order, so
+    the walk for a smaller depth is a prefix of the walk for a larger one.
+    A page stops before the relationship that would add more than
+    ``max_nodes`` users, and its ``cursor`` (the depth and id of the last
+    relationship delivered) continues the walk: pass it back with the same
+    depth for the next page, or with a larger depth to expand the tree by
+    another level. The cursor names a position in that order rather than a
+    count, so relationships added or removed between pages do not make the
+    next page repeat or skip others.
     
     Args:
         user_id: User ID
+        depth: Maximum number of hops from the user
+        max_nodes: Maximum number of users added by this page (None for no limit)
+        cursor: Cursor returned by the previous page (None for the first page)
         
     Returns:
-        Dictionary with nodes and links for the family tree
+        Dictionary with the page's nodes (the user, on the first page, and
+        every user first reached on it) and links, the ``cursor`` to continue
+        from, ``has_more``, whether the walk stopped early at max_nodes, and
+        the graph ``version`` to pass to get_family_tree_changes() (None
+        without the graph index)
     """
-    db = Database()
+    router = get_shards()
+    db = router.for_id(user_id)
     
     # Get user's own info
     user = get_user_by_id(user_id)
     if not user:
-        return {"nodes": [], "links": []}
-    
-    # Get all relatives (direct and indirect)
-    relationships = db.fetch_all(
-        """
-        WITH RECURSIVE
-        relatives(user_id, relative_id, path, relationship_type, verified, relation_id) AS (
-            -- Direct relationships
-            SELECT 
-                r.user_id, 
-                r.relative_id, 
-                user_id || ',' || relative_id AS path,
-                r.relationship_type,
-                r.verified,
-                r.id
-            FROM family_relationships r
-            WHERE r.user_id = ?
-            
-            UNION
-            
-            -- Relatives of relatives (up to 3 levels deep)
-            SELECT 
-                r.user_id, 
-                r.relative_id, 
-                relatives.path || ',' || r.relative_id AS path,
-                r.relationship_type,
-                r.verified,
-                r.id
-            FROM family_relationships r
-            JOIN relatives ON r.user_id = relatives.relative_id
-            WHERE relatives.path NOT LIKE '%' || r.relative_id || '%'
-            AND LENGTH(relatives.path) - LENGTH(REPLACE(relatives.path, ',', '')) < 3
+        return {"nodes": [], "links": [], "cursor": cursor or (0, 0), "has_more": False, "version": None}
+    
+    # Get the relatives (direct and indirect) on this page, from the in-memory
+    # graph index when it is enabled; it stops walking once the page is full
+    graph = router.family_graph()
+    version = None
+    if graph is not None:
+        # Read before walking: a change racing with the walk is sent again
+        # as a delta rather than missed
+        version = graph.version
+        edges, has_more = graph.page(user_id, depth, after=cursor, max_nodes=max_nodes)
+        last = edges[-1] if edges else None
+        relationships = _with_edge_users(
+            router, edges, {edge['user_id'] for edge in edges} | {edge['relative_id'] for edge in edges}
         )
-        SELECT DISTINCT 
-            r.user_id, 
-            r.relative_id, 
-            r.relationship_type,
-            r.verified,
-            r.relation_id,
-            u1.name AS user_name,
-            u1.email AS user_email,
-            u1.verification_level AS user_verification_level,
-            u2.name AS relative_name,
-            u2.email AS relative_email,
-            u2.verification_level AS relative_verification_level
-        FROM relatives r
-        JOIN users u1 ON r.user_id = u1.id
-        JOIN users u2 ON r.relative_id = u2.id
-        """,
-        (user_id,)
-    )
+    else:
+        if router.count > 1:
+            walk = _sharded_family_edges(router, user_id, max_depth=depth)
+        else:
+            rows = db.fetch_all(
+                """
+                WITH RECURSIVE
+                relatives(user_id, relative_id, path, depth, relationship_type, verified, relation_id) AS (
+                    -- Direct relationships
+                    SELECT 
+                        r.user_id, 
+                        r.relative_id, 
+                        ',' || user_id || ',' || relative_id || ',' AS path,
+                        1,
+                        r.relationship_type,
+                        r.verified,
+                        r.id
+                    FROM family_relationships r
+                    WHERE r.user_id = ?
+                
+                    UNION
+                
+                    -- Relatives of relatives (up to the requested depth)
+                    SELECT 
+                        r.user_id, 
+                        r.relative_id, 
+                        relatives.path || r.relative_id || ',' AS path,
+                        relatives.depth + 1,
+                        r.relationship_type,
+                        r.verified,
+                        r.id
+                    FROM family_relationships r
+                    JOIN relatives ON r.user_id = relatives.relative_id
+                    -- Ids are matched with their delimiters, so 1 is not found in 12
+                    WHERE relatives.path NOT LIKE '%,' || r.relative_id || ',%'
+                    AND relatives.depth < ?
+                )
+                SELECT 
+                    r.user_id, 
+                    r.relative_id, 
+                    r.relationship_type,
+                    r.verified,
+                    r.relation_id,
+                    r.depth,
+                    u1.name AS user_name,
+                    u1.email AS user_email,
+                    u1.verification_level AS user_verification_level,
+                    u2.name AS relative_name,
+                    u2.email AS relative_email,
+                    u2.verification_level AS relative_verification_level
+                FROM relatives r
+                JOIN users u1 ON r.user_id = u1.id
+                JOIN users u2 ON r.relative_id = u2.id
+                """,
+                (user_id, depth),
+                row_mode='dict'
+            )
+            # A relationship reached over several paths counts at its shallowest
+            # depth. The CTE rows have no index to group or order them by, so
+            # this is done on the (neighbourhood-sized) result instead of in
+            # temporary B-trees.
+            shallowest = {}
+            for row in sorted(rows, key=lambda row: (row['depth'], row['relation_id'])):
+                shallowest.setdefault(row['relation_id'], row)
+            walk = list(shallowest.values())
+        relationships, has_more = _page_edges(walk, user_id, after=cursor, max_nodes=max_nodes)
+        last = relationships[-1] if relationships else None
     
     # Build the family tree
-    nodes = [
-        {
+    nodes = []
+    if cursor is None:
+        nodes.append({
             "id": user_id,
             "name": user["name"],
             "email": user["email"],
@@ -646,50 +3202,82 @@ def get_family_tree(user_id: int) -> Dict[str, Any]:
             "verified": True,
             "pending": False,
             "added_date": user["created_at"]
-        }
-    ]
+        })
     
     links = []
-    processed_users = {user_id}
     
     for rel in relationships:
-        # Add the user node if not already added
-        if rel["user_id"] not in processed_users:
-            nodes.append({
-                "id": rel["user_id"],
-                "name": rel["user_name"],
-                "email": rel["user_email"],
-                "verification_level": rel["user_verification_level"],
-                "verified": True,
-                "pending": False
-            })
-            processed_users.add(rel["user_id"])
-        
-        # Add the relative node if not already added
-        if rel["relative_id"] not in processed_users:
-            nodes.append({
-                "id": rel["relative_id"],
-                "name": rel["relative_name"],
-                "email": rel["relative_email"],
-                "verification_level": rel["relative_verification_level"],
-                "verified": rel["verified"],
-                "pending": not rel["verified"],
-                "relationship": rel["relationship_type"]
-            })
-            processed_users.add(rel["relative_id"])
+        # Add the relative node where the walk first reaches it (earlier
+        # relationships, and earlier pages, have already added the user)
+        if rel["discovered"]:
+            nodes.append(_tree_node(rel))
         
         # Add the link
-        links.append({
-            "id": rel["relation_id"],
-            "source": rel["user_id"],
-            "target": rel["relative_id"],
-            "relationship": rel["relationship_type"],
-            "verified": rel["verified"]
-        })
+        links.append(_tree_link(rel))
     
     return {
         "nodes": nodes,
-        "links": links
+        "links": links,
+        # (0, 0) once the user's own node has been sent
+        "cursor": (last["depth"], last["relation_id"]) if last else cursor or (0, 0),
+        "has_more": has_more,
+        "version": version
+    }
+
+def _tree_node(rel: Dict[str, Any]) -> Dict[str, Any]:
+    """Family tree node for the relative an edge discovers."""
+    return {
+        "id": rel["relative_id"],
+        "name": rel["relative_name"],
+        "email": rel["relative_email"],
+        "verification_level": rel["relative_verification_level"],
+        "verified": rel["verified"],
+        "pending": not rel["verified"],
+        "relationship": rel["relationship_type"]
+    }
+
+def _tree_link(rel: Dict[str, Any]) -> Dict[str, Any]:
+    """Family tree link for an edge."""
+    return {
+        "id": rel["relation_id"],
+        "source": rel["user_id"],
+        "target": rel["relative_id"],
+        "relationship": rel["relationship_type"],
+        "verified": rel["verified"]
+    }
+
+def get_family_tree_changes(user_id: int, since: str, depth: int = 3) -> Dict[str, Any]:
+    """
+    Get the changes to a user's family tree after a version.
+    
+    Args:
+        user_id: User ID
+        since: ``version`` of the tree the caller holds
+        depth: Maximum number of hops the caller loaded
+        
+    Returns:
+        Dictionary with the current ``version``, the added or changed
+        ``nodes`` and ``links``, and the ids of ``removed_nodes`` and
+        ``removed_links``; or ``{"reset": True}`` if the changes are no
+        longer known and the caller must reload the tree
+    """
+    router = get_shards()
+    changes = router.family_changes_since(user_id, since, depth)
+    if changes is None:
+        graph = router.family_graph()
+        return {"reset": True, "version": graph.version if graph is not None else None}
+    
+    edges = changes["edges"]
+    relationships = _with_edge_users(
+        router, edges, {edge['user_id'] for edge in edges} | {edge['relative_id'] for edge in edges}
+    )
+    return {
+        "reset": False,
+        "version": changes["version"],
+        "nodes": [_tree_node(rel) for rel in relationships if rel["discovered"]],
+        "links": [_tree_link(rel) for rel in relationships],
+        "removed_nodes": changes["removed_nodes"],
+        "removed_links": changes["removed_edges"]
     }
 
 def add_family_relationship(user_id: int, relative_email: str, relationship_type: str) -> Dict[str, Any]:
@@ -704,7 +3292,7 @@ def add_family_relationship(user_id: int, relative_email: str, relationship_type
     Returns:
         Dictionary with relationship data or error
     """
-    db = Database()
+    router = get_shards()
     
     # Check if the relative exists
     relative = get_user_by_email(relative_email)
@@ -713,19 +3301,25 @@ def add_family_relationship(user_id: int, relative_email: str, relationship_type
     
     relative_id = relative["id"]
     
-    # Check if the relationship already exists
-    existing = db.fetch_one(
-        "SELECT * FROM family_relationships WHERE user_id = ? AND relative_id = ?",
-        (user_id, relative_id)
-    )
-    
-    if existing:
-        return {"success": False, "error": "Relationship already exists"}
-    
     # Get the inverse relationship type
     inverse_relationship = get_inverse_relationship(relationship_type)
     
-    with db.transaction() as conn:
+    # Each direction lives on its owner's shard. Both directions and the
+    # notification commit together, or not at all (see ShardRouter.transaction
+    # for the cross-shard case).
+    db, relative_db = router.for_id(user_id), router.for_id(relative_id)
+    edges = [(user_id, relative_id, relationship_type), (relative_id, user_id, inverse_relationship)]
+    with _family_closure_transaction(router, edges) as paths:
+        # Check if the relationship already exists (under the write lock, so
+        # a concurrent request cannot insert it in between)
+        existing = db.fetch_one(
+            "SELECT * FROM family_relationships WHERE user_id = ? AND relative_id = ?",
+            (user_id, relative_id)
+        )
+        
+        if existing:
+            return {"success": False, "error": "Relationship already exists"}
+        
         # Add the relationship
         now = int(time.time())
         relationship_id = db.execute_query(
@@ -734,13 +3328,16 @@ def add_family_relationship(user_id: int, relative_email: str, relationship_type
         )
         
         # Add the inverse relationship
-        inverse_id = db.execute_query(
+        inverse_id = relative_db.execute_query(
             "INSERT INTO family_relationships (user_id, relative_id, relationship_type, verified, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) RETURNING id",
             (relative_id, user_id, inverse_relationship, False, now, now)
         )
         
+        # Paths near the new edges can now continue over them
+        _update_family_closure(router, paths, 1)
+        
         # Create a notification for the relative
-        db.execute_query(
+        relative_db.execute_query(
             "INSERT INTO notifications (user_id, type, message, data, read, created_at) VALUES (?, ?, ?, ?, ?, ?)",
             (relative_id, 'family_request', f"New family relationship request: {relationship_type}", f'{{"user_id": {user_id}, "relationship_id": {inverse_id}, "relationship_type": "{inverse_relationship}"}}', False, now)
         )
@@ -764,7 +3361,8 @@ def verify_family_relationship(relationship_id: int) -> Dict[str, Any]:
     Returns:
         Dictionary with status and relationship data
     """
-    db = Database()
+    router = get_shards()
+    db = router.for_id(relationship_id)
     
     # Get the relationship
     relationship = db.fetch_one(
@@ -778,8 +3376,9 @@ def verify_family_relationship(relationship_id: int) -> Dict[str, Any]:
     user_id = relationship["user_id"]
     relative_id = relationship["relative_id"]
     
-    # Get the inverse relationship
-    inverse = db.fetch_one(
+    # Get the inverse relationship (from the relative's shard)
+    relative_db = router.for_id(relative_id)
+    inverse = relative_db.fetch_one(
         "SELECT * FROM family_relationships WHERE user_id = ? AND relative_id = ?",
         (relative_id, user_id)
     )
@@ -787,45 +3386,35 @@ def verify_family_relationship(relationship_id: int) -> Dict[str, Any]:
     if not inverse:
         return {"success": False, "error": "Inverse relationship not found"}
     
-    with db.transaction() as conn:
+    with router.transaction(router.shard_of(user_id), router.shard_of(relative_id)):
         # Mark both relationships as verified
         now = int(time.time())
         
-        conn.execute(
+        db.execute_query(
             "UPDATE family_relationships SET verified = TRUE, updated_at = ? WHERE id = ?",
             (now, relationship_id)
         )
         
-        conn.execute(
+        relative_db.execute_query(
             "UPDATE family_relationships SET verified = TRUE, updated_at = ? WHERE id = ?",
             (now, inverse["id"])
         )
         
-        # Count how many verified relationships the user has
-        result = conn.execute(
-            "SELECT COUNT(*) as count FROM family_relationships WHERE user_id = ? AND verified = TRUE",
-            (user_id,)
-        ).fetchone()
-        
-        verified_count = result["count"]
-        
-        # Update verification level if enough verified relationships
-        if verified_count >= 2:
-            conn.execute(
-                """
-                UPDATE users 
-                SET verification_level = CASE
-                    WHEN verification_level < 3 THEN 3
-                    ELSE verification_level
-                END,
-                updated_at = ?
-                WHERE id = ?
-                """,
-                (now, user_id)
-            )
+        # Update verification level if enough verified relationships. The
+        # triggers have already counted the two rows verified above.
+        db.execute_query(
+            """
+            UPDATE users 
+            SET verification_level = 3, updated_at = ?
+            WHERE id = ? AND verified_relationship_count >= 2 AND verification_level < 3
+            """,
+            (now, user_id)
+        )
+        db.invalidate_user(user_id)
+        relative_db.invalidate_user(relative_id)
         
         # Create a notification for the relative
-        conn.execute(
+        relative_db.execute_query(
             "INSERT INTO notifications (user_id, type, message, data, read, created_at) VALUES (?, ?, ?, ?, ?, ?)",
             (relative_id, 'family_verified', f"Family relationship verified", f'{{"user_id": {user_id}, "relationship_id": {inverse["id"]}}}', False, now)
         )
@@ -848,7 +3437,8 @@ def remove_family_relationship(relationship_id: int) -> Dict[str, Any]:
     Returns:
         Dictionary with status and removed relationship data
     """
-    db = Database()
+    router = get_shards()
+    db = router.for_id(relationship_id)
     
     # Get the relationship
     relationship = db.fetch_one(
@@ -862,51 +3452,47 @@ def remove_family_relationship(relationship_id: int) -> Dict[str, Any]:
     user_id = relationship["user_id"]
     relative_id = relationship["relative_id"]
     
-    # Get the inverse relationship
-    inverse = db.fetch_one(
+    # Get the inverse relationship (from the relative's shard)
+    relative_db = router.for_id(relative_id)
+    inverse = relative_db.fetch_one(
         "SELECT * FROM family_relationships WHERE user_id = ? AND relative_id = ?",
         (relative_id, user_id)
     )
     
-    with db.transaction() as conn:
+    edges = [(user_id, relative_id, relationship["relationship_type"])]
+    if inverse:
+        edges.append((relative_id, user_id, inverse["relationship_type"]))
+    with _family_closure_transaction(router, edges) as paths:
         # Delete both relationships
-        conn.execute(
+        db.execute_query(
             "DELETE FROM family_relationships WHERE id = ?",
             (relationship_id,)
         )
         
         if inverse:
-            conn.execute(
+            relative_db.execute_query(
                 "DELETE FROM family_relationships WHERE id = ?",
                 (inverse["id"],)
             )
         
-        # Count how many verified relationships the user has now
-        result = conn.execute(
-            "SELECT COUNT(*) as count FROM family_relationships WHERE user_id = ? AND verified = TRUE",
-            (user_id,)
-        ).fetchone()
-        
-        verified_count = result["count"]
+        _update_family_closure(router, paths, -1)
         
         # Update verification level if not enough verified relationships
-        if verified_count < 2:
-            conn.execute(
-                """
-                UPDATE users 
-                SET verification_level = CASE
-                    WHEN verification_level = 3 THEN 2
-                    ELSE verification_level
-                END,
-                updated_at = ?
-                WHERE id = ?
-                """,
-                (int(time.time()), user_id)
-            )
+        # remain (the triggers keep verified_relationship_count current)
+        db.execute_query(
+            """
+            UPDATE users 
+            SET verification_level = 2, updated_at = ?
+            WHERE id = ? AND verified_relationship_count < 2 AND verification_level = 3
+            """,
+            (int(time.time()), user_id)
+        )
+        db.invalidate_user(user_id)
+        relative_db.invalidate_user(relative_id)
         
         # Create a notification for the relative
         if inverse:
-            conn.execute(
+            relative_db.execute_query(
                 "INSERT INTO notifications (user_id, type, message, data, read, created_at) VALUES (?, ?, ?, ?, ?, ?)",
                 (relative_id, 'family_removed', f"Family relationship removed", f'{{"user_id": {user_id}}}', False, int(time.time()))
             )
@@ -952,30 +3538,34 @@ def get_verification_requests(user_id: int, include_completed: bool = False) ->
     Returns:
         List of verification request data
     """
-    db = Database()
+    router = get_shards()
+    db = router.for_id(user_id)
+    status_filter = "" if include_completed else "AND v.status = 'pending'"
     
-    if include_completed:
-        return db.fetch_all(
-            """
-            SELECT v.*, u.name as verifier_name
-            FROM verification_requests v
-            LEFT JOIN users u ON v.verifier_id = u.id
-            WHERE v.user_id = ?
-            ORDER BY v.created_at DESC
-            """,
-            (user_id,)
-        )
-    else:
+    if router.count == 1:
         return db.fetch_all(
-            """
+            f"""
             SELECT v.*, u.name as verifier_name
             FROM verification_requests v
             LEFT JOIN users u ON v.verifier_id = u.id
-            WHERE v.user_id = ? AND v.status = 'pending'
+            WHERE v.user_id = ? {status_filter}
             ORDER BY v.created_at DESC
             """,
-            (user_id,)
+            (user_id,),
+            row_mode='dict'
         )
+    
+    # Verifiers may live on other shards
+    requests = db.fetch_all(
+        f"SELECT v.* FROM verification_requests v WHERE v.user_id = ? {status_filter} ORDER BY v.created_at DESC",
+        (user_id,),
+        row_mode='dict'
+    )
+    verifiers = _users_by_id(router, (v['verifier_id'] for v in requests if v['verifier_id'] is not None))
+    for request in requests:
+        verifier = verifiers.get(request['verifier_id'])
+        request['verifier_name'] = verifier['name'] if verifier else None
+    return requests
 
 def create_verification_request(user_id: int, verification_type: str, data: str = None) -> int:
     """
@@ -989,7 +3579,7 @@ def create_verification_request(user_id: int, verification_type: str, data: str
     Returns:
         Verification request ID
     """
-    db = Database()
+    db = get_shards().for_id(user_id)
     
     now = int(time.time())
     request_data = {
@@ -1019,10 +3609,11 @@ def get_did_document(user_id: int) -> Optional[Dict[str, Any]]:
     Returns:
         DID document data or None if not found
     """
-    db = Database()
+    db = get_shards().for_id(user_id)
     return db.fetch_one(
         "SELECT * FROM did_documents WHERE user_id = ?",
-        (user_id,)
+        (user_id,),
+        row_mode='dict'
     )
 
 def get_did_by_identifier(did_identifier: str) -> Optional[Dict[str, Any]]:
@@ -1035,11 +3626,16 @@ def get_did_by_identifier(did_identifier: str) -> Optional[Dict[str, Any]]:
     Returns:
         DID document data or None if not found
     """
-    db = Database()
-    return db.fetch_one(
-        "SELECT * FROM did_documents WHERE identifier = ?",
-        (did_identifier,)
-    )
+    # Identifiers carry no shard, so look on every shard (one indexed lookup each)
+    for db in get_shards().shards:
+        document = db.fetch_one(
+            "SELECT * FROM did_documents WHERE identifier = ?",
+            (did_identifier,),
+            row_mode='dict'
+        )
+        if document:
+            return document
+    return None
 
 def create_did_document(user_id: int, identifier: str, document: str, keys: str = None) -> int:
     """
@@ -1054,7 +3650,7 @@ def create_did_document(user_id: int, identifier: str, document: str, keys: str
     Returns:
         DID document ID
     """
-    db = Database()
+    db = get_shards().for_id(user_id)
     
     now = int(time.time())
     did_data = {
@@ -1066,13 +3662,16 @@ def create_did_document(user_id: int, identifier: str, document: str, keys: str
         'updated_at': now
     }
     
-    return db.execute_query(
+    did_id = db.execute_query(
         "INSERT INTO did_documents ({}) VALUES ({}) RETURNING id".format(
             ', '.join(did_data.keys()),
             ', '.join(['?'] * len(did_data))
         ),
         tuple(did_data.values())
     )
+    # The insert trigger bumped users.did_count
+    db.invalidate_user(user_id)
+    return did_id
 
 def add_notification(user_id: int, notification_type: str, message: str, data: str = None) -> int:
     """
@@ -1087,7 +3686,7 @@ def add_notification(user_id: int, notification_type: str, message: str, data: s
     Returns:
         Notification ID
     """
-    db = Database()
+    db = get_shards().for_id(user_id)
     
     notification_data = {
         'user_id': user_id,
@@ -1117,17 +3716,19 @@ def get_notifications(user_id: int, unread_only: bool = False) -> List[Dict[str,
     Returns:
         List of notification data
     """
-    db = Database()
+    db = get_shards().for_id(user_id)
     
     if unread_only:
         return db.fetch_all(
             "SELECT * FROM notifications WHERE user_id = ? AND read = 0 ORDER BY created_at DESC",
-            (user_id,)
+            (user_id,),
+            row_mode='dict'
         )
     else:
         return db.fetch_all(
             "SELECT * FROM notifications WHERE user_id = ? ORDER BY created_at DESC LIMIT 50",
-            (user_id,)
+            (user_id,),
+            row_mode='dict'
         )
 
 def mark_notification_read(notification_id: int) -> bool:
@@ -1140,7 +3741,7 @@ def mark_notification_read(notification_id: int) -> bool:
     Returns:
         True if successful, False otherwise
     """
-    db = Database()
+    db = get_shards().for_id(notification_id)
     rows_affected = db.execute_query(
         "UPDATE notifications SET read = TRUE WHERE id = ?",
         (notification_id,)
@@ -1157,13 +3758,9 @@ def mark_all_notifications_read(user_id: int) -> bool:
     Returns:
         True if successful, False otherwise
     """
-    db = Database()
+    db = get_shards().for_id(user_id)
     rows_affected = db.execute_query(
         "UPDATE notifications SET read = TRUE WHERE user_id = ? AND read = 0",
         (user_id,)
     )
     return rows_affected > 0
-
-
-# Initialize the database singleton
-db = Database() 
\ No newline at end of file
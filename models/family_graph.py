@@ -0,0 +1,522 @@
+"""
+Process-resident index of the family relationship graph.
+
+FamilyGraph holds the ``family_relationships`` edges in compressed sparse
+row (CSR) form. User ids are mapped to dense node numbers. The outgoing
+edges of node ``n`` are positions ``offsets[n]`` to ``offsets[n + 1]`` of the
+parallel edge arrays, which store the relative's node number, the
+relationship id, the verified flag and an interned relationship type.
+Everything is held in ``array``/``bytearray`` storage: a few dozen bytes
+per edge and no Python object per relationship.
+
+CSR arrays cannot grow in place, so edges added after the last build go to
+a small per-node overlay and removed edges are tombstoned. The overlay is
+folded back into the arrays once it reaches ``compact_threshold`` changes.
+
+A tree query is a breadth-first search over the arrays that records the
+users it reaches in a set. Its cost depends on the size of the user's
+neighbourhood, not on the size of the table, and a paged query stops as
+soon as its page is full.
+
+The graph does not watch the database itself. Triggers record every change
+to ``family_relationships`` in the ``family_changes`` log, whichever process
+or statement made it, and apply() replays the log from the last position
+the graph has seen.
+
+Those positions, one per shard, are the graph's version. They are assigned
+by the database, so every process agrees on what a version means. Given
+the log rows written after a client's version, changes_since() undoes them
+to walk a user's neighbourhood as it was at that version, so clients can
+fetch the difference instead of the whole tree.
+"""
+
+import threading
+from array import array
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+# Deepest walk served, whatever the caller asks for
+MAX_DEPTH = 250
+
+class FamilyGraph:
+    """
+    CSR adjacency index of family relationships, safe for concurrent use.
+    """
+
+    def __init__(self, compact_threshold: int = 1024):
+        """
+        Initialize an empty graph.
+
+        Args:
+            compact_threshold: Incremental changes kept in the overlay before
+                the arrays are rebuilt
+        """
+        self.compact_threshold = compact_threshold
+        self.lock = threading.RLock()
+        self.loaded = False
+        # Per shard, the last family_changes version replayed into the graph
+        self.positions: List[int] = []
+        self._reset()
+
+    @property
+    def version(self) -> str:
+        """The graph's positions in the shards' change logs, as a token like '42' or '42.1099511627790'."""
+        with self.lock:
+            return '.'.join(str(position) for position in self.positions)
+
+    def _reset(self) -> None:
+        # Dense node numbering
+        self.index: Dict[int, int] = {}
+        self.node_ids = array('q')
+        # CSR arrays; offsets has one entry more than there are nodes
+        self.offsets = array('q', [0])
+        self.targets = array('q')
+        self.edge_ids = array('q')
+        self.verified = bytearray()
+        self.types = array('H')
+        self.type_names: List[str] = []
+        self.type_index: Dict[str, int] = {}
+        # Changes since the last build: node -> [[target, edge id, verified, type]]
+        self.added: Dict[int, List[list]] = {}
+        self.removed = set()
+        self.changes = 0
+
+    def __len__(self) -> int:
+        """Number of live edges."""
+        return len(self.edge_ids) - len(self.removed) + sum(len(edges) for edges in self.added.values())
+
+    def _node(self, user_id: int) -> int:
+        node = self.index.get(user_id)
+        if node is None:
+            node = len(self.node_ids)
+            self.index[user_id] = node
+            self.node_ids.append(user_id)
+            # A new node starts with an empty slice of the arrays
+            self.offsets.append(self.offsets[-1])
+        return node
+
+    def _type(self, relationship_type: str) -> int:
+        code = self.type_index.get(relationship_type)
+        if code is None:
+            code = len(self.type_names)
+            self.type_index[relationship_type] = code
+            self.type_names.append(relationship_type)
+        return code
+
+    def build(self, edges: Iterable[Dict[str, Any]], positions: Optional[List[int]] = None) -> None:
+        """
+        Replace the graph with the given edges.
+
+        Args:
+            edges: Rows with id, user_id, relative_id, relationship_type and verified
+            positions: Per shard, the last family_changes version written
+                before the edges were read
+        """
+        rows = sorted(
+            (row['user_id'], row['id'], row['relative_id'], row['relationship_type'], row['verified'])
+            for row in edges
+        )
+        with self.lock:
+            self._reset()
+            self._load(rows)
+            self.positions = list(positions or [])
+            self.loaded = True
+
+    def _load(self, rows: List[Tuple[int, int, int, str, int]]) -> None:
+        """Fill the CSR arrays from (user_id, id, relative_id, type, verified) sorted by user."""
+        for user_id, _, relative_id, _, _ in rows:
+            self._node(user_id)
+            self._node(relative_id)
+        counts = array('q', bytes(8 * len(self.node_ids)))
+        for user_id, _, _, _, _ in rows:
+            counts[self.index[user_id]] += 1
+
+        offsets = array('q', [0])
+        for count in counts:
+            offsets.append(offsets[-1] + count)
+        self.offsets = offsets
+
+        # Rows are sorted by user id, but node numbers follow first appearance,
+        # so place each edge at the next free position of its node's slice
+        cursor = array('q', offsets[:-1])
+        size = len(rows)
+        self.targets = array('q', bytes(8 * size))
+        self.edge_ids = array('q', bytes(8 * size))
+        self.verified = bytearray(size)
+        self.types = array('H', bytes(2 * size))
+        for user_id, edge_id, relative_id, relationship_type, verified in rows:
+            node = self.index[user_id]
+            position = cursor[node]
+            cursor[node] += 1
+            self.targets[position] = self.index[relative_id]
+            self.edge_ids[position] = edge_id
+            self.verified[position] = 1 if verified else 0
+            self.types[position] = self._type(relationship_type)
+
+    def _edges(self) -> List[Tuple[int, int, int, str, int]]:
+        """Every live edge as (user_id, id, relative_id, type, verified)."""
+        rows = []
+        for node, user_id in enumerate(self.node_ids):
+            for target, edge_id, verified, code in self._neighbors(node):
+                rows.append((user_id, edge_id, self.node_ids[target], self.type_names[code], verified))
+        return rows
+
+    def compact(self) -> None:
+        """Fold the overlay of incremental changes back into the CSR arrays."""
+        with self.lock:
+            rows = sorted(self._edges())
+            # Keep the type codes, so codes read before the compaction stay valid
+            type_names, type_index = self.type_names, self.type_index
+            self._reset()
+            self.type_names, self.type_index = type_names, type_index
+            self._load(rows)
+
+    def _changed(self) -> None:
+        self.changes += 1
+        if self.changes >= self.compact_threshold:
+            self.compact()
+
+    def _neighbors(self, node: int):
+        """Yield (target node, edge id, verified, type code) for a node's outgoing edges."""
+        removed = self.removed
+        for position in range(self.offsets[node], self.offsets[node + 1]):
+            edge_id = self.edge_ids[position]
+            if removed and edge_id in removed:
+                continue
+            yield self.targets[position], edge_id, self.verified[position], self.types[position]
+        for target, edge_id, verified, code in self.added.get(node, ()):
+            yield target, edge_id, verified, code
+
+    def _position(self, node: int, edge_id: int) -> int:
+        """Find an edge in a node's slice of the arrays, or -1."""
+        for position in range(self.offsets[node], self.offsets[node + 1]):
+            if self.edge_ids[position] == edge_id:
+                return position
+        return -1
+
+    def add_edge(self, edge_id: int, user_id: int, relative_id: int,
+                 relationship_type: str, verified: bool = False) -> None:
+        """
+        Add a relationship (a no-op if it is already indexed).
+
+        Args:
+            edge_id: Relationship id
+            user_id: Owning user
+            relative_id: Related user
+            relationship_type: Type of relationship
+            verified: Whether it is verified
+        """
+        with self.lock:
+            node = self._node(user_id)
+            if (self._position(node, edge_id) >= 0 and edge_id not in self.removed) or \
+                    any(edge[1] == edge_id for edge in self.added.get(node, ())):
+                return
+            code = self._type(relationship_type)
+            flag = 1 if verified else 0
+            self.added.setdefault(node, []).append([self._node(relative_id), edge_id, flag, code])
+            self._changed()
+
+    def remove_edge(self, edge_id: int, user_id: int) -> None:
+        """
+        Remove a relationship.
+
+        Args:
+            edge_id: Relationship id
+            user_id: Owning user
+        """
+        with self.lock:
+            node = self.index.get(user_id)
+            if node is None:
+                return
+            overlay = self.added.get(node, [])
+            for edge in overlay:
+                if edge[1] == edge_id:
+                    overlay.remove(edge)
+                    break
+            else:
+                position = self._position(node, edge_id)
+                if position < 0 or edge_id in self.removed:
+                    return
+                self.removed.add(edge_id)
+            self._changed()
+
+    def set_verified(self, edge_id: int, user_id: int, verified: bool = True) -> None:
+        """
+        Mark a relationship verified (or unverified).
+
+        Args:
+            edge_id: Relationship id
+            user_id: Owning user
+            verified: New verified flag
+        """
+        flag = 1 if verified else 0
+        with self.lock:
+            node = self.index.get(user_id)
+            if node is None:
+                return
+            position = self._position(node, edge_id)
+            if position >= 0 and edge_id not in self.removed:
+                self.verified[position] = flag
+                return
+            for edge in self.added.get(node, ()):
+                if edge[1] == edge_id:
+                    edge[2] = flag
+                    return
+
+    def apply(self, shard: int, changes: Iterable[Dict[str, Any]]) -> None:
+        """
+        Replay rows of a shard's family_changes log, in version order.
+
+        Each change sets the edge to its state after the change, so changes
+        the loaded edges already include replay as no-ops and the log can be
+        replayed from a position read before the edges.
+
+        Args:
+            shard: Index of the shard the changes were read from
+            changes: Rows with version, relationship_id, user_id, relative_id,
+                relationship_type, verified_before and verified_after (None
+                when the edge did not exist before or after the change)
+        """
+        with self.lock:
+            for change in changes:
+                edge_id, user_id = change['relationship_id'], change['user_id']
+                if change['verified_after'] is None:
+                    self.remove_edge(edge_id, user_id)
+                elif change['verified_before'] is None:
+                    self.add_edge(edge_id, user_id, change['relative_id'], change['relationship_type'],
+                                  bool(change['verified_after']))
+                else:
+                    self.set_verified(edge_id, user_id, bool(change['verified_after']))
+                self.positions[shard] = change['version']
+
+    def traverse(self, user_id: int, max_depth: int = 3) -> List[Dict[str, Any]]:
+        """
+        Collect the relationships within max_depth hops of a user.
+
+        Args:
+            user_id: Root user ID
+            max_depth: Maximum number of hops
+
+        Returns:
+            Edges in breadth-first order (see page())
+        """
+        return self.page(user_id, max_depth)[0]
+
+    def page(self, user_id: int, max_depth: int = 3, after: Optional[Tuple[int, int]] = None,
+             max_nodes: Optional[int] = None) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Collect one page of the relationships within max_depth hops of a user.
+
+        Level by level from the user, every edge leaving a user reached on
+        the previous level is included, except edges back to users reached
+        on an earlier level. Edges are ordered by (depth, relationship id),
+        so the edges of a shallower walk are a prefix of a deeper one and a
+        page can be resumed after its last edge even if the graph changed
+        in between.
+
+        Args:
+            user_id: Root user ID
+            max_depth: Maximum number of hops
+            after: (depth, relationship id) of the last edge delivered by
+                earlier pages, or None to start from the user
+            max_nodes: Stop before the edge that would reach more than this
+                many new users after ``after`` (None for no limit)
+
+        Returns:
+            Tuple of the edges, each with relation_id, user_id, relative_id,
+            relationship_type, verified, depth and ``discovered`` (whether it
+            reaches its relative for the first time), and whether the walk
+            stopped early because of max_nodes
+        """
+        max_depth = min(max_depth, MAX_DEPTH)
+        after = after or (0, 0)
+        with self.lock:
+            root = self.index.get(user_id)
+            if root is None:
+                return [], False
+            # Nodes reached so far; sized by the neighbourhood rather than
+            # by the whole graph
+            visited = {root}
+            node_ids, type_names = self.node_ids, self.type_names
+            edges = []
+            discovered = 0
+            frontier = [root]
+            for depth in range(1, max_depth + 1):
+                if not frontier:
+                    break
+                level = []
+                for source in frontier:
+                    for target, edge_id, verified, code in self._neighbors(source):
+                        if target not in visited:
+                            level.append((edge_id, source, target, verified, code))
+                # Users first reached on this level are discovered by their
+                # lowest relationship id, whatever order the index holds them in
+                level.sort()
+                frontier = []
+                for edge_id, source, target, verified, code in level:
+                    new = target not in visited
+                    if new:
+                        visited.add(target)
+                        frontier.append(target)
+                    if (depth, edge_id) <= after:
+                        continue
+                    if new:
+                        if max_nodes is not None and discovered >= max_nodes:
+                            return edges, True
+                        discovered += 1
+                    edges.append({
+                        'relation_id': edge_id,
+                        'user_id': node_ids[source],
+                        'relative_id': node_ids[target],
+                        'relationship_type': type_names[code],
+                        'verified': verified,
+                        'depth': depth,
+                        'discovered': new
+                    })
+            return edges, False
+
+    def neighbors(self, user_ids: Iterable[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Get the relationships of some users.
+
+        Args:
+            user_ids: Users to look up
+
+        Returns:
+            Dictionary mapping each user with relationships to its edges,
+            with relation_id, user_id, relative_id, relationship_type and verified
+        """
+        with self.lock:
+            edges = {}
+            for user_id in user_ids:
+                node = self.index.get(user_id)
+                if node is None:
+                    continue
+                edges[user_id] = [
+                    {
+                        'relation_id': edge_id,
+                        'user_id': user_id,
+                        'relative_id': self.node_ids[target],
+                        'relationship_type': self.type_names[code],
+                        'verified': verified
+                    }
+                    for target, edge_id, verified, code in self._neighbors(node)
+                ]
+            return edges
+
+    def _walk(self, user_id: int, max_depth: int,
+              undo: Optional[Dict[int, tuple]] = None) -> Dict[int, tuple]:
+        """
+        Walk a user's neighbourhood like page(), optionally as it was before
+        some changes.
+
+        Args:
+            user_id: Root user ID
+            max_depth: Maximum number of hops
+            undo: Edge id -> (user id, relative id, type code, verified) of
+                edges to restore to an earlier state; verified None means
+                the edge did not exist
+
+        Returns:
+            Edge id -> (user id, relative id, type code, verified, discovered)
+        """
+        restored = {}
+        for edge_id, (source, target, code, verified) in (undo or {}).items():
+            if verified is not None:
+                restored.setdefault(source, []).append((target, edge_id, verified, code))
+
+        reached = {user_id}
+        edges = {}
+        frontier = [user_id]
+        for _ in range(min(max_depth, MAX_DEPTH)):
+            if not frontier:
+                break
+            level = []
+            for source in frontier:
+                node = self.index.get(source)
+                neighbors = [] if node is None else [
+                    (self.node_ids[target], edge_id, verified, code)
+                    for target, edge_id, verified, code in self._neighbors(node)
+                    if not undo or edge_id not in undo
+                ]
+                for target, edge_id, verified, code in neighbors + restored.get(source, []):
+                    if target not in reached:
+                        level.append((edge_id, source, target, verified, code))
+            # Same order as page(), so the same edges discover the same users
+            level.sort()
+            frontier = []
+            for edge_id, source, target, verified, code in level:
+                new = target not in reached
+                if new:
+                    reached.add(target)
+                    frontier.append(target)
+                edges[edge_id] = (source, target, code, verified, new)
+        return edges
+
+    def changes_since(self, user_id: int, changes: Iterable[Dict[str, Any]],
+                      max_depth: int = 3) -> Dict[str, Any]:
+        """
+        Get how a user's neighbourhood changed over some change log rows.
+
+        Args:
+            user_id: Root user ID
+            changes: The family_changes rows written after the version the
+                caller's copy of the neighbourhood was read at, up to the
+                graph's positions, in version order
+            max_depth: Maximum number of hops
+
+        Returns:
+            Dictionary with the 'edges' that were added or changed (as
+            returned by page()), and the 'removed_edges' and 'removed_nodes' ids
+        """
+        with self.lock:
+            # State of every edge touched by the changes, before the first one
+            undo = {}
+            for change in changes:
+                if change['relationship_id'] not in undo:
+                    undo[change['relationship_id']] = (
+                        change['user_id'], change['relative_id'],
+                        self._type(change['relationship_type']), change['verified_before']
+                    )
+            result = {'edges': [], 'removed_edges': [], 'removed_nodes': []}
+            if not undo:
+                return result
+
+            old, new = self._walk(user_id, max_depth, undo), self._walk(user_id, max_depth)
+            old_nodes = {edge[1]: edge for edge in old.values() if edge[4]}
+            new_nodes = {edge[1]: edge for edge in new.values() if edge[4]}
+            for edge_id, edge in new.items():
+                source, target, code, verified, discovered = edge
+                previous = old.get(edge_id)
+                # A node's attributes come from the edge that discovers it
+                if previous is not None and previous[:4] == edge[:4] and \
+                        (not discovered or old_nodes.get(target) == edge):
+                    continue
+                result['edges'].append({
+                    'relation_id': edge_id,
+                    'user_id': source,
+                    'relative_id': target,
+                    'relationship_type': self.type_names[code],
+                    'verified': verified,
+                    'discovered': discovered
+                })
+            result['removed_edges'] = [edge_id for edge_id in old if edge_id not in new]
+            result['removed_nodes'] = [node for node in old_nodes if node not in new_nodes]
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get index statistics.
+
+        Returns:
+            Dictionary with node and edge counts, overlay size and array memory
+        """
+        with self.lock:
+            arrays = (self.node_ids, self.offsets, self.targets, self.edge_ids, self.types)
+            return {
+                'loaded': self.loaded,
+                'nodes': len(self.node_ids),
+                'edges': len(self),
+                'pending_changes': self.changes,
+                'version': self.version,
+                'bytes': sum(a.itemsize * len(a) for a in arrays) + len(self.verified)
+            }
@@ -0,0 +1,175 @@
+"""
+Hardware PRAGMA profiles for SQLite connections.
+
+A profile sets the per-connection page cache and memory map of the
+connections opened by ConnectionPool. The named profiles were tuned by hand
+for Apple silicon machines. The 'auto' profile is sized on Linux from the
+memory the process can actually use, which is the smaller of the host's
+available memory and the cgroup limit of the container it runs in.
+"""
+
+import os
+import logging
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger('database')
+
+HARDWARE_PROFILES = {
+    'm1': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -8000,      # 8MB cache
+        'mmap_size': 20000000000, # 20GB memory map
+    },
+    'm2': {
+        'journal_mode': 'WAL',       # Write-Ahead Logging for better concurrency
+        'synchronous': 'NORMAL',     # Balance between safety and performance
+        'cache_size': -10000,        # 10MB cache (negative value means kilobytes)
+        'mmap_size': 30000000000,    # 30GB memory map for faster reads
+        'temp_store': 'MEMORY',      # Store temp tables and indices in memory
+        'foreign_keys': 'ON',        # Maintain referential integrity
+        'auto_vacuum': 'INCREMENTAL' # Incremental vacuuming to manage free space
+    },
+    'm2_pro': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,     # 20MB cache
+        'mmap_size': 40000000000, # 40GB memory map
+    },
+    'safe': {
+        'journal_mode': 'DELETE', # Traditional rollback journal
+        'synchronous': 'FULL',    # Maximum durability
+        'cache_size': -2000,      # 2MB cache
+        'mmap_size': 0,           # No memory mapping
+    },
+    # Used where memory cannot be detected: the pool's historical settings
+    'default': {
+        'synchronous': 'NORMAL',
+        'cache_size': 10000,      # 10000 pages
+        'mmap_size': 0,
+    }
+}
+
+# PRAGMAs a pool applies from a profile. Journal mode stays WAL (read/write
+# split relies on it), foreign keys follow the pool's own flag and
+# auto_vacuum only takes effect on an empty database.
+POOL_PRAGMAS = ('synchronous', 'cache_size', 'mmap_size', 'temp_store')
+
+# Share of usable memory given to page caches and to memory maps
+CACHE_MEMORY_FRACTION = 1 / 32
+MMAP_MEMORY_FRACTION = 1 / 4
+
+MIN_CACHE_KIB = 2 * 1024
+MAX_CACHE_KIB = 64 * 1024
+MAX_MMAP_BYTES = 4 * 1024 ** 3
+# Below this much usable memory memory-mapped I/O is not worth the page cache pressure
+MIN_MMAP_MEMORY = 512 * 1024 ** 2
+
+# cgroup v2 and v1 memory limit files; v1 reports "no limit" as a huge number
+CGROUP_LIMIT_FILES = ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+
+def _read_meminfo(path: str = '/proc/meminfo') -> Optional[int]:
+    """Get MemAvailable (or MemTotal on old kernels) in bytes."""
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                values[key] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return values.get('MemAvailable', values.get('MemTotal'))
+
+def _read_cgroup_limit(paths=CGROUP_LIMIT_FILES) -> Optional[int]:
+    """Get the memory limit of this process's cgroup in bytes, if it has one."""
+    for path in paths:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value == 'max':
+            return None
+        try:
+            limit = int(value)
+        except ValueError:
+            continue
+        # cgroup v1 spells "unlimited" as a page-rounded LONG_MAX
+        return limit if limit < 1 << 60 else None
+    return None
+
+def usable_memory() -> Optional[int]:
+    """
+    Get the memory this process can use.
+
+    Returns:
+        The smaller of available host memory and the cgroup limit in bytes,
+        or None where it cannot be determined (e.g. outside Linux)
+    """
+    available = _read_meminfo()
+    limit = _read_cgroup_limit()
+    candidates = [value for value in (available, limit) if value]
+    return min(candidates) if candidates else None
+
+def derive_profile(memory: int, connections: int = 1) -> Dict[str, Any]:
+    """
+    Size a profile for the given usable memory.
+
+    Args:
+        memory: Usable memory in bytes
+        connections: Connections sharing the cache budget
+
+    Returns:
+        Dictionary of PRAGMA settings
+    """
+    cache_kib = int(memory * CACHE_MEMORY_FRACTION / max(connections, 1) / 1024)
+    cache_kib = max(MIN_CACHE_KIB, min(MAX_CACHE_KIB, cache_kib))
+    mmap_size = 0
+    if memory >= MIN_MMAP_MEMORY:
+        # Mapped pages are shared by every connection to the file
+        mmap_size = min(MAX_MMAP_BYTES, int(memory * MMAP_MEMORY_FRACTION))
+    return {
+        'synchronous': 'NORMAL',
+        'cache_size': -cache_kib,
+        'mmap_size': mmap_size,
+        'temp_store': 'MEMORY',
+    }
+
+def resolve_profile(name: Optional[str] = None, connections: int = 1) -> Dict[str, Any]:
+    """
+    Select the PRAGMA profile for a connection pool.
+
+    Args:
+        name: Profile name, or 'auto' to size one from usable memory
+            (defaults to DATABASE_PROFILE)
+        connections: Connections in the pool, which share the cache budget
+
+    Returns:
+        Dictionary with the profile 'name', the 'pragmas' a pool applies and,
+        for 'auto', the 'memory' it was sized from
+    """
+    if name is None:
+        try:
+            from flask import current_app
+            config = current_app.config
+        except (RuntimeError, ImportError):
+            # Working outside of application context
+            config = {}
+        name = config.get('DATABASE_PROFILE', os.environ.get('DATABASE_PROFILE', 'auto'))
+
+    memory = None
+    if name == 'auto':
+        memory = usable_memory()
+        if memory is None:
+            logger.debug("Usable memory unknown, using the default SQLite profile")
+            name = 'default'
+    elif name not in HARDWARE_PROFILES:
+        raise ValueError(f"Unknown database profile {name!r}, expected 'auto' or one of "
+                         f"{tuple(HARDWARE_PROFILES)}")
+
+    settings = derive_profile(memory, connections) if memory is not None else HARDWARE_PROFILES[name]
+    return {
+        'name': name,
+        'pragmas': {pragma: settings[pragma] for pragma in POOL_PRAGMAS if pragma in settings},
+        'memory': memory
+    }
@@ -0,0 +1,558 @@
+"""
+Index advisor for the Proof of Humanity database.
+
+Collects every SQL statement in models/database.py, runs it through
+EXPLAIN QUERY PLAN against a representative database, flags full table
+scans and temporary B-trees, and proposes composite, covering and partial
+indexes for them. Accepted proposals are added to models/migrations.py as
+a versioned migration and applied with ``--apply``.
+
+Usage:
+    python -m models.index_advisor                 # synthetic database, all migrations
+    python -m models.index_advisor --baseline      # synthetic database, tables only
+    python -m models.index_advisor --database instance/poh.sqlite --apply
+"""
+
+import os
+import re
+import ast
+import sys
+import random
+import argparse
+import tempfile
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+
+from models.database import Database, close_all_databases
+from models.migrations import MIGRATIONS, apply_migrations
+
+logger = logging.getLogger('database')
+
+# Statements whose access paths the advisor analyzes
+_ANALYZABLE_RE = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE)\b', re.IGNORECASE)
+_TABLE_RE = re.compile(r'\b(?:FROM|JOIN|UPDATE)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?', re.IGNORECASE)
+_SET_CLAUSE_RE = re.compile(r'\bSET\b.*?(?=\bWHERE\b|$)', re.IGNORECASE | re.DOTALL)
+_PREDICATE_RE = re.compile(
+    r"(?:\b([A-Za-z_]\w*)\.)?\b([A-Za-z_]\w*)\s*(=|<=|>=|<|>|\bIN\b)\s*(\?|\(|'[^']*'|-?\d+(?:\.\d+)?|TRUE\b|FALSE\b)",
+    re.IGNORECASE
+)
+_JOIN_PREDICATE_RE = re.compile(r'\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\s*=\s*([A-Za-z_]\w*)\.([A-Za-z_]\w*)')
+_ORDER_BY_RE = re.compile(r'\bORDER\s+BY\s+(.+?)(?=\bLIMIT\b|\)|;|$)', re.IGNORECASE | re.DOTALL)
+_ORDER_TERM_RE = re.compile(r'^\s*(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)(?:\s+(?:ASC|DESC))?\s*$', re.IGNORECASE)
+_SELECT_LIST_RE = re.compile(r'^\s*SELECT\s+(?:DISTINCT\s+)?(.+?)\s+FROM\b', re.IGNORECASE | re.DOTALL)
+_SCAN_RE = re.compile(r'^SCAN (\w+)(?: USING (COVERING )?INDEX\b)?')
+# Clauses an index can serve; a statement with none of them reads whole tables by design
+_FILTER_RE = re.compile(r'\b(WHERE|JOIN|ORDER\s+BY|GROUP\s+BY)\b', re.IGNORECASE)
+# str.format() placeholders in query templates, such as IN ({ids})
+_TEMPLATE_RE = re.compile(r'\{\w*\}')
+
+# Sample binding substituted for an interpolated id list
+SAMPLE_ID_LIST = '?, ?, ?'
+# A placeholder right after one of these stands for an identifier, which has no sample
+_IDENTIFIER_POSITION_RE = re.compile(r'\b(FROM|JOIN|UPDATE|INTO|SET|WHERE|ON|BY|AND|OR)\s*$', re.IGNORECASE)
+
+# Words the table regex can mistake for an alias
+_RESERVED = {
+    'WHERE', 'ON', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'CROSS', 'NATURAL', 'ORDER',
+    'GROUP', 'LIMIT', 'UNION', 'SET', 'USING', 'AND', 'OR', 'AS', 'VALUES', 'RETURNING',
+}
+
+def _sample_sql(node: ast.AST) -> Optional[str]:
+    """
+    Get a plannable statement from a string literal or f-string.
+
+    Interpolated values and str.format() placeholders are replaced with
+    sample bindings: an id list where they open a parenthesis (``IN ({ids})``),
+    and nothing elsewhere (optional clauses such as an extra filter).
+    Statements with placeholders for table or column names are skipped.
+    """
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        parts = _TEMPLATE_RE.split(node.value)
+        holes = [None] * (len(parts) - 1)
+    elif isinstance(node, ast.JoinedStr):
+        parts, holes = [''], []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts[-1] += str(value.value)
+            else:
+                holes.append(value)
+                parts.append('')
+    else:
+        return None
+
+    sql = parts[0]
+    for part in parts[1:]:
+        if _IDENTIFIER_POSITION_RE.search(sql):
+            return None
+        sql += (SAMPLE_ID_LIST if sql.rstrip().endswith('(') else '') + part
+    return sql
+
+def collect_queries(paths: Optional[List[str]] = None) -> List[Dict[str, str]]:
+    """
+    Collect the SQL statements written as string literals in Python modules.
+
+    Statements built as templates or f-strings are collected with sample
+    bindings in place of their placeholders (see _sample_sql()).
+
+    Args:
+        paths: Python files to scan (defaults to models/database.py)
+
+    Returns:
+        List of {'name': enclosing function, 'sql': statement}, without duplicates
+    """
+    if paths is None:
+        paths = [os.path.join(os.path.dirname(__file__), 'database.py')]
+
+    queries = []
+    seen = set()
+    for path in paths:
+        with open(path, 'r') as f:
+            tree = ast.parse(f.read(), filename=path)
+        for function in ast.walk(tree):
+            if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            docstring = function.body[0].value if (
+                isinstance(function.body[0], ast.Expr) and isinstance(function.body[0].value, ast.Constant)
+            ) else None
+            # Constants inside f-strings are collected with their f-string
+            nested = {id(value) for node in ast.walk(function) if isinstance(node, ast.JoinedStr)
+                      for value in node.values}
+            for node in ast.walk(function):
+                if node is docstring or id(node) in nested:
+                    continue
+                sql = _sample_sql(node)
+                if sql is None:
+                    continue
+                sql = sql.strip()
+                key = ' '.join(sql.split())
+                # Skip non-SQL strings and table-less statements such as SELECT 1
+                if not _ANALYZABLE_RE.match(sql) or not _TABLE_RE.search(key):
+                    continue
+                if key in seen:
+                    continue
+                seen.add(key)
+                queries.append({'name': function.name, 'sql': sql})
+    return queries
+
+def build_sample_database(path: str, users: int = 1000, target: Optional[int] = None,
+                          seed: int = 0) -> Database:
+    """
+    Create a migrated database filled with representative data.
+
+    Relationship, notification and verification volumes per user follow
+    production ratios closely enough for the planner to make the same
+    choices, and ANALYZE is run so it has statistics to make them with.
+
+    Args:
+        path: Database file to create
+        users: Number of users to generate
+        target: Highest migration version to apply (defaults to the latest)
+        seed: Random seed, for reproducible reports
+
+    Returns:
+        Database for the new file
+    """
+    rng = random.Random(seed)
+    db = Database(path, query_stats=False)
+    apply_migrations(db, target=target)
+
+    now = 1_700_000_000
+    db.bulk_insert('users', (
+        {
+            'name': f"User {i}",
+            'email': f"user{i}@example.com",
+            'password_hash': 'x',
+            'verification_level': rng.randint(0, 3),
+            'email_verified': rng.random() < 0.7,
+            'created_at': now + i,
+            'updated_at': now + i,
+        }
+        for i in range(1, users + 1)
+    ))
+
+    pairs = set()
+    for user_id in range(1, users + 1):
+        for _ in range(rng.randint(1, 4)):
+            relative_id = rng.randint(1, users)
+            if relative_id != user_id:
+                pairs.add((user_id, relative_id))
+                pairs.add((relative_id, user_id))
+    db.bulk_insert('family_relationships', (
+        {
+            'user_id': user_id,
+            'relative_id': relative_id,
+            'relationship_type': rng.choice(['parent', 'child', 'sibling', 'spouse', 'cousin']),
+            'verified': rng.random() < 0.6,
+            'created_at': now,
+            'updated_at': now,
+        }
+        for user_id, relative_id in sorted(pairs)
+    ))
+
+    db.bulk_insert('notifications', (
+        {
+            'user_id': rng.randint(1, users),
+            'type': 'family_request',
+            'message': 'New family relationship request',
+            'data': None,
+            'read': rng.random() < 0.8,
+            'created_at': now + n,
+        }
+        for n in range(users * 8)
+    ))
+
+    db.bulk_insert('verification_requests', (
+        {
+            'user_id': rng.randint(1, users),
+            'verifier_id': rng.randint(1, users),
+            'type': rng.choice(['family', 'document', 'video']),
+            'status': rng.choice(['pending', 'approved', 'approved', 'rejected']),
+            'data': None,
+            'created_at': now + n,
+            'updated_at': now + n,
+        }
+        for n in range(users * 2)
+    ))
+
+    db.bulk_insert('did_documents', (
+        {
+            'user_id': user_id,
+            'identifier': f"did:poh:{user_id:08x}",
+            'document': '{}',
+            'keys': None,
+            'created_at': now,
+            'updated_at': now,
+        }
+        for user_id in range(1, users + 1, 3)
+    ))
+
+    db.execute_query("ANALYZE")
+    return db
+
+def _table_columns(conn) -> Dict[str, List[str]]:
+    """Map each table in the database to its column names."""
+    tables = [row['name'] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()]
+    return {table: [row['name'] for row in conn.execute(f'PRAGMA table_info("{table}")').fetchall()]
+            for table in tables}
+
+def _existing_indexes(conn, table: str) -> List[Tuple[List[str], bool]]:
+    """List (columns, is_partial) for every index on a table, including UNIQUE autoindexes."""
+    indexes = []
+    for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+        columns = [row['name'] for row in conn.execute(f'PRAGMA index_info("{index["name"]}")').fetchall()]
+        indexes.append((columns, bool(index['partial'])))
+    return indexes
+
+def explain(conn, sql: str) -> List[str]:
+    """
+    Get the EXPLAIN QUERY PLAN steps of a statement.
+
+    Parameters are bound to NULL; the plan does not depend on their values.
+
+    Args:
+        conn: Connection to the representative database
+        sql: Statement to explain
+
+    Returns:
+        Plan step details, in plan order
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count('?'))
+    return [detail for _, _, _, detail in cursor.fetchall()]
+
+def _aliases(sql: str, tables: Dict[str, List[str]]) -> Dict[str, str]:
+    """Map the table names and aliases used in a statement to real tables."""
+    aliases = {}
+    shadowed = set()
+    for table, alias in _TABLE_RE.findall(sql):
+        if alias.upper() in _RESERVED:
+            alias = ''
+        if table not in tables:
+            # An alias for a CTE or subquery; it cannot be attributed to a table
+            shadowed.add(alias or table)
+            continue
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    for name in shadowed:
+        aliases.pop(name, None)
+    return aliases
+
+def _resolve(qualifier: str, column: str, aliases: Dict[str, str],
+             tables: Dict[str, List[str]]) -> Optional[str]:
+    """Find the table a (possibly qualified) column reference belongs to."""
+    if qualifier:
+        table = aliases.get(qualifier)
+        return table if table and column in tables[table] else None
+    owners = {table for table in aliases.values() if column in tables[table]}
+    return owners.pop() if len(owners) == 1 else None
+
+def plan_findings(plan: List[str], aliases: Dict[str, str]) -> List[Dict[str, str]]:
+    """
+    Flag full table scans and temporary B-trees in a query plan.
+
+    Args:
+        plan: Plan step details from explain()
+        aliases: Table aliases used by the statement
+
+    Returns:
+        List of {'kind': 'full_scan' or 'temp_btree', 'table', 'detail'}
+    """
+    findings = []
+    for detail in plan:
+        match = _SCAN_RE.match(detail)
+        if match and not match.group(0).endswith('INDEX') and match.group(1) in aliases:
+            findings.append({'kind': 'full_scan', 'table': aliases[match.group(1)], 'detail': detail})
+        elif 'TEMP B-TREE' in detail:
+            findings.append({'kind': 'temp_btree', 'table': None, 'detail': detail})
+    return findings
+
+def _index_name(table: str, columns: List[str], where: Optional[List[str]]) -> str:
+    name = f"idx_{table}_{'_'.join(columns)}"
+    if where:
+        name += '_where_' + '_'.join(where)
+    return name
+
+def propose_indexes(sql: str, findings: List[Dict[str, str]], aliases: Dict[str, str],
+                    tables: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    """
+    Propose indexes that remove the scans and sorts flagged for a statement.
+
+    Columns go in the order equality predicates (or, for a table reached
+    only through a join, its join keys), constant predicates, ORDER BY
+    columns and finally the first range predicate.
+    Constant predicates also produce a partial index alternative, and an
+    explicit select list that adds few columns produces a covering variant.
+
+    Args:
+        sql: The statement
+        findings: Output of plan_findings() for the statement
+        aliases: Table aliases used by the statement
+        tables: Column names per table
+
+    Returns:
+        List of proposals ({'table', 'columns', 'where', 'kind', 'name', 'sql'})
+    """
+    predicate_sql = _SET_CLAUSE_RE.sub(' ', sql) if sql.lstrip().upper().startswith('UPDATE') else sql
+
+    equality, constants, ranges, joins, order = {}, {}, {}, {}, {}
+    for qualifier, column, op, value in _PREDICATE_RE.findall(predicate_sql):
+        table = _resolve(qualifier, column, aliases, tables)
+        if table is None:
+            continue
+        if value == '?' or value == '(':
+            if op in ('=',) or op.upper() == 'IN':
+                equality.setdefault(table, []).append(column)
+            else:
+                ranges.setdefault(table, []).append(column)
+        elif op == '=':
+            constants.setdefault(table, []).append((column, value))
+    for left_alias, left_column, right_alias, right_column in _JOIN_PREDICATE_RE.findall(predicate_sql):
+        for alias, column in ((left_alias, left_column), (right_alias, right_column)):
+            table = _resolve(alias, column, aliases, tables)
+            if table is not None:
+                joins.setdefault(table, []).append(column)
+    order_match = _ORDER_BY_RE.search(sql)
+    if order_match:
+        for term in order_match.group(1).split(','):
+            term_match = _ORDER_TERM_RE.match(term)
+            if term_match:
+                table = _resolve(term_match.group(1), term_match.group(2), aliases, tables)
+                if table is not None:
+                    order.setdefault(table, []).append(term_match.group(2))
+
+    flagged = {finding['table'] for finding in findings if finding['kind'] == 'full_scan'}
+    if any(finding['kind'] == 'temp_btree' for finding in findings) and order:
+        flagged.update(order)
+
+    def unique(columns):
+        return list(dict.fromkeys(columns))
+
+    proposals = []
+    for table in sorted(flagged):
+        # Join keys only matter when the table is reached through the join
+        eq = equality.get(table, []) or joins.get(table, [])
+        constant_columns = [column for column, _ in constants.get(table, [])]
+        ordering = order.get(table, [])
+        trailing = ranges.get(table, [])[:1]
+
+        columns = unique(eq + constant_columns + ordering + trailing)
+        if not columns:
+            continue
+        proposals.append({'table': table, 'columns': columns, 'where': None, 'kind': 'composite'})
+
+        if constants.get(table):
+            partial_columns = unique(eq + ordering + trailing)
+            if partial_columns:
+                proposals.append({
+                    'table': table,
+                    'columns': partial_columns,
+                    'where': [f"{column} = {value}" for column, value in constants[table]],
+                    'kind': 'partial',
+                })
+
+        select_match = _SELECT_LIST_RE.match(sql)
+        if select_match and '*' not in select_match.group(1):
+            selected = []
+            for item in select_match.group(1).split(','):
+                term_match = _ORDER_TERM_RE.match(re.sub(r'\s+AS\s+\w+\s*$', '', item, flags=re.IGNORECASE))
+                if term_match and _resolve(term_match.group(1), term_match.group(2), aliases, tables) == table:
+                    selected.append(term_match.group(2))
+            extra = [column for column in unique(selected) if column not in columns and column != 'id']
+            if extra and len(extra) <= 3:
+                proposals.append({'table': table, 'columns': columns + extra, 'where': None, 'kind': 'covering'})
+
+    for proposal in proposals:
+        where_columns = [clause.split()[0] for clause in proposal['where']] if proposal['where'] else None
+        proposal['name'] = _index_name(proposal['table'], proposal['columns'], where_columns)
+        proposal['sql'] = "CREATE INDEX IF NOT EXISTS {} ON {} ({}){}".format(
+            proposal['name'], proposal['table'], ', '.join(proposal['columns']),
+            f" WHERE {' AND '.join(proposal['where'])}" if proposal['where'] else ''
+        )
+    return proposals
+
+def _merge_proposals(proposals: List[Dict[str, Any]], conn) -> List[Dict[str, Any]]:
+    """Drop duplicate proposals, ones that prefix a wider proposal, and ones an index already serves."""
+    merged = {}
+    for proposal in proposals:
+        entry = merged.setdefault(proposal['sql'], dict(proposal, queries=[]))
+        entry['queries'].extend(proposal.get('queries', []))
+
+    result = []
+    for proposal in merged.values():
+        key = (proposal['table'], tuple(proposal['where'] or ()))
+        columns = proposal['columns']
+        # A wider index with the same leading columns serves this one too
+        wider = [
+            other for other in merged.values()
+            if other is not proposal
+            and (other['table'], tuple(other['where'] or ())) == key
+            and len(other['columns']) > len(columns)
+            and other['columns'][:len(columns)] == columns
+        ]
+        if wider:
+            wider[0]['queries'].extend(q for q in proposal['queries'] if q not in wider[0]['queries'])
+            continue
+        existing = _existing_indexes(conn, proposal['table'])
+        if any(index_columns[:len(columns)] == columns and (not partial or proposal['where'])
+               for index_columns, partial in existing):
+            continue
+        result.append(proposal)
+    return sorted(result, key=lambda proposal: proposal['name'])
+
+def advise(db: Database, queries: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    """
+    Analyze a query set against a database and propose missing indexes.
+
+    Args:
+        db: Representative database to plan against
+        queries: Statements to analyze (defaults to collect_queries())
+
+    Returns:
+        Dictionary with per-query plans and findings, and merged index proposals
+    """
+    queries = collect_queries() if queries is None else queries
+    report = {'queries': [], 'proposals': []}
+    proposals = []
+
+    with db._connection(readonly=True) as conn:
+        tables = _table_columns(conn)
+        for query in queries:
+            aliases = _aliases(query['sql'], tables)
+            entry = dict(query, plan=[], findings=[], error=None)
+            try:
+                entry['plan'] = explain(conn, query['sql'])
+            except Exception as e:
+                # The statement references tables or columns this schema lacks
+                entry['error'] = str(e)
+                report['queries'].append(entry)
+                continue
+            if _FILTER_RE.search(query['sql']):
+                entry['findings'] = plan_findings(entry['plan'], aliases)
+            if entry['findings']:
+                for proposal in propose_indexes(query['sql'], entry['findings'], aliases, tables):
+                    proposal['queries'] = [query['name']]
+                    proposals.append(proposal)
+            report['queries'].append(entry)
+
+        report['proposals'] = _merge_proposals(proposals, conn)
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    """Print an advisor report in human readable form."""
+    flagged = [entry for entry in report['queries'] if entry['findings'] or entry['error']]
+    unplanned = [entry for entry in report['queries'] if entry['error']]
+    print(f"Analyzed {len(report['queries'])} statements, {len(flagged)} need attention\n")
+    if unplanned:
+        print(f"WARNING: {len(unplanned)} statements could not be planned and were not checked\n")
+
+    for entry in flagged:
+        print(f"{entry['name']}:")
+        print("  " + " ".join(entry['sql'].split()))
+        if entry['error']:
+            print(f"  ! cannot plan: {entry['error']}")
+        for finding in entry['findings']:
+            label = 'FULL SCAN' if finding['kind'] == 'full_scan' else 'TEMP B-TREE'
+            print(f"  ! {label}: {finding['detail']}")
+        print()
+
+    if not report['proposals']:
+        print("No index changes proposed.")
+        return
+
+    print("Proposed indexes:")
+    for proposal in report['proposals']:
+        print(f"  [{proposal['kind']}] {proposal['sql']}")
+        print(f"      for: {', '.join(sorted(set(proposal['queries'])))}")
+
+    next_version = max(migration.version for migration in MIGRATIONS) + 1
+    print("\nAs a migration for models/migrations.py:")
+    print(f"    Migration({next_version}, 'advisor indexes', [")
+    for proposal in report['proposals']:
+        print(f'        "{proposal["sql"]}",')
+    print("    ]),")
+
+def parse_arguments(argv=None):
+    """Parse command line arguments for the index advisor."""
+    parser = argparse.ArgumentParser(description='Propose indexes for the queries in models/database.py')
+    parser.add_argument('--database', '-d',
+                        help='Analyze this database instead of a generated sample')
+    parser.add_argument('--users', '-u', type=int, default=1000,
+                        help='Users in the generated sample database (default: 1000)')
+    parser.add_argument('--baseline', action='store_true',
+                        help='Generate the sample with the baseline schema only, without index migrations')
+    parser.add_argument('--apply', action='store_true',
+                        help='Apply pending migrations (including index migrations) to --database')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Run the index advisor from the command line."""
+    args = parse_arguments(argv)
+    if args.apply and not args.database:
+        print("--apply needs --database")
+        return 1
+
+    if args.database:
+        db = Database(args.database, query_stats=False)
+        report = advise(db)
+        print_report(report)
+        if args.apply:
+            applied = apply_migrations(db)
+            print(f"\nApplied migrations: {applied or 'none pending'}")
+        db.close_pools()
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db = build_sample_database(os.path.join(tmp_dir, 'advisor.sqlite'), users=args.users,
+                                       target=1 if args.baseline else None)
+            report = advise(db)
+            print_report(report)
+            db.close_pools()
+        close_all_databases()
+    # Statements that could not be planned were not checked at all
+    return 1 if any(entry['error'] for entry in report['queries']) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+"""
+Background maintenance for the Proof of Humanity database.
+
+A MaintenanceScheduler runs the housekeeping SQLite does not do on its own:
+
+- ``checkpoint``: ``PRAGMA wal_checkpoint(TRUNCATE)``, which copies the WAL
+  back into the database and truncates it. It runs as soon as the WAL grows
+  past a size threshold, and otherwise once per interval when traffic is low.
+- ``optimize``: ``PRAGMA optimize``, which re-analyzes tables whose
+  statistics have drifted.
+- ``analyze``: a full ``ANALYZE``, bounded by ``PRAGMA analysis_limit``.
+- ``trim_family_changes``: deletes all but the newest ``FAMILY_CHANGES_KEPT``
+  rows of the family change log.
+
+Free pages are not returned to the filesystem. That would need
+``auto_vacuum = INCREMENTAL``, which an existing database only takes after a
+full ``VACUUM`` that rewrites the file under an exclusive lock. Pages freed
+by deletes are reused by later inserts instead.
+
+Apart from WAL-size checkpoints, tasks wait until the pools have been idle
+for a whole tick. A task that has waited a long time without an idle tick
+runs anyway. Maintenance uses its own connection with a short busy timeout,
+so a busy database makes a task give up and retry later instead of queueing
+behind writers.
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from collections import deque
+from urllib.parse import urlparse, unquote
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger('database')
+
+# Task name -> multiple of the scheduler interval between runs
+TASK_INTERVALS = {
+    'checkpoint': 1,
+    'optimize': 1,
+    'trim_family_changes': 1,
+    'analyze': 24
+}
+
+# A task overdue by this multiple of its interval runs even when traffic is high
+MAX_DELAY_FACTOR = 4
+
+# Rows sampled per index by ANALYZE, which keeps it fast on large tables
+ANALYSIS_LIMIT = 1000
+
+# Rows of family_changes kept by trim_family_changes (at least one, so the
+# newest version stays visible). Family graphs and tree clients further
+# behind than this reload instead of replaying them.
+FAMILY_CHANGES_KEPT = 100000
+
+class MaintenanceScheduler:
+    """
+    Runs periodic maintenance on one database from a background thread.
+    """
+
+    def __init__(self, db, interval: float = None, wal_threshold: int = None,
+                 tick: float = 30.0, busy_timeout: float = 1.0, history: int = 100):
+        """
+        Initialize the scheduler.
+
+        Args:
+            db: Database whose file is maintained and whose pools are watched
+                for traffic
+            interval: Base seconds between maintenance runs (defaults to
+                DATABASE_MAINTENANCE_INTERVAL)
+            wal_threshold: WAL size in bytes that triggers an immediate
+                checkpoint (defaults to DATABASE_WAL_CHECKPOINT_MB)
+            tick: Seconds between scheduler checks
+            busy_timeout: Seconds a task waits for locks before giving up
+            history: Number of recent runs kept for stats()
+        """
+        try:
+            from flask import current_app
+            config = current_app.config
+        except (RuntimeError, ImportError):
+            # Working outside of application context
+            config = {}
+
+        if interval is None:
+            interval = float(config.get('DATABASE_MAINTENANCE_INTERVAL',
+                                        os.environ.get('DATABASE_MAINTENANCE_INTERVAL', 3600)))
+        if wal_threshold is None:
+            wal_mb = float(config.get('DATABASE_WAL_CHECKPOINT_MB', os.environ.get('DATABASE_WAL_CHECKPOINT_MB', 64)))
+            wal_threshold = int(wal_mb * 1024 * 1024)
+
+        self.db = db
+        self.interval = interval
+        self.wal_threshold = wal_threshold
+        self.tick = tick
+        self.busy_timeout = busy_timeout
+
+        self.lock = threading.Lock()
+        self.last_run = {task: time.time() for task in TASK_INTERVALS}
+        self.history = deque(maxlen=history)
+        self.runs = {task: 0 for task in TASK_INTERVALS}
+        self.failures = {task: 0 for task in TASK_INTERVALS}
+        # Pool checkout counter at the previous tick, for idle detection
+        self._last_checkouts = None
+
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def file_path(self) -> str:
+        """Filesystem path of the database, also when it is opened by a file: URI."""
+        path = self.db.database_path
+        return unquote(urlparse(path).path) if path.startswith("file:") else path
+
+    @property
+    def wal_path(self) -> str:
+        """Path of the database's write-ahead log."""
+        return f"{self.file_path}-wal"
+
+    def wal_size(self) -> int:
+        """Get the current WAL size in bytes."""
+        try:
+            return os.path.getsize(self.wal_path)
+        except OSError:
+            return 0
+
+    def _pools(self) -> List:
+        pools = [self.db.pool]
+        if self.db.read_pool is not self.db.pool:
+            pools.append(self.db.read_pool)
+        return pools
+
+    def is_idle(self) -> bool:
+        """
+        Check whether the database saw no traffic since the previous check.
+
+        Returns:
+            True if no connection is checked out and none was checked out
+            since the last call
+        """
+        stats = [pool.stats() for pool in self._pools()]
+        checkouts = sum(s['checkouts'] for s in stats)
+        idle = (self._last_checkouts == checkouts
+                and all(s['in_use'] == 0 and s['queue_depth'] == 0 for s in stats))
+        self._last_checkouts = checkouts
+        return idle
+
+    def due(self, now: Optional[float] = None, idle: Optional[bool] = None) -> List[str]:
+        """
+        Get the tasks that should run now.
+
+        Args:
+            now: Current time (defaults to time.time())
+            idle: Whether traffic is low (defaults to is_idle())
+
+        Returns:
+            Task names in the order they should run
+        """
+        now = time.time() if now is None else now
+        idle = self.is_idle() if idle is None else idle
+        tasks = []
+        if self.wal_size() > self.wal_threshold:
+            tasks.append('checkpoint')
+        for task, factor in TASK_INTERVALS.items():
+            if task in tasks:
+                continue
+            elapsed = now - self.last_run[task]
+            period = self.interval * factor
+            if (idle and elapsed >= period) or elapsed >= period * MAX_DELAY_FACTOR:
+                tasks.append(task)
+        return tasks
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db.database_path, timeout=self.busy_timeout, isolation_level=None,
+                               uri=self.db.database_path.startswith("file:"))
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        return conn
+
+    @staticmethod
+    def _pragma(conn: sqlite3.Connection, name: str) -> int:
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+    def run(self, task: str) -> Dict[str, Any]:
+        """
+        Run one maintenance task now and record it.
+
+        Args:
+            task: One of TASK_INTERVALS
+
+        Returns:
+            The recorded run: task, start time, duration, the measurements
+            before and after, and an error message if it failed
+        """
+        if task not in TASK_INTERVALS:
+            raise ValueError(f"Unknown maintenance task {task!r}, expected one of {tuple(TASK_INTERVALS)}")
+
+        with self.lock:
+            record = {'task': task, 'started_at': time.time(), 'duration': 0.0,
+                      'before': {}, 'after': {}, 'error': None}
+            start = time.perf_counter()
+            conn = None
+            try:
+                conn = self._connect()
+                record['before'] = self._measure(conn)
+                if task == 'checkpoint':
+                    busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+                    record['busy'] = bool(busy)
+                    record['checkpointed'] = checkpointed
+                elif task == 'optimize':
+                    conn.execute("PRAGMA optimize")
+                elif task == 'analyze':
+                    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+                    conn.execute("ANALYZE")
+                elif task == 'trim_family_changes':
+                    if conn.execute(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'family_changes'"
+                    ).fetchone():
+                        # Versions are consecutive, so this is a range delete on the key
+                        record['deleted'] = conn.execute(
+                            "DELETE FROM family_changes WHERE version <= (SELECT MAX(version) FROM family_changes) - ?",
+                            (max(FAMILY_CHANGES_KEPT, 1),)
+                        ).rowcount
+                    else:
+                        record['skipped'] = True
+                record['after'] = self._measure(conn)
+                self.runs[task] += 1
+            except sqlite3.Error as e:
+                record['error'] = str(e)
+                self.failures[task] += 1
+                logger.warning(f"Maintenance task {task} on {self.db.database_path} failed: {e}")
+            finally:
+                if conn is not None:
+                    conn.close()
+            record['duration'] = time.perf_counter() - start
+            self.last_run[task] = time.time()
+            self.history.append(record)
+            logger.debug(f"Maintenance task {task} on {self.db.database_path} took {record['duration']:.3f}s")
+            return record
+
+    def _measure(self, conn: sqlite3.Connection) -> Dict[str, int]:
+        """Measure what maintenance changes: WAL size, file size and free pages."""
+        return {
+            'wal_size': self.wal_size(),
+            'file_size': os.path.getsize(self.file_path) if os.path.exists(self.file_path) else 0,
+            'freelist_count': self._pragma(conn, 'freelist_count')
+        }
+
+    def run_due(self) -> List[Dict[str, Any]]:
+        """
+        Run every task that is due.
+
+        Returns:
+            The recorded runs
+        """
+        return [self.run(task) for task in self.due()]
+
+    def start(self) -> None:
+        """Start the background scheduler thread."""
+        if self._thread is not None or self.interval <= 0 or self.db.anchor is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='db-maintenance', daemon=True)
+        self._thread.start()
+
+    def _loop(self) -> None:
+        """Background loop checking for due tasks every tick."""
+        while not self._stop.wait(self.tick):
+            try:
+                self.run_due()
+            except Exception as e:
+                logger.error(f"Error in maintenance scheduler for {self.db.database_path}: {e}")
+
+    def stop(self) -> None:
+        """Stop the background scheduler thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get maintenance statistics.
+
+        Returns:
+            Dictionary with per-task run and failure counts, the current WAL
+            size and the most recent runs
+        """
+        return {
+            'interval': self.interval,
+            'wal_threshold': self.wal_threshold,
+            'wal_size': self.wal_size(),
+            'runs': dict(self.runs),
+            'failures': dict(self.failures),
+            'history': list(self.history)[-10:]
+        }
+
+# Process-wide registry of schedulers, keyed by database path
+_schedulers: Dict[str, MaintenanceScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+def start_maintenance(db, **kwargs) -> MaintenanceScheduler:
+    """
+    Start the shared maintenance scheduler for a database.
+
+    Args:
+        db: Database to maintain
+        **kwargs: MaintenanceScheduler options, only used when it is first created
+
+    Returns:
+        The running scheduler
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(db.database_path)
+        if scheduler is None or scheduler.db is not db:
+            if scheduler is not None:
+                scheduler.stop()
+            scheduler = MaintenanceScheduler(db, **kwargs)
+            scheduler.start()
+            _schedulers[db.database_path] = scheduler
+        return scheduler
+
+def get_maintenance(db) -> Optional[MaintenanceScheduler]:
+    """
+    Get the running maintenance scheduler for a database.
+
+    Args:
+        db: Database to look up
+
+    Returns:
+        The scheduler, or None if maintenance was not started for it
+    """
+    scheduler = _schedulers.get(db.database_path)
+    return scheduler if scheduler is not None and scheduler.db is db else None
+
+def stop_all_maintenance() -> None:
+    """Stop every registered maintenance scheduler and clear the registry."""
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+        _schedulers.clear()
+    for scheduler in schedulers:
+        scheduler.stop()
+
+atexit.register(stop_all_maintenance)
@@ -0,0 +1,719 @@
+"""
+Versioned schema migrations for the Proof of Humanity database.
+
+Each migration is applied once, in version order, and recorded in the
+``schema_migrations`` table. Add new schema changes (tables, columns,
+indexes) as a new migration at the end of MIGRATIONS instead of editing an
+applied one.
+
+The canonical schema is the one the query helpers in models/database.py
+use; schema.sql is a plain SQL copy of it. Databases created from older
+copies of schema.sql (family_relations, verification_attempts,
+did_identifier) or by older versions of init_db.py (related_user_id,
+request_type, did) are rebuilt into it by the first migration.
+
+Usage:
+    python -m models.migrations --database instance/poh.sqlite [--status] [--shards N]
+"""
+
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+from typing import List, Dict, Any, Optional, Callable, Union, Tuple
+
+from models.database import (
+    Database, DatabaseError, get_database, get_shards, close_all_databases
+)
+
+logger = logging.getLogger('database')
+
+class Migration:
+    """
+    A numbered, named list of steps applied together.
+    
+    Steps are SQL statements or callables taking the connection. A regular
+    migration runs in one transaction with foreign key enforcement off, so
+    tables can be rebuilt. An ``online`` migration (index builds) runs each
+    step in its own short transaction, pausing in between so queued writers
+    get the lock; its steps must therefore be idempotent.
+    """
+
+    def __init__(self, version: int, name: str, steps: List[Union[str, Callable]], online: bool = False):
+        self.version = version
+        self.name = name
+        self.steps = steps
+        self.online = online
+
+    def __repr__(self):
+        return f"Migration({self.version}, {self.name!r})"
+
+# Seconds an online migration yields the write lock between steps
+ONLINE_STEP_PAUSE = 0.05
+
+# Tables as used by the query helpers in models/database.py
+CANONICAL_TABLES = {
+    'users': """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        verification_level INTEGER DEFAULT 0,
+        email_verified BOOLEAN DEFAULT 0,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL
+    )
+    """,
+    'family_relationships': """
+    CREATE TABLE IF NOT EXISTS family_relationships (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        relative_id INTEGER NOT NULL,
+        relationship_type TEXT NOT NULL,
+        verified BOOLEAN DEFAULT 0,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+        FOREIGN KEY (relative_id) REFERENCES users (id) ON DELETE CASCADE,
+        UNIQUE (user_id, relative_id)
+    )
+    """,
+    'verification_requests': """
+    CREATE TABLE IF NOT EXISTS verification_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        verifier_id INTEGER,
+        type TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        data TEXT,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+        FOREIGN KEY (verifier_id) REFERENCES users (id)
+    )
+    """,
+    'did_documents': """
+    CREATE TABLE IF NOT EXISTS did_documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        identifier TEXT UNIQUE NOT NULL,
+        document TEXT NOT NULL,
+        keys TEXT,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+    )
+    """,
+    'notifications': """
+    CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        message TEXT,
+        data TEXT,
+        read BOOLEAN DEFAULT 0,
+        created_at INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+    )
+    """,
+}
+
+# Older table names and the canonical table their rows belong to
+LEGACY_TABLES = {
+    'family_relations': 'family_relationships',
+    'verification_attempts': 'verification_requests',
+}
+
+def _epoch(column: str) -> str:
+    """SQL expression converting an ISO-8601 text timestamp to Unix seconds."""
+    now = "CAST(strftime('%s', 'now') AS INTEGER)"
+    return (f"CASE WHEN typeof({column}) = 'text' "
+            f"THEN COALESCE(CAST(strftime('%s', {column}) AS INTEGER), {now}) "
+            f"ELSE COALESCE({column}, {now}) END")
+
+def _extra_column(name: str, decl: str) -> Tuple[str, str]:
+    """
+    Get the declared type and copy expression for a kept legacy column.
+    
+    Date-typed columns are stored as Unix seconds like the canonical
+    timestamps; their ISO text values would otherwise trip the sqlite3
+    TIMESTAMP converter on read.
+    """
+    if decl.upper() in ('TIMESTAMP', 'DATETIME', 'DATE'):
+        return 'INTEGER', (f'CASE WHEN typeof("{name}") = \'text\' '
+                           f'THEN CAST(strftime(\'%s\', "{name}") AS INTEGER) ELSE "{name}" END')
+    return decl, f'"{name}"'
+
+def _legacy_mapping(table: str, columns: List[str]) -> Tuple[Dict[str, str], set]:
+    """
+    Map each canonical column to an SQL expression over a legacy table.
+    
+    Args:
+        table: Canonical table name
+        columns: Columns of the legacy table
+        
+    Returns:
+        (canonical column -> expression, legacy columns consumed by the mapping)
+    """
+    consumed = set()
+    
+    def first(*names, default='NULL'):
+        for name in names:
+            if name in columns:
+                consumed.add(name)
+                return f'"{name}"'
+        return default
+    
+    mapping = {'id': first('id')}
+    if table == 'users':
+        name_parts = [f"COALESCE({first(part)}, '')" for part in ('first_name', 'last_name') if part in columns]
+        separator = " || ' ' || "
+        full_name = f"NULLIF(TRIM({separator.join(name_parts)}), '')" if name_parts else 'NULL'
+        mapping.update({
+            'name': f"COALESCE({full_name}, {first('name', 'username')}, \"email\")",
+            'email': f"LOWER({first('email')})",
+            'password_hash': f"COALESCE({first('password_hash', 'password')}, '')",
+            'verification_level': f"COALESCE({first('verification_level', default='0')}, 0)",
+            'email_verified': f"COALESCE({first('email_verified', default='0')}, 0)",
+        })
+        # Keep username around: routes/auth.py still looks users up by it
+        consumed.discard('username')
+    elif table == 'family_relationships':
+        mapping.update({
+            'user_id': first('user_id'),
+            'relative_id': first('relative_id', 'related_user_id'),
+            'relationship_type': first('relationship_type'),
+            'verified': f"COALESCE({first('verified', 'is_verified', default='0')}, 0)",
+        })
+    elif table == 'verification_requests':
+        mapping.update({
+            'user_id': first('user_id'),
+            'verifier_id': first('verifier_id'),
+            'type': f"COALESCE({first('type', 'verification_type', 'request_type')}, 'unknown')",
+            'status': f"COALESCE({first('status')}, 'pending')",
+            'data': first('data', 'metadata'),
+        })
+    elif table == 'did_documents':
+        mapping.update({
+            'user_id': first('user_id'),
+            'identifier': first('identifier', 'did_identifier', 'did'),
+            'document': f"COALESCE({first('document', 'document_json')}, '{{}}')",
+            'keys': first('keys', 'public_key'),
+        })
+    else:
+        raise ValueError(f"No legacy mapping for table {table}")
+    
+    mapping['created_at'] = _epoch(first('created_at'))
+    mapping['updated_at'] = _epoch(first('updated_at', 'verified_at', 'created_at'))
+    return mapping, consumed
+
+def _tuples(conn: sqlite3.Connection, query: str) -> List[tuple]:
+    """Run a query returning plain tuples, whatever the connection's row factory."""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor.execute(query).fetchall()
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> List[Tuple[str, str]]:
+    """Get (name, declared type) for each column of a table, empty if missing."""
+    return [(row[1], row[2]) for row in _tuples(conn, f'PRAGMA table_info("{table}")')]
+
+def _canonical_columns(table: str) -> List[str]:
+    """Get the column names of a canonical table."""
+    scratch = sqlite3.connect(':memory:')
+    try:
+        scratch.execute(CANONICAL_TABLES[table])
+        return [name for name, _ in _table_columns(scratch, table)]
+    finally:
+        scratch.close()
+
+def _rebuild_into(conn: sqlite3.Connection, source: str, table: str) -> None:
+    """
+    Copy a legacy table's rows into the canonical table and drop it.
+    
+    Legacy columns without a canonical counterpart are kept as plain
+    nullable columns so no data is lost. Rows violating the canonical
+    unique constraints (duplicate relationships) are skipped.
+    
+    Args:
+        conn: Connection inside the migration transaction
+        source: Legacy table name
+        table: Canonical table name
+    """
+    legacy = _table_columns(conn, source)
+    mapping, consumed = _legacy_mapping(table, [name for name, _ in legacy])
+    canonical = set(mapping)
+    extras = [(name,) + _extra_column(name, decl) for name, decl in legacy
+              if name not in canonical and name not in consumed]
+    
+    # Rebuild in place when the source has the canonical name, merge otherwise
+    if source == table or not _table_columns(conn, table):
+        target = f"{table}__migrating"
+        conn.execute(f'DROP TABLE IF EXISTS "{target}"')
+        conn.execute(CANONICAL_TABLES[table].replace(
+            f"CREATE TABLE IF NOT EXISTS {table} (", f'CREATE TABLE "{target}" (', 1
+        ))
+    else:
+        target = table
+    
+    existing = {name for name, _ in _table_columns(conn, target)}
+    for name, decl, _ in extras:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE "{target}" ADD COLUMN "{name}" {decl}')
+    
+    columns = list(mapping) + [name for name, _, _ in extras]
+    expressions = list(mapping.values()) + [expression for _, _, expression in extras]
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    cursor = conn.execute(
+        f'INSERT OR IGNORE INTO "{target}" ({column_list}) '
+        f'SELECT {", ".join(expressions)} FROM "{source}"'
+    )
+    total = _tuples(conn, f'SELECT COUNT(*) FROM "{source}"')[0][0]
+    if cursor.rowcount < total:
+        logger.warning(f"Skipped {total - cursor.rowcount} duplicate rows migrating {source} into {table}")
+    
+    conn.execute(f'DROP TABLE "{source}"')
+    if target != table:
+        conn.execute(f'ALTER TABLE "{target}" RENAME TO "{table}"')
+    logger.info(f"Migrated {cursor.rowcount} rows from legacy table {source} into {table}")
+
+def reconcile_legacy_schema(conn: sqlite3.Connection) -> None:
+    """
+    Rebuild tables created from older schema definitions into the canonical schema.
+    
+    A table is legacy when it lives under an old name (family_relations,
+    verification_attempts) or lacks canonical columns (related_user_id
+    instead of relative_id, did instead of identifier). Canonical tables
+    and missing tables are left alone.
+    
+    Args:
+        conn: Connection inside the migration transaction
+    """
+    for table in CANONICAL_TABLES:
+        columns = {name for name, _ in _table_columns(conn, table)}
+        if columns and not set(_canonical_columns(table)) <= columns:
+            _rebuild_into(conn, table, table)
+        for legacy, canonical in LEGACY_TABLES.items():
+            if canonical == table and _table_columns(conn, legacy):
+                _rebuild_into(conn, legacy, table)
+
+# Indexes for the hot predicates, as proposed by models/index_advisor.py.
+# The composite variants were kept over the partial alternatives because
+# each one also serves the unfiltered form of the same query.
+HOT_PATH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_did_documents_user_id ON did_documents (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_family_relationships_user_id_verified_created_at "
+    "ON family_relationships (user_id, verified, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_notifications_user_id_read_created_at "
+    "ON notifications (user_id, read, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_notifications_user_id_created_at ON notifications (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_verification_requests_user_id_status_created_at "
+    "ON verification_requests (user_id, status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_verification_requests_user_id_created_at "
+    "ON verification_requests (user_id, created_at)",
+]
+
+# Denormalized per-user counters kept current by triggers, so verification
+# level changes read one users row instead of counting relationships
+USER_COUNTERS = [
+    "ALTER TABLE users ADD COLUMN verified_relationship_count INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN did_count INTEGER NOT NULL DEFAULT 0",
+    """
+    UPDATE users SET
+        verified_relationship_count = (
+            SELECT COUNT(*) FROM family_relationships f WHERE f.user_id = users.id AND f.verified
+        ),
+        did_count = (SELECT COUNT(*) FROM did_documents d WHERE d.user_id = users.id)
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_family_relationships_count_insert
+    AFTER INSERT ON family_relationships WHEN NEW.verified
+    BEGIN
+        UPDATE users SET verified_relationship_count = verified_relationship_count + 1 WHERE id = NEW.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_family_relationships_count_delete
+    AFTER DELETE ON family_relationships WHEN OLD.verified
+    BEGIN
+        UPDATE users SET verified_relationship_count = verified_relationship_count - 1 WHERE id = OLD.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_family_relationships_count_update
+    AFTER UPDATE OF verified, user_id ON family_relationships
+    WHEN NEW.verified IS NOT OLD.verified OR NEW.user_id IS NOT OLD.user_id
+    BEGIN
+        UPDATE users SET verified_relationship_count = verified_relationship_count - 1
+        WHERE id = OLD.user_id AND OLD.verified;
+        UPDATE users SET verified_relationship_count = verified_relationship_count + 1
+        WHERE id = NEW.user_id AND NEW.verified;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_did_documents_count_insert
+    AFTER INSERT ON did_documents
+    BEGIN
+        UPDATE users SET did_count = did_count + 1 WHERE id = NEW.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_did_documents_count_delete
+    AFTER DELETE ON did_documents
+    BEGIN
+        UPDATE users SET did_count = did_count - 1 WHERE id = OLD.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_did_documents_count_update
+    AFTER UPDATE OF user_id ON did_documents WHEN NEW.user_id IS NOT OLD.user_id
+    BEGIN
+        UPDATE users SET did_count = did_count - 1 WHERE id = OLD.user_id;
+        UPDATE users SET did_count = did_count + 1 WHERE id = NEW.user_id;
+    END
+    """,
+]
+
+# Every simple path of up to FAMILY_CLOSURE_DEPTH relationships, so kinship
+# questions are one indexed lookup. ancestor_id reaches descendant_id over
+# the relationship types in path_type, e.g. 'parent,parent' for a
+# grandparent. Rows are derived from family_relationships and kept current
+# by the query helpers whenever a relationship is added or removed; the
+# table is filled by the next migration.
+FAMILY_CLOSURE = [
+    """
+    CREATE TABLE IF NOT EXISTS family_closure (
+        ancestor_id INTEGER NOT NULL,
+        descendant_id INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        path_type TEXT NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id, path_type)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_family_closure_ancestor_id_path_type "
+    "ON family_closure (ancestor_id, path_type)",
+    "CREATE INDEX IF NOT EXISTS idx_family_closure_descendant_id_depth "
+    "ON family_closure (descendant_id, depth)",
+]
+
+# One row per (ancestor, descendant, path_type) with the number of simple
+# paths behind it, so adding or removing a relationship only adjusts the
+# counts of the paths over it and deletes rows whose count reaches zero.
+# The backfill joins up to FAMILY_CLOSURE_DEPTH (3) relationships directly
+# (users on a path are all distinct) and counts each group once, from this
+# database's relationships; ShardRouter.migrate() rebuilds it across shards.
+FAMILY_CLOSURE_PATH_COUNTS = [
+    "ALTER TABLE family_closure ADD COLUMN paths INTEGER NOT NULL DEFAULT 1",
+    "CREATE INDEX IF NOT EXISTS idx_family_relationships_relative_id ON family_relationships (relative_id)",
+    "DELETE FROM family_closure",
+    """
+    INSERT INTO family_closure (ancestor_id, descendant_id, depth, path_type, paths)
+    SELECT r1.user_id, r1.relative_id, 1, r1.relationship_type, COUNT(*)
+    FROM family_relationships r1
+    WHERE r1.relative_id != r1.user_id
+    GROUP BY r1.user_id, r1.relative_id, r1.relationship_type
+    """,
+    """
+    INSERT INTO family_closure (ancestor_id, descendant_id, depth, path_type, paths)
+    SELECT r1.user_id, r2.relative_id, 2, r1.relationship_type || ',' || r2.relationship_type, COUNT(*)
+    FROM family_relationships r1
+    JOIN family_relationships r2 ON r2.user_id = r1.relative_id
+    WHERE r1.relative_id != r1.user_id
+    AND r2.relative_id NOT IN (r1.user_id, r1.relative_id)
+    GROUP BY r1.user_id, r2.relative_id, r1.relationship_type, r2.relationship_type
+    """,
+    """
+    INSERT INTO family_closure (ancestor_id, descendant_id, depth, path_type, paths)
+    SELECT r1.user_id, r3.relative_id, 3,
+           r1.relationship_type || ',' || r2.relationship_type || ',' || r3.relationship_type, COUNT(*)
+    FROM family_relationships r1
+    JOIN family_relationships r2 ON r2.user_id = r1.relative_id
+    JOIN family_relationships r3 ON r3.user_id = r2.relative_id
+    WHERE r1.relative_id != r1.user_id
+    AND r2.relative_id NOT IN (r1.user_id, r1.relative_id)
+    AND r3.relative_id NOT IN (r1.user_id, r1.relative_id, r2.relative_id)
+    GROUP BY r1.user_id, r3.relative_id, r1.relationship_type, r2.relationship_type, r3.relationship_type
+    """,
+]
+
+# Every change to family_relationships, recorded by triggers so writes from
+# any process, bulk_insert() or plain SQL are seen. A row holds the edge and
+# its verified flag before and after the change (NULL when the edge did not
+# exist); a change to anything but the flag is logged as the old edge's
+# removal followed by the new edge's insertion. FamilyGraph replays the log
+# to stay current, and maintenance trims it to its newest rows.
+FAMILY_CHANGES = [
+    """
+    CREATE TABLE IF NOT EXISTS family_changes (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        relationship_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        relative_id INTEGER NOT NULL,
+        relationship_type TEXT NOT NULL,
+        verified_before INTEGER,
+        verified_after INTEGER
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_family_relationships_log_insert
+    AFTER INSERT ON family_relationships
+    BEGIN
+        INSERT INTO family_changes (relationship_id, user_id, relative_id, relationship_type, verified_before, verified_after)
+        VALUES (NEW.id, NEW.user_id, NEW.relative_id, NEW.relationship_type, NULL, CASE WHEN NEW.verified THEN 1 ELSE 0 END);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_family_relationships_log_delete
+    AFTER DELETE ON family_relationships
+    BEGIN
+        INSERT INTO family_changes (relationship_id, user_id, relative_id, relationship_type, verified_before, verified_after)
+        VALUES (OLD.id, OLD.user_id, OLD.relative_id, OLD.relationship_type, CASE WHEN OLD.verified THEN 1 ELSE 0 END, NULL);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_family_relationships_log_update
+    AFTER UPDATE OF id, user_id, relative_id, relationship_type, verified ON family_relationships
+    WHEN NEW.id IS NOT OLD.id OR NEW.user_id IS NOT OLD.user_id OR NEW.relative_id IS NOT OLD.relative_id
+    OR NEW.relationship_type IS NOT OLD.relationship_type OR NEW.verified IS NOT OLD.verified
+    BEGIN
+        INSERT INTO family_changes (relationship_id, user_id, relative_id, relationship_type, verified_before, verified_after)
+        SELECT OLD.id, OLD.user_id, OLD.relative_id, OLD.relationship_type, CASE WHEN OLD.verified THEN 1 ELSE 0 END, NULL
+        WHERE NEW.id IS NOT OLD.id OR NEW.user_id IS NOT OLD.user_id OR NEW.relative_id IS NOT OLD.relative_id
+        OR NEW.relationship_type IS NOT OLD.relationship_type;
+        INSERT INTO family_changes (relationship_id, user_id, relative_id, relationship_type, verified_before, verified_after)
+        SELECT NEW.id, NEW.user_id, NEW.relative_id, NEW.relationship_type,
+               CASE WHEN NEW.id IS NOT OLD.id OR NEW.user_id IS NOT OLD.user_id OR NEW.relative_id IS NOT OLD.relative_id
+                    OR NEW.relationship_type IS NOT OLD.relationship_type THEN NULL
+                    WHEN OLD.verified THEN 1 ELSE 0 END,
+               CASE WHEN NEW.verified THEN 1 ELSE 0 END;
+    END
+    """,
+]
+
+MIGRATIONS = [
+    Migration(1, 'baseline schema', [reconcile_legacy_schema] + list(CANONICAL_TABLES.values())),
+    Migration(2, 'hot path indexes', HOT_PATH_INDEXES, online=True),
+    Migration(3, 'user relationship counters', USER_COUNTERS),
+    Migration(4, 'family closure table', FAMILY_CLOSURE),
+    Migration(5, 'family closure path counts', FAMILY_CLOSURE_PATH_COUNTS),
+    Migration(6, 'family change log', FAMILY_CHANGES),
+]
+
+def ensure_migrations_table(db: Database) -> None:
+    """Create the schema_migrations bookkeeping table if needed."""
+    db.execute_query(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        )
+        """
+    )
+
+def applied_versions(db: Database) -> List[int]:
+    """
+    Get the versions already applied to a database.
+
+    Args:
+        db: Database to inspect
+
+    Returns:
+        Sorted list of applied migration versions
+    """
+    ensure_migrations_table(db)
+    rows = db.fetch_all("SELECT version FROM schema_migrations ORDER BY version")
+    return [row['version'] for row in rows]
+
+def current_version(db: Database) -> int:
+    """
+    Get the highest migration version applied to a database.
+
+    Args:
+        db: Database to inspect
+
+    Returns:
+        Schema version, or 0 for an unmigrated database
+    """
+    versions = applied_versions(db)
+    return versions[-1] if versions else 0
+
+def pending_migrations(db: Database, target: Optional[int] = None) -> List[Migration]:
+    """
+    Get the migrations not yet applied, in order.
+
+    Args:
+        db: Database to inspect
+        target: Highest version to include (defaults to the latest)
+
+    Returns:
+        List of pending migrations
+    """
+    applied = set(applied_versions(db))
+    return [
+        migration for migration in sorted(MIGRATIONS, key=lambda m: m.version)
+        if migration.version not in applied and (target is None or migration.version <= target)
+    ]
+
+def _run_step(conn: sqlite3.Connection, step: Union[str, Callable]) -> None:
+    """Run one migration step on a connection."""
+    if callable(step):
+        step(conn)
+    else:
+        conn.execute(step)
+
+def _record(conn: sqlite3.Connection, migration: Migration) -> None:
+    """Record a migration as applied."""
+    conn.execute(
+        "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+        (migration.version, migration.name, int(time.time()))
+    )
+
+def _apply_offline(db: Database, migration: Migration) -> None:
+    """
+    Apply a migration in a single transaction with foreign keys off.
+    
+    Foreign key enforcement can only be toggled outside a transaction, and
+    turning it off keeps DROP TABLE from cascading while tables are rebuilt.
+    The constraints are re-checked before committing, and enforcement is
+    restored to the connection's previous setting.
+    """
+    with db._connection() as conn:
+        enforced = _tuples(conn, "PRAGMA foreign_keys")[0][0]
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for step in migration.steps:
+                    _run_step(conn, step)
+                # Shards reference users on other shards, so only check
+                # databases that enforce foreign keys
+                violations = _tuples(conn, "PRAGMA foreign_key_check") if enforced else []
+                if violations:
+                    tables = sorted({row[0] for row in violations})
+                    logger.warning(
+                        f"Migration {migration.version} left {len(violations)} dangling "
+                        f"foreign keys in {', '.join(tables)}"
+                    )
+                _record(conn, migration)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.execute(f"PRAGMA foreign_keys = {'ON' if enforced else 'OFF'}")
+
+def _apply_online(db: Database, migration: Migration, pause: float) -> None:
+    """
+    Apply a migration one step per transaction.
+    
+    Each step (typically a CREATE INDEX) holds the write lock only for its
+    own duration, and the pause between steps lets waiting writers run.
+    A failure part way leaves the earlier steps in place; they are
+    idempotent, so the migration is simply retried.
+    """
+    for step in migration.steps:
+        with db.transaction() as conn:
+            _run_step(conn, step)
+        if pause:
+            time.sleep(pause)
+    with db.transaction() as conn:
+        _record(conn, migration)
+
+def apply_migrations(db: Optional[Database] = None, target: Optional[int] = None,
+                     pause: float = ONLINE_STEP_PAUSE) -> List[int]:
+    """
+    Apply pending migrations in version order.
+
+    A regular migration runs in one transaction together with its
+    schema_migrations record, so a failed migration leaves no trace and
+    the ones before it stay applied. Online migrations are applied step by
+    step (see Migration).
+
+    Args:
+        db: Database to migrate (defaults to the shared database)
+        target: Highest version to apply (defaults to the latest)
+        pause: Seconds to yield the write lock between online steps
+
+    Returns:
+        List of versions applied by this call
+    """
+    db = db or get_database()
+    applied = []
+    for migration in pending_migrations(db, target):
+        start = time.time()
+        try:
+            if migration.online:
+                _apply_online(db, migration, pause)
+            else:
+                _apply_offline(db, migration)
+        except Exception as e:
+            logger.error(f"Migration {migration.version} ({migration.name}) failed: {e}")
+            raise DatabaseError(f"Migration {migration.version} ({migration.name}) failed: {e}")
+        logger.info(f"Applied migration {migration.version}: {migration.name} in {time.time() - start:.2f}s")
+        applied.append(migration.version)
+    return applied
+
+def migration_status(db: Database) -> List[Dict[str, Any]]:
+    """
+    Describe every known migration and whether it is applied.
+
+    Args:
+        db: Database to inspect
+
+    Returns:
+        List of dicts with version, name, online and applied_at (None if pending)
+    """
+    ensure_migrations_table(db)
+    applied = {
+        row['version']: row['applied_at']
+        for row in db.fetch_all("SELECT version, applied_at FROM schema_migrations")
+    }
+    return [
+        {
+            'version': migration.version,
+            'name': migration.name,
+            'online': migration.online,
+            'applied_at': applied.get(migration.version),
+        }
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version)
+    ]
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Apply schema migrations to a Proof of Humanity database')
+    parser.add_argument('--database', '-d', default='instance/poh.sqlite',
+                        help='Path to the SQLite database (default: instance/poh.sqlite)')
+    parser.add_argument('--target', '-t', type=int,
+                        help='Highest migration version to apply (default: latest)')
+    parser.add_argument('--status', '-s', action='store_true',
+                        help='Show migration status without applying anything')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Number of shard files of a sharded database (default: 1)')
+    return parser.parse_args()
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    router = get_shards(args.database, args.shards, track_leaks=False, query_stats=False)
+    try:
+        if not args.status:
+            for index, applied in router.migrate(args.target).items():
+                print(f"Shard {index}: applied {len(applied)} migration(s)" + (f": {applied}" if applied else ""))
+        for index, db in enumerate(router.shards):
+            print(f"Shard {index} ({db.database_path})")
+            for entry in migration_status(db):
+                state = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['applied_at'])) \
+                    if entry['applied_at'] else 'pending'
+                print(f"{entry['version']:>4}  {entry['name']:<30} {state}")
+    except DatabaseError as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        close_all_databases()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
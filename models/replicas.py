@@ -0,0 +1,307 @@
+"""
+Snapshot read replicas of the Proof of Humanity database.
+
+A ReplicaManager keeps a periodically refreshed copy of a database file,
+made with the SQLite online backup API, for queries that read a lot and can
+tolerate slightly stale data: dashboards, analytics, exports and
+benchmarks. Queries against the replica never take locks on the primary,
+so they cannot hold up its writer or its WAL checkpoints.
+
+Each refresh copies the primary into a temporary file in page steps and
+then atomically renames it over the replica. Readers hold the old file open
+until they reconnect, so a refresh never changes data under a running query.
+
+The application starts the shared replica at startup with start_replica()
+(DATABASE_REPLICA), whose refresher takes the first snapshot in the
+background; request handlers only look it up with get_replica().
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+
+from models.database import resolve_database_path, _registry_key
+
+logger = logging.getLogger('database')
+
+def replica_path_for(database_path: str) -> str:
+    """
+    Get the default replica file for a database.
+
+    Args:
+        database_path: Path of the primary database
+
+    Returns:
+        Sibling path named <stem>.replica<ext>
+    """
+    root, ext = os.path.splitext(database_path)
+    return f"{root}.replica{ext or '.sqlite'}"
+
+class _BackupRestarted(Exception):
+    """Raised from the backup progress callback when the copy started over."""
+
+class ReplicaManager:
+    """
+    Keeps a snapshot copy of a database fresh and serves read queries from it.
+    """
+
+    def __init__(self, database_path: str = None, replica_path: str = None,
+                 interval: float = None, pages: int = None, max_restarts: int = 3):
+        """
+        Initialize the replica manager.
+
+        Args:
+            database_path: Path of the primary database (defaults to DATABASE_PATH)
+            replica_path: Path of the snapshot (defaults to <stem>.replica<ext>)
+            interval: Seconds between background refreshes (defaults to
+                DATABASE_REPLICA_INTERVAL)
+            pages: Pages copied per backup step (defaults to DATABASE_REPLICA_PAGES)
+            max_restarts: Times an incremental copy may start over because the
+                primary changed before it falls back to a single-step copy
+        """
+        try:
+            from flask import current_app
+            config = current_app.config
+        except (RuntimeError, ImportError):
+            # Working outside of application context
+            config = {}
+
+        self.database_path = resolve_database_path(database_path)
+        self.replica_path = replica_path or replica_path_for(self.database_path)
+        if interval is None:
+            interval = float(config.get('DATABASE_REPLICA_INTERVAL', os.environ.get('DATABASE_REPLICA_INTERVAL', 60)))
+        if pages is None:
+            pages = int(config.get('DATABASE_REPLICA_PAGES', os.environ.get('DATABASE_REPLICA_PAGES', 1024)))
+        self.interval = interval
+        self.pages = pages
+        self.max_restarts = max_restarts
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # Bumped by every refresh so readers reconnect to the new snapshot
+        self.generation = 0
+        self.refreshed_at = None
+
+        # Statistics, exported through stats()
+        self.refreshes = 0
+        self.failures = 0
+        self.restarts = 0
+        self.fallbacks = 0
+        self.last_duration = 0.0
+
+        self._refresher = None
+        self._stop = threading.Event()
+
+    def refresh(self) -> None:
+        """
+        Copy the primary into a new snapshot and swap it in.
+
+        The copy is made in steps of ``pages`` pages so it never holds the
+        primary's read lock for long. A write to the primary between steps
+        makes SQLite restart the copy; after ``max_restarts`` restarts the
+        copy is redone in a single step instead.
+        """
+        with self.lock:
+            start = time.perf_counter()
+            temp_path = f"{self.replica_path}.tmp"
+            for suffix in ('', '-journal', '-wal', '-shm'):
+                if os.path.exists(temp_path + suffix):
+                    os.remove(temp_path + suffix)
+
+            source = sqlite3.connect(self.database_path, timeout=10)
+            target = sqlite3.connect(temp_path)
+            try:
+                try:
+                    self._copy(source, target, self.pages)
+                except _BackupRestarted:
+                    self.fallbacks += 1
+                    logger.info(f"Replica copy of {self.database_path} kept restarting, copying in one step")
+                    self._copy(source, target, -1)
+                # A plain rollback journal file, safe to rename and open immutable
+                target.execute("PRAGMA journal_mode = DELETE")
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Error refreshing replica {self.replica_path}: {e}")
+                raise
+            finally:
+                target.close()
+                source.close()
+
+            os.replace(temp_path, self.replica_path)
+            self.generation += 1
+            self.refreshes += 1
+            self.refreshed_at = time.time()
+            self.last_duration = time.perf_counter() - start
+            logger.debug(f"Refreshed replica {self.replica_path} in {self.last_duration:.3f}s")
+
+    def _copy(self, source: sqlite3.Connection, target: sqlite3.Connection, pages: int) -> None:
+        """Run one backup, raising _BackupRestarted once it restarted too often."""
+        restarts = 0
+        previous = None
+
+        def progress(status, remaining, total):
+            nonlocal restarts, previous
+            if previous is not None and remaining > previous:
+                restarts += 1
+                self.restarts += 1
+                if restarts > self.max_restarts:
+                    raise _BackupRestarted()
+            previous = remaining
+
+        source.backup(target, pages=pages, progress=progress if pages > 0 else None)
+
+    @property
+    def ready(self) -> bool:
+        """Whether a snapshot has been taken, so reads do not have to copy the primary first."""
+        return self.generation > 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection to the current snapshot, taking the first one if needed."""
+        if self.generation == 0 or not os.path.exists(self.replica_path):
+            self.refresh()
+
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None and self.local.generation == self.generation:
+            return conn
+        if conn is not None:
+            conn.close()
+
+        # The snapshot file is never modified once swapped in, so readers can
+        # skip locking and change detection entirely
+        conn = sqlite3.connect(f"file:{self.replica_path}?mode=ro&immutable=1", uri=True,
+                               check_same_thread=False)
+        conn.row_factory = lambda cursor, row: {
+            column[0]: row[index] for index, column in enumerate(cursor.description)
+        }
+        self.local.conn = conn
+        self.local.generation = self.generation
+        return conn
+
+    def fetch_all(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        """
+        Run a read query against the snapshot.
+
+        Args:
+            query: SQL query
+            params: Query parameters
+
+        Returns:
+            List of rows as dictionaries
+        """
+        return self._connection().execute(query, params).fetchall()
+
+    def fetch_one(self, query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
+        """
+        Run a read query against the snapshot and return its first row.
+
+        Args:
+            query: SQL query
+            params: Query parameters
+
+        Returns:
+            First row as a dictionary, or None
+        """
+        return self._connection().execute(query, params).fetchone()
+
+    def start(self) -> None:
+        """Take a snapshot in the background now, and again every ``interval`` seconds."""
+        if self._refresher is not None or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._refresher = threading.Thread(target=self._run, name='replica-refresher', daemon=True)
+        self._refresher.start()
+
+    def _run(self) -> None:
+        """Background refresh loop."""
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                # Already logged; keep serving the previous snapshot
+                pass
+            self._stop.wait(self.interval)
+
+    def stop(self) -> None:
+        """Stop the background refresher and close this thread's connection."""
+        self._stop.set()
+        if self._refresher is not None:
+            self._refresher.join(timeout=5)
+            self._refresher = None
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get replica statistics.
+
+        Returns:
+            Dictionary with the snapshot's age, size and refresh counters
+        """
+        return {
+            'replica_path': self.replica_path,
+            'age': time.time() - self.refreshed_at if self.refreshed_at else None,
+            'size': os.path.getsize(self.replica_path) if os.path.exists(self.replica_path) else 0,
+            'interval': self.interval,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'restarts': self.restarts,
+            'fallbacks': self.fallbacks,
+            'last_duration': self.last_duration
+        }
+
+# Process-wide registry of replica managers, keyed by primary database path
+_replicas: Dict[str, ReplicaManager] = {}
+_replicas_lock = threading.Lock()
+
+def start_replica(database_path: Optional[str] = None, **kwargs) -> ReplicaManager:
+    """
+    Start the shared ReplicaManager for a database.
+
+    The refresher thread takes the first snapshot, so this returns at once.
+    close_all_databases() stops it.
+
+    Args:
+        database_path: Path of the primary database (defaults to DATABASE_PATH)
+        **kwargs: ReplicaManager options, only used when it is first created
+
+    Returns:
+        The running ReplicaManager
+    """
+    database_path = resolve_database_path(database_path)
+    key = _registry_key(database_path)
+
+    with _replicas_lock:
+        replica = _replicas.get(key)
+        if replica is None:
+            replica = ReplicaManager(database_path, **kwargs)
+            replica.start()
+            _replicas[key] = replica
+        return replica
+
+def get_replica(database_path: Optional[str] = None) -> Optional[ReplicaManager]:
+    """
+    Get the running replica of a database.
+
+    Args:
+        database_path: Path of the primary database (defaults to DATABASE_PATH)
+
+    Returns:
+        The ReplicaManager, or None if start_replica() was not called for it
+    """
+    return _replicas.get(_registry_key(resolve_database_path(database_path)))
+
+def stop_all_replicas() -> None:
+    """Stop every registered replica refresher and clear the registry."""
+    with _replicas_lock:
+        replicas = list(_replicas.values())
+        _replicas.clear()
+    for replica in replicas:
+        replica.stop()
+
+atexit.register(stop_all_replicas)
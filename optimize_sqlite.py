@@ -12,52 +12,18 @@ import argparse
 import time
 from pathlib import Path
 
-# M2-optimized pragma settings
-M2_OPTIMIZED_PRAGMAS = {
-    'journal_mode': 'WAL',       # Write-Ahead Logging for better concurrency
-    'synchronous': 'NORMAL',     # Balance between safety and performance
-    'cache_size': -10000,        # 10MB cache (negative value means kilobytes)
-    'mmap_size': 30000000000,    # 30GB memory map for faster reads
-    'temp_store': 'MEMORY',      # Store temp tables and indices in memory
-    'foreign_keys': 'ON',        # Maintain referential integrity
-    'auto_vacuum': 'INCREMENTAL' # Incremental vacuuming to manage free space
-}
+from models.migrations import HOT_PATH_INDEXES
+from models.replicas import ReplicaManager
+from models.hardware import HARDWARE_PROFILES
 
-# For testing on different hardware
-HARDWARE_PROFILES = {
-    'm1': {
-        'journal_mode': 'WAL',
-        'synchronous': 'NORMAL',
-        'cache_size': -8000,      # 8MB cache
-        'mmap_size': 20000000000, # 20GB memory map
-    },
-    'm2': M2_OPTIMIZED_PRAGMAS,
-    'm2_pro': {
-        'journal_mode': 'WAL',
-        'synchronous': 'NORMAL',
-        'cache_size': -20000,     # 20MB cache
-        'mmap_size': 40000000000, # 40GB memory map
-    },
-    'safe': {
-        'journal_mode': 'DELETE', # Traditional rollback journal
-        'synchronous': 'FULL',    # Maximum durability
-        'cache_size': -2000,      # 2MB cache
-        'mmap_size': 0,           # No memory mapping
-    }
-}
+# M2-optimized pragma settings; the profiles are shared with the connection
+# pool, which applies them to every connection it opens
+M2_OPTIMIZED_PRAGMAS = HARDWARE_PROFILES['m2']
 
-# Recommended indexes for the Proof of Humanity database
-RECOMMENDED_INDEXES = [
-    "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)",
-    "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)",
-    "CREATE INDEX IF NOT EXISTS idx_family_relationships_user_id ON family_relationships(user_id)",
-    "CREATE INDEX IF NOT EXISTS idx_family_relationships_relative_id ON family_relationships(relative_id)",
-    "CREATE INDEX IF NOT EXISTS idx_verification_requests_user_id ON verification_requests(user_id)",
-    "CREATE INDEX IF NOT EXISTS idx_verification_requests_status ON verification_requests(status)",
-    "CREATE INDEX IF NOT EXISTS idx_verification_requests_created_at ON verification_requests(created_at)",
-    "CREATE INDEX IF NOT EXISTS idx_did_documents_user_id ON did_documents(user_id)",
-    "CREATE INDEX IF NOT EXISTS idx_video_sessions_user_id ON video_sessions(user_id)",
-]
+# Recommended indexes for the Proof of Humanity database. They are owned by
+# the schema migrations; --add-indexes only helps databases that have not
+# been migrated yet.
+RECOMMENDED_INDEXES = list(HOT_PATH_INDEXES)
 
 def parse_arguments():
     """Parse command line arguments for database optimization."""
@@ -74,6 +40,8 @@ def parse_arguments():
                         help='Run ANALYZE to update optimization statistics')
     parser.add_argument('--benchmark', '-b', action='store_true',
                         help='Run benchmarks to measure performance improvements')
+    parser.add_argument('--benchmark-live', action='store_true',
+                        help='Benchmark the live database instead of a fresh snapshot of it')
     return parser.parse_args()
 
 def check_database(db_path):
@@ -259,7 +227,7 @@ def run_benchmark(db_path):
         {
             "name": "User verification status",
             "query": """
-                SELECT u.username, COUNT(v.id) as verification_count, MAX(v.status) as latest_status 
+                SELECT u.name, COUNT(v.id) as verification_count, MAX(v.status) as latest_status 
                 FROM users u 
                 LEFT JOIN verification_requests v ON u.id = v.user_id 
                 GROUP BY u.id LIMIT 100
@@ -268,7 +236,7 @@ def run_benchmark(db_path):
         {
             "name": "Family relationships",
             "query": """
-                SELECT u1.username as user, u2.username as relative, f.relationship_type 
+                SELECT u1.name as user, u2.name as relative, f.relationship_type 
                 FROM family_relationships f
                 JOIN users u1 ON f.user_id = u1.id
                 JOIN users u2 ON f.relative_id = u2.id
@@ -278,7 +246,7 @@ def run_benchmark(db_path):
         {
             "name": "Recent verification requests",
             "query": """
-                SELECT v.id, u.username, v.created_at, v.status
+                SELECT v.id, u.name, v.created_at, v.status
                 FROM verification_requests v
                 JOIN users u ON v.user_id = u.id
                 ORDER BY v.created_at DESC LIMIT 100
@@ -394,7 +362,13 @@ def main():
     
     # Run benchmark if requested
     if args.benchmark:
-        run_benchmark(args.database)
+        if args.benchmark_live:
+            run_benchmark(args.database)
+        else:
+            # Benchmark a snapshot so the timing queries never block the app's writer
+            replica = ReplicaManager(args.database, interval=0)
+            replica.refresh()
+            run_benchmark(replica.replica_path)
     
     print("\nOptimization complete! Your database is now optimized for M2 Mac performance.")
     print("=" * 80)
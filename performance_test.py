@@ -32,6 +32,8 @@ def parse_arguments():
     parser.add_argument('--cpu', '-c', action='store_true', help='Track CPU usage')
     parser.add_argument('--visualize', '-v', action='store_true', help='Generate visualization of results')
     parser.add_argument('--parallel', '-p', type=int, help='Run tests in parallel with specified number of workers')
+    parser.add_argument('--row-memory', '-r', type=int, nargs='?', const=100000, metavar='ROWS',
+                       help='Compare memory of dict rows and sqlite3.Row results (default 100000 rows)')
     return parser.parse_args()
 
 def get_system_info():
@@ -127,7 +129,7 @@ def analyze_database_performance():
         "SELECT count(*) FROM users",
         "SELECT count(*) FROM family_relationships",
         "SELECT * FROM verification_requests ORDER BY created_at DESC LIMIT 10",
-        "SELECT u.username, COUNT(f.id) FROM users u LEFT JOIN family_relationships f ON u.id = f.user_id GROUP BY u.id",
+        "SELECT u.name, COUNT(f.id) FROM users u LEFT JOIN family_relationships f ON u.id = f.user_id GROUP BY u.id",
     ]
     
     results = {}
@@ -150,6 +152,44 @@ def analyze_database_performance():
     
     return results
 
+def analyze_row_memory(row_count=100000):
+    """Compare memory held by dict rows and compact sqlite3.Row results."""
+    import tempfile
+    from models.database import Database
+    
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = Database(os.path.join(tmp_dir, "rows.db"))
+        try:
+            db.execute_query(
+                "CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT, "
+                "verification_level INTEGER, created_at INTEGER)"
+            )
+            with db.transaction() as conn:
+                conn.executemany(
+                    "INSERT INTO users (name, email, verification_level, created_at) VALUES (?, ?, ?, ?)",
+                    ((f"User {i}", f"user{i}@example.com", i % 4, i) for i in range(row_count))
+                )
+            
+            for mode in ('dict', 'row'):
+                tracemalloc.start()
+                start_time = time.time()
+                rows = db.fetch_all("SELECT * FROM users", row_mode=mode)
+                elapsed = time.time() - start_time
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results[mode] = {
+                    "rows": len(rows),
+                    "memory_mb": current / (1024 * 1024),
+                    "peak_memory_mb": peak / (1024 * 1024),
+                    "fetch_time": elapsed,
+                }
+                del rows
+        finally:
+            db.close_pools()
+    
+    return results
+
 def visualize_results(results):
     """Create visualizations of performance test results."""
     # Ensure output directory exists
@@ -189,7 +229,7 @@ def visualize_results(results):
         plt.savefig(output_file)
         print(f"Memory usage visualization saved to {output_file}")
 
-def print_summary(all_results, system_info, db_results=None):
+def print_summary(all_results, system_info, db_results=None, row_results=None):
     """Print a summary of test results with M2-specific analysis."""
     print("\n" + "=" * 80)
     print("PERFORMANCE TEST SUMMARY FOR M2 MAC")
@@ -219,6 +259,12 @@ def print_summary(all_results, system_info, db_results=None):
             if query != "error":
                 print(f"  {query}: {time:.5f} seconds")
     
+    if row_results:
+        print("\nRow Representation Memory:")
+        for mode, stats in row_results.items():
+            print(f"  {mode}: {stats['memory_mb']:.2f} MB for {stats['rows']} rows "
+                  f"(peak {stats['peak_memory_mb']:.2f} MB, {stats['fetch_time']:.3f} s)")
+    
     # M2-specific recommendations
     print("\nM2-Specific Recommendations:")
     if avg_time > 5.0:
@@ -272,13 +318,19 @@ def main():
         print("\nAnalyzing database performance...")
         db_results = analyze_database_performance()
     
+    # Compare row representations if requested
+    row_results = None
+    if args.row_memory:
+        print(f"\nMeasuring row memory for {args.row_memory} rows...")
+        row_results = analyze_row_memory(args.row_memory)
+    
     # Visualize results if requested
     if args.visualize and len(all_results) > 1:
         print("\nGenerating visualizations...")
         visualize_results(all_results)
     
     # Print summary with M2-specific analysis
-    print_summary(all_results, system_info, db_results)
+    print_summary(all_results, system_info, db_results, row_results)
     
     return 0
 
@@ -2,7 +2,9 @@
 API routes package for the Proof of Humanity application.
 """
 
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, g
+
+from models.maintenance import get_maintenance
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
@@ -18,7 +20,17 @@ bp.register_blueprint(did_bp, url_prefix='/did')
 @bp.route('/health')
 def health_check():
     """Health check endpoint for API monitoring."""
-    return jsonify({"status": "ok"})
+    health = {"status": "ok"}
+    
+    # Export connection pool usage so the pool can be sized from monitoring
+    db = g.get('db')
+    if db is not None:
+        health["database"] = db.pool_stats()
+        maintenance = get_maintenance(db)
+        if maintenance is not None:
+            health["database"]["maintenance"] = maintenance.stats()
+    
+    return jsonify(health)
 
 # Error handling for API routes
 @bp.errorhandler(404)
@@ -8,13 +8,9 @@ from utils.security import require_auth, verify_token, generate_csrf_token
 import logging
 from functools import wraps
 import jwt
-from models.database import Database
 
 did_bp = Blueprint('did', __name__)
 
-# Initialize database
-db = Database()
-
 def require_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -3,18 +3,29 @@ Family relationship API route handlers for the Proof of Humanity application.
 """
 
 from flask import Blueprint, request, jsonify, current_app, g
+import re
 import json
 from utils.security import require_auth, verify_token, generate_csrf_token
 import logging
 from functools import wraps
 import jwt
-from models.database import Database
+from models.database import get_user_by_email, get_user_by_id, find_relationship_path
+from models.database import get_family_tree as build_family_tree
+from models.database import get_family_tree_changes as build_family_tree_changes
 
 # Create blueprint
 family_bp = Blueprint('family', __name__)
 
-# Initialize database
-db = Database()
+# Bounds for the tree query parameters
+DEFAULT_TREE_DEPTH = 3
+MAX_TREE_DEPTH = 6
+DEFAULT_TREE_NODES = 200
+MAX_TREE_NODES = 1000
+DEFAULT_PATH_DEPTH = 6
+MAX_PATH_DEPTH = 12
+
+# Tree versions: one change log position per shard, joined by dots
+VERSION_RE = re.compile(r'\d{1,19}(?:\.\d{1,19})*')
 
 def require_auth(f):
     @wraps(f)
@@ -34,24 +45,123 @@ def require_auth(f):
             return jsonify({'error': 'Invalid authorization header format'}), 401
     return decorated
 
+def _int_arg(name, default, minimum, maximum):
+    """Read a bounded integer query parameter, or None if it is invalid."""
+    value = request.args.get(name, default, type=int)
+    if value is None or value < minimum or value > maximum:
+        return None
+    return value
+
+def _cursor_arg():
+    """
+    Read the tree cursor query parameter.
+    
+    Returns:
+        Tuple of a valid flag and the (depth, relationship id) cursor, or
+        None for the first page
+    """
+    value = request.args.get('cursor', '')
+    if value in ('', '0'):
+        return True, None
+    try:
+        depth, relation_id = (int(part) for part in value.split(','))
+    except ValueError:
+        return False, None
+    if not 0 <= depth <= MAX_TREE_DEPTH or relation_id < 0:
+        return False, None
+    return True, (depth, relation_id)
+
+def _version_arg():
+    """Read the since query parameter, a tree version, or None if it is invalid."""
+    value = request.args.get('since', '')
+    return value if VERSION_RE.fullmatch(value) else None
+
+def _current_user_id():
+    """Resolve the token subject (a user id or an email) to a user id, or None."""
+    subject = str(g.user.get('sub', ''))
+    if subject.isdigit():
+        user = get_user_by_id(int(subject))
+    elif '@' in subject:
+        user = get_user_by_email(subject)
+    else:
+        user = None
+    return user['id'] if user else None
+
 @family_bp.route('/tree', methods=['GET'])
 @require_auth
 def get_family_tree():
     """
-    Get the family tree for the authenticated user.
+    Get the family tree for the authenticated user, one page at a time.
+    
+    Query parameters:
+        depth: Maximum number of hops from the user (default 3)
+        max_nodes: Maximum number of users added by this page (default 200)
+        cursor: Cursor from the previous response; with the same depth it
+            returns the next page, with a larger depth the next level
     """
-    # Mock family tree data for testing
-    family_tree = {
-        'nodes': [
-            {'id': 1, 'name': 'Test User', 'verification_level': 1},
-            {'id': 2, 'name': 'Admin User', 'verification_level': 3}
-        ],
-        'links': [
-            {'source': 1, 'target': 2, 'type': 'colleague', 'verified': True}
-        ]
-    }
+    depth = _int_arg('depth', DEFAULT_TREE_DEPTH, 1, MAX_TREE_DEPTH)
+    max_nodes = _int_arg('max_nodes', DEFAULT_TREE_NODES, 1, MAX_TREE_NODES)
+    valid, cursor = _cursor_arg()
+    if depth is None or max_nodes is None or not valid:
+        return jsonify({
+            'error': f'depth must be 1-{MAX_TREE_DEPTH}, max_nodes 1-{MAX_TREE_NODES} '
+                     f'and cursor a value returned by this endpoint'
+        }), 400
+    
+    user_id = _current_user_id()
+    if user_id is None:
+        family_tree = {'nodes': [], 'links': [], 'cursor': None, 'has_more': False, 'version': None}
+        return jsonify({'family_tree': family_tree}), 200
+    
+    # Traversal stops once the page is full
+    family_tree = build_family_tree(user_id, depth=depth, max_nodes=max_nodes, cursor=cursor)
+    family_tree['cursor'] = '{},{}'.format(*family_tree['cursor'])
     return jsonify({'family_tree': family_tree}), 200
 
+@family_bp.route('/tree/changes', methods=['GET'])
+@require_auth
+def get_family_tree_changes():
+    """
+    Get the changes to the authenticated user's family tree since a version.
+    
+    Query parameters:
+        since: ``version`` of the tree (or of the last changes) the client holds
+        depth: Number of hops the client loaded (default 3)
+    """
+    since = _version_arg()
+    depth = _int_arg('depth', DEFAULT_TREE_DEPTH, 1, MAX_TREE_DEPTH)
+    if since is None or depth is None:
+        return jsonify({
+            'error': f'since must be a version returned by this API and depth 1-{MAX_TREE_DEPTH}'
+        }), 400
+    
+    user_id = _current_user_id()
+    if user_id is None:
+        return jsonify({'changes': {'reset': True, 'version': None}}), 200
+    
+    return jsonify({'changes': build_family_tree_changes(user_id, since, depth=depth)}), 200
+
+@family_bp.route('/path/<int:other_id>', methods=['GET'])
+@require_auth
+def get_relationship_path(other_id):
+    """
+    Get how the authenticated user is related to another user. Users on
+    the path are returned with their id and name only.
+    
+    Query parameters:
+        max_depth: Maximum number of relationships on the path (default 6)
+    """
+    max_depth = _int_arg('max_depth', DEFAULT_PATH_DEPTH, 1, MAX_PATH_DEPTH)
+    if max_depth is None:
+        return jsonify({'error': f'max_depth must be 1-{MAX_PATH_DEPTH}'}), 400
+    
+    user_id = _current_user_id()
+    path = find_relationship_path(user_id, other_id, max_depth=max_depth) if user_id is not None else None
+    if path is None:
+        return jsonify({'error': 'No relationship path found'}), 404
+    
+    return jsonify({'path': path}), 200
+
 @family_bp.route('/relationship', methods=['POST'])
 @require_auth
 def add_family_relationship():
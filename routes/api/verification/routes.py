@@ -9,13 +9,9 @@ import logging
 from datetime import datetime
 from functools import wraps
 import jwt
-from models.database import Database
 
 verification_bp = Blueprint('verification', __name__)
 
-# Initialize database
-db = Database()
-
 def require_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, g, session
 from werkzeug.security import generate_password_hash, check_password_hash
-from models.database import Database
+from models.database import Database, get_user_by_id
 from models.user import User
 
 # Create auth blueprint
@@ -102,8 +102,8 @@ def load_logged_in_user():
     if user_id is None:
         g.user = None
     else:
-        db = g.db
-        user_data = db.execute_query_fetch_one('SELECT * FROM users WHERE id = ?', (user_id,))
+        # Runs on every request, so go through the user cache
+        user_data = get_user_by_id(user_id)
         
         if user_data:
             g.user = User.from_db(user_data)
@@ -3,8 +3,8 @@
 
 import os
 import sys
+import time
 import random
-from datetime import datetime, timedelta
 import hashlib
 import json
 import uuid
@@ -14,7 +14,8 @@ project_root = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, project_root)
 
 from app import create_app
-from models.database import Database
+from models.database import get_database
+from models.migrations import apply_migrations
 
 def generate_sample_data():
     """Generate sample data for the Proof of Humanity application."""
@@ -23,50 +24,47 @@ def generate_sample_data():
     # Create app context
     app = create_app('development')
     with app.app_context():
-        db = Database()
+        db = get_database()
+        apply_migrations(db)
+        now = int(time.time())
         
         # Create sample users
         users = []
+        new_users = []
         for i in range(1, 11):
-            username = f"user{i}"
+            name = f"First{i} Last{i}"
             email = f"user{i}@example.com"
             password_hash = hashlib.sha256(f"password{i}".encode()).hexdigest()
             
             # Check if user already exists
             existing_user = db.execute_query_fetch_one(
-                "SELECT id FROM users WHERE username = ? OR email = ?",
-                params=(username, email)
+                "SELECT id FROM users WHERE email = ?",
+                params=(email,)
             )
             
             if existing_user:
-                user_id = existing_user['id']
-                print(f"User {username} already exists with ID {user_id}")
+                users.append(existing_user['id'])
+                print(f"User {email} already exists with ID {existing_user['id']}")
             else:
-                user_id = db.execute_query(
-                    """
-                    INSERT INTO users 
-                    (username, email, password_hash, first_name, last_name, date_of_birth, 
-                    is_verified, verification_level, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    params=(
-                        username, 
-                        email, 
-                        password_hash,
-                        f"First{i}",
-                        f"Last{i}",
-                        (datetime.now() - timedelta(days=365*25 + i*100)).strftime('%Y-%m-%d'),
-                        i % 4 == 0,  # Every 4th user is verified
-                        min(i % 4, 3),  # Verification levels 0-3
-                        datetime.now().isoformat(),
-                        datetime.now().isoformat()
-                    )
-                )
-                print(f"Created user {username} with ID {user_id}")
-            
-            users.append(user_id)
+                new_users.append({
+                    'name': name,
+                    'email': email,
+                    'password_hash': password_hash,
+                    'email_verified': i % 4 == 0,  # Every 4th user is verified
+                    'verification_level': min(i % 4, 3),  # Verification levels 0-3
+                    'created_at': now,
+                    'updated_at': now
+                })
+        
+        if new_users:
+            user_ids = db.bulk_insert('users', new_users, return_ids=True)
+            for user, user_id in zip(new_users, user_ids):
+                print(f"Created user {user['email']} with ID {user_id}")
+            users.extend(user_ids)
         
         # Create family relationships
+        relations = []
+        seen_pairs = set()
         for i, user_id in enumerate(users):
             # Connect each user with 1-3 other users
             num_connections = random.randint(1, 3)
@@ -76,30 +74,30 @@ def generate_sample_data():
                 relationship_type = random.choice(relationship_types)
                 
                 # Check if relationship already exists
+                if (user_id, relative_id) in seen_pairs:
+                    continue
                 existing_relation = db.execute_query_fetch_one(
-                    "SELECT id FROM family_relations WHERE user_id = ? AND relative_id = ?",
+                    "SELECT id FROM family_relationships WHERE user_id = ? AND relative_id = ?",
                     params=(user_id, relative_id)
                 )
                 
                 if not existing_relation:
-                    relation_id = db.execute_query(
-                        """
-                        INSERT INTO family_relations
-                        (user_id, relative_id, relationship_type, is_verified, created_at, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                        """,
-                        params=(
-                            user_id,
-                            relative_id,
-                            relationship_type,
-                            random.choice([0, 1]),  # Randomly verified
-                            datetime.now().isoformat(),
-                            datetime.now().isoformat()
-                        )
-                    )
+                    seen_pairs.add((user_id, relative_id))
+                    relations.append({
+                        'user_id': user_id,
+                        'relative_id': relative_id,
+                        'relationship_type': relationship_type,
+                        'verified': random.choice([0, 1]),  # Randomly verified
+                        'created_at': now,
+                        'updated_at': now
+                    })
                     print(f"Created {relationship_type} relationship between users {user_id} and {relative_id}")
         
-        # Create verification attempts
+        if relations:
+            db.bulk_insert('family_relationships', relations)
+        
+        # Create verification requests
+        attempts = []
         for user_id in users:
             # 50% chance to have verification attempts
             if random.random() < 0.5:
@@ -108,32 +106,30 @@ def generate_sample_data():
                     verification_types = ['initial', 'family', 'document', 'video']
                     status_options = ['pending', 'approved', 'rejected']
                     
-                    attempt_id = db.execute_query(
-                        """
-                        INSERT INTO verification_attempts
-                        (user_id, verifier_id, status, verification_type, created_at, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                        """,
-                        params=(
-                            user_id,
-                            random.choice(users),  # Random verifier
-                            random.choice(status_options),
-                            random.choice(verification_types),
-                            datetime.now().isoformat(),
-                            datetime.now().isoformat()
-                        )
-                    )
-                    print(f"Created verification attempt {attempt_id} for user {user_id}")
+                    attempts.append({
+                        'user_id': user_id,
+                        'verifier_id': random.choice(users),  # Random verifier
+                        'status': random.choice(status_options),
+                        'type': random.choice(verification_types),
+                        'created_at': now,
+                        'updated_at': now
+                    })
+        
+        if attempts:
+            attempt_ids = db.bulk_insert('verification_requests', attempts, return_ids=True)
+            for attempt, attempt_id in zip(attempts, attempt_ids):
+                print(f"Created verification request {attempt_id} for user {attempt['user_id']}")
         
         # Create DIDs for verified users
+        did_documents = []
         for user_id in users:
             # Check if user is verified
             user = db.execute_query_fetch_one(
-                "SELECT is_verified FROM users WHERE id = ?",
+                "SELECT email_verified FROM users WHERE id = ?",
                 params=(user_id,)
             )
             
-            if user and user['is_verified']:
+            if user and user['email_verified']:
                 # Check if DID already exists
                 existing_did = db.execute_query_fetch_one(
                     "SELECT id FROM did_documents WHERE user_id = ?",
@@ -158,23 +154,19 @@ def generate_sample_data():
                         ]
                     }
                     
-                    did_doc_id = db.execute_query(
-                        """
-                        INSERT INTO did_documents
-                        (user_id, did_identifier, document_json, public_key, created_at, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                        """,
-                        params=(
-                            user_id,
-                            did_id,
-                            json.dumps(document),
-                            "sample_public_key_" + str(user_id),
-                            datetime.now().isoformat(),
-                            datetime.now().isoformat()
-                        )
-                    )
+                    did_documents.append({
+                        'user_id': user_id,
+                        'identifier': did_id,
+                        'document': json.dumps(document),
+                        'keys': json.dumps(["sample_public_key_" + str(user_id)]),
+                        'created_at': now,
+                        'updated_at': now
+                    })
                     print(f"Created DID {did_id} for verified user {user_id}")
         
+        if did_documents:
+            db.bulk_insert('did_documents', did_documents)
+        
         print("Sample data generation complete!")
 
 if __name__ == "__main__":
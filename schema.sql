@@ -1,53 +1,57 @@
 -- Schema for Proof of Humanity application
+--
+-- Plain SQL copy of the schema built by models/migrations.py (migrations 1
+-- to 6). Keep the two in sync: schema changes go in a new migration first.
 
 -- Drop existing tables
-DROP TABLE IF EXISTS users;
-DROP TABLE IF EXISTS family_relations;
-DROP TABLE IF EXISTS verification_attempts;
+DROP TABLE IF EXISTS family_changes;
+DROP TABLE IF EXISTS family_closure;
+DROP TABLE IF EXISTS notifications;
 DROP TABLE IF EXISTS did_documents;
+DROP TABLE IF EXISTS verification_requests;
+DROP TABLE IF EXISTS family_relationships;
+DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS schema_migrations;
 
 -- Users table
 CREATE TABLE users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
     email TEXT UNIQUE NOT NULL,
     password_hash TEXT NOT NULL,
-    first_name TEXT,
-    last_name TEXT,
-    date_of_birth TEXT,
-    profile_picture TEXT,
-    bio TEXT,
-    is_verified BOOLEAN DEFAULT 0,
     verification_level INTEGER DEFAULT 0,
     email_verified BOOLEAN DEFAULT 0,
-    created_at TEXT NOT NULL,
-    updated_at TEXT NOT NULL
+    created_at INTEGER NOT NULL, -- Unix seconds, as are all timestamps below
+    updated_at INTEGER NOT NULL,
+    verified_relationship_count INTEGER NOT NULL DEFAULT 0, -- maintained by triggers
+    did_count INTEGER NOT NULL DEFAULT 0 -- maintained by triggers
 );
 
--- Family relations table
-CREATE TABLE family_relations (
+-- Family relationships table
+CREATE TABLE family_relationships (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
     relative_id INTEGER NOT NULL,
     relationship_type TEXT NOT NULL, -- parent, child, sibling, spouse, cousin
-    is_verified BOOLEAN DEFAULT 0,
-    created_at TEXT NOT NULL,
-    updated_at TEXT NOT NULL,
-    FOREIGN KEY (user_id) REFERENCES users (id),
-    FOREIGN KEY (relative_id) REFERENCES users (id)
+    verified BOOLEAN DEFAULT 0,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+    FOREIGN KEY (relative_id) REFERENCES users (id) ON DELETE CASCADE,
+    UNIQUE (user_id, relative_id)
 );
 
--- Verification attempts table
-CREATE TABLE verification_attempts (
+-- Verification requests table
+CREATE TABLE verification_requests (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
     verifier_id INTEGER,
-    status TEXT NOT NULL, -- pending, approved, rejected
-    verification_type TEXT NOT NULL, -- initial, family, document, video
-    metadata TEXT, -- JSON data related to this verification attempt
-    created_at TEXT NOT NULL,
-    updated_at TEXT NOT NULL,
-    FOREIGN KEY (user_id) REFERENCES users (id),
+    type TEXT NOT NULL, -- initial, family, document, video
+    status TEXT NOT NULL DEFAULT 'pending', -- pending, approved, rejected
+    data TEXT, -- JSON data related to this verification request
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
     FOREIGN KEY (verifier_id) REFERENCES users (id)
 );
 
@@ -55,19 +59,145 @@ CREATE TABLE verification_attempts (
 CREATE TABLE did_documents (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
-    did_identifier TEXT UNIQUE NOT NULL,
-    document_json TEXT NOT NULL,
-    public_key TEXT NOT NULL,
-    created_at TEXT NOT NULL,
-    updated_at TEXT NOT NULL,
-    FOREIGN KEY (user_id) REFERENCES users (id)
+    identifier TEXT UNIQUE NOT NULL,
+    document TEXT NOT NULL,
+    keys TEXT,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+-- Notifications table
+CREATE TABLE notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    message TEXT,
+    data TEXT,
+    read BOOLEAN DEFAULT 0,
+    created_at INTEGER NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+-- Family closure table: every path of up to 3 relationships, derived from
+-- family_relationships ('parent,parent' reaches a grandparent), one row per
+-- pair and sequence of relationship types
+CREATE TABLE family_closure (
+    ancestor_id INTEGER NOT NULL,
+    descendant_id INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    path_type TEXT NOT NULL,
+    paths INTEGER NOT NULL DEFAULT 1, -- simple paths behind the row
+    PRIMARY KEY (ancestor_id, descendant_id, path_type)
+) WITHOUT ROWID;
+
+-- Every change to family_relationships, written by the triggers below: the
+-- edge and its verified flag before and after (NULL when it did not exist)
+CREATE TABLE family_changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    relationship_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    relative_id INTEGER NOT NULL,
+    relationship_type TEXT NOT NULL,
+    verified_before INTEGER,
+    verified_after INTEGER
 );
 
 -- Create indexes for performance
-CREATE INDEX idx_users_email ON users(email);
-CREATE INDEX idx_users_verification ON users(verification_level);
-CREATE INDEX idx_family_relations_user_id ON family_relations(user_id);
-CREATE INDEX idx_family_relations_relative_id ON family_relations(relative_id);
-CREATE INDEX idx_verification_attempts_user_id ON verification_attempts(user_id);
-CREATE INDEX idx_did_documents_user_id ON did_documents(user_id);
-CREATE INDEX idx_did_documents_identifier ON did_documents(did_identifier); 
\ No newline at end of file
+CREATE INDEX idx_did_documents_user_id ON did_documents (user_id);
+CREATE INDEX idx_family_relationships_user_id_verified_created_at ON family_relationships (user_id, verified, created_at);
+CREATE INDEX idx_notifications_user_id_read_created_at ON notifications (user_id, read, created_at);
+CREATE INDEX idx_notifications_user_id_created_at ON notifications (user_id, created_at);
+CREATE INDEX idx_verification_requests_user_id_status_created_at ON verification_requests (user_id, status, created_at);
+CREATE INDEX idx_verification_requests_user_id_created_at ON verification_requests (user_id, created_at);
+CREATE INDEX idx_family_closure_ancestor_id_path_type ON family_closure (ancestor_id, path_type);
+CREATE INDEX idx_family_closure_descendant_id_depth ON family_closure (descendant_id, depth);
+CREATE INDEX idx_family_relationships_relative_id ON family_relationships (relative_id);
+
+-- Keep the users counters current
+CREATE TRIGGER trg_family_relationships_count_insert
+AFTER INSERT ON family_relationships WHEN NEW.verified
+BEGIN
+    UPDATE users SET verified_relationship_count = verified_relationship_count + 1 WHERE id = NEW.user_id;
+END;
+
+CREATE TRIGGER trg_family_relationships_count_delete
+AFTER DELETE ON family_relationships WHEN OLD.verified
+BEGIN
+    UPDATE users SET verified_relationship_count = verified_relationship_count - 1 WHERE id = OLD.user_id;
+END;
+
+CREATE TRIGGER trg_family_relationships_count_update
+AFTER UPDATE OF verified, user_id ON family_relationships
+WHEN NEW.verified IS NOT OLD.verified OR NEW.user_id IS NOT OLD.user_id
+BEGIN
+    UPDATE users SET verified_relationship_count = verified_relationship_count - 1
+    WHERE id = OLD.user_id AND OLD.verified;
+    UPDATE users SET verified_relationship_count = verified_relationship_count + 1
+    WHERE id = NEW.user_id AND NEW.verified;
+END;
+
+CREATE TRIGGER trg_did_documents_count_insert
+AFTER INSERT ON did_documents
+BEGIN
+    UPDATE users SET did_count = did_count + 1 WHERE id = NEW.user_id;
+END;
+
+CREATE TRIGGER trg_did_documents_count_delete
+AFTER DELETE ON did_documents
+BEGIN
+    UPDATE users SET did_count = did_count - 1 WHERE id = OLD.user_id;
+END;
+
+CREATE TRIGGER trg_did_documents_count_update
+AFTER UPDATE OF user_id ON did_documents WHEN NEW.user_id IS NOT OLD.user_id
+BEGIN
+    UPDATE users SET did_count = did_count - 1 WHERE id = OLD.user_id;
+    UPDATE users SET did_count = did_count + 1 WHERE id = NEW.user_id;
+END;
+
+-- Log every change to family_relationships in family_changes
+CREATE TRIGGER trg_family_relationships_log_insert
+AFTER INSERT ON family_relationships
+BEGIN
+    INSERT INTO family_changes (relationship_id, user_id, relative_id, relationship_type, verified_before, verified_after)
+    VALUES (NEW.id, NEW.user_id, NEW.relative_id, NEW.relationship_type, NULL, CASE WHEN NEW.verified THEN 1 ELSE 0 END);
+END;
+
+CREATE TRIGGER trg_family_relationships_log_delete
+AFTER DELETE ON family_relationships
+BEGIN
+    INSERT INTO family_changes (relationship_id, user_id, relative_id, relationship_type, verified_before, verified_after)
+    VALUES (OLD.id, OLD.user_id, OLD.relative_id, OLD.relationship_type, CASE WHEN OLD.verified THEN 1 ELSE 0 END, NULL);
+END;
+
+CREATE TRIGGER trg_family_relationships_log_update
+AFTER UPDATE OF id, user_id, relative_id, relationship_type, verified ON family_relationships
+WHEN NEW.id IS NOT OLD.id OR NEW.user_id IS NOT OLD.user_id OR NEW.relative_id IS NOT OLD.relative_id
+OR NEW.relationship_type IS NOT OLD.relationship_type OR NEW.verified IS NOT OLD.verified
+BEGIN
+    INSERT INTO family_changes (relationship_id, user_id, relative_id, relationship_type, verified_before, verified_after)
+    SELECT OLD.id, OLD.user_id, OLD.relative_id, OLD.relationship_type, CASE WHEN OLD.verified THEN 1 ELSE 0 END, NULL
+    WHERE NEW.id IS NOT OLD.id OR NEW.user_id IS NOT OLD.user_id OR NEW.relative_id IS NOT OLD.relative_id
+    OR NEW.relationship_type IS NOT OLD.relationship_type;
+    INSERT INTO family_changes (relationship_id, user_id, relative_id, relationship_type, verified_before, verified_after)
+    SELECT NEW.id, NEW.user_id, NEW.relative_id, NEW.relationship_type,
+           CASE WHEN NEW.id IS NOT OLD.id OR NEW.user_id IS NOT OLD.user_id OR NEW.relative_id IS NOT OLD.relative_id
+                OR NEW.relationship_type IS NOT OLD.relationship_type THEN NULL
+                WHEN OLD.verified THEN 1 ELSE 0 END,
+           CASE WHEN NEW.verified THEN 1 ELSE 0 END;
+END;
+
+-- Mark the migrations this file is equivalent to as applied
+CREATE TABLE schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at INTEGER NOT NULL
+);
+INSERT INTO schema_migrations (version, name, applied_at) VALUES
+    (1, 'baseline schema', CAST(strftime('%s', 'now') AS INTEGER)),
+    (2, 'hot path indexes', CAST(strftime('%s', 'now') AS INTEGER)),
+    (3, 'user relationship counters', CAST(strftime('%s', 'now') AS INTEGER)),
+    (4, 'family closure table', CAST(strftime('%s', 'now') AS INTEGER)),
+    (5, 'family closure path counts', CAST(strftime('%s', 'now') AS INTEGER)),
+    (6, 'family change log', CAST(strftime('%s', 'now') AS INTEGER));
@@ -12,6 +12,9 @@ class FamilyTreeVisualization {
      * @param {string} config.verifyEndpoint - API endpoint for verifying relations
      * @param {string} config.removeEndpoint - API endpoint for removing relations
      * @param {string} config.defaultProfileImage - Default profile image URL
+     * @param {number} config.pageSize - Maximum number of relatives per API page
+     * @param {string} config.changesEndpoint - API endpoint for tree changes
+     *     (defaults to apiEndpoint + '/changes')
      */
     constructor(config) {
         this.containerId = config.containerId;
@@ -32,6 +35,16 @@ class FamilyTreeVisualization {
         this.nodes = [];
         this.links = [];
         
+        // Paged loading: the tree is fetched one level at a time
+        this.pageSize = config.pageSize || 200;
+        this.loadedDepth = 0;
+        this.treeCursor = '';
+        this.nodeDepths = new Map();
+        
+        // Version of the loaded tree, for fetching only what changed since
+        this.changesEndpoint = config.changesEndpoint || `${this.apiEndpoint.split('?')[0]}/changes`;
+        this.treeVersion = null;
+        
         // Visualization settings
         this.width = 0;
         this.height = 0;
@@ -125,26 +138,22 @@ class FamilyTreeVisualization {
     loadData() {
         this.setLoading(true);
         
-        fetch(this.apiEndpoint)
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error('Network response was not ok');
-                }
-                return response.json();
-            })
-            .then(data => {
+        // Start over with the first level of the tree
+        this.nodes = [];
+        this.links = [];
+        this.loadedDepth = 0;
+        this.treeCursor = '';
+        this.treeVersion = null;
+        this.nodeDepths = new Map([[this.currentUserId, 0]]);
+        
+        this.fetchLevel(1)
+            .then(() => {
                 // Process and visualize the data
-                this.processData(data);
+                this.processData({ nodes: this.nodes, links: this.links });
                 this.setLoading(false);
                 
                 // Update statistics
-                if (typeof window.updateFamilyStats === 'function') {
-                    window.updateFamilyStats({
-                        totalCount: data.nodes.length - 1, // Exclude the current user
-                        verifiedCount: data.nodes.filter(n => n.id !== this.currentUserId && n.verified).length,
-                        pendingCount: data.nodes.filter(n => n.id !== this.currentUserId && !n.verified).length
-                    });
-                }
+                this.updateStats();
             })
             .catch(error => {
                 console.error('Error loading family tree data:', error);
@@ -164,6 +173,150 @@ class FamilyTreeVisualization {
             });
     }
     
+    /**
+     * Fetch the tree down to the given depth, continuing from the relationships
+     * already loaded. The server walks the tree breadth first, so a deeper walk
+     * only adds to a shallower one and the cursor picks up where it ended.
+     * @param {number} depth - Number of hops from the current user
+     * @returns {Promise} Resolves once every page of the level is merged
+     */
+    fetchLevel(depth) {
+        const separator = this.apiEndpoint.includes('?') ? '&' : '?';
+        const fetchPage = () => {
+            const url = `${this.apiEndpoint}${separator}depth=${depth}&max_nodes=${this.pageSize}&cursor=${encodeURIComponent(this.treeCursor)}`;
+            return fetch(url)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error('Network response was not ok');
+                    }
+                    return response.json();
+                })
+                .then(data => {
+                    const tree = data.family_tree || data.data || data;
+                    this.mergeTree(tree);
+                    // Keep the oldest version: changes after it are applied again harmlessly
+                    if (this.treeVersion === null && tree.version !== undefined) {
+                        this.treeVersion = tree.version;
+                    }
+                    this.treeCursor = tree.cursor;
+                    return tree.has_more ? fetchPage() : null;
+                });
+        };
+        
+        return fetchPage().then(() => {
+            this.loadedDepth = depth;
+        });
+    }
+    
+    /**
+     * Merge one page of tree data into the loaded nodes and links
+     * @param {Object} tree - Page of tree data from the API
+     */
+    mergeTree(tree) {
+        const nodeIds = new Set(this.nodes.map(n => n.id));
+        for (const node of tree.nodes || []) {
+            if (!nodeIds.has(node.id)) {
+                this.nodes.push(node);
+                nodeIds.add(node.id);
+            }
+        }
+        
+        const linkIds = new Set(this.links.map(l => l.id));
+        for (const link of tree.links || []) {
+            if (linkIds.has(link.id)) {
+                continue;
+            }
+            this.links.push(link);
+            linkIds.add(link.id);
+            
+            // Links arrive in breadth-first order, so the source's depth is known
+            if (!this.nodeDepths.has(link.target)) {
+                this.nodeDepths.set(link.target, (this.nodeDepths.get(link.source) || 0) + 1);
+            }
+        }
+    }
+    
+    /**
+     * Fetch and apply the changes to the tree since it was loaded, or reload
+     * it if the server no longer knows them
+     */
+    refreshChanges() {
+        if (this.treeVersion === null) {
+            this.loadData();
+            return;
+        }
+        
+        this.setLoading(true);
+        const url = `${this.changesEndpoint}?since=${this.treeVersion}&depth=${Math.max(this.loadedDepth, 1)}`;
+        fetch(url)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error('Network response was not ok');
+                }
+                return response.json();
+            })
+            .then(data => {
+                const changes = data.changes || data.data || data;
+                if (changes.reset) {
+                    this.loadData();
+                    return;
+                }
+                this.applyChanges(changes);
+                this.setLoading(false);
+                this.updateStats();
+                this.refreshVisibleNodes();
+            })
+            .catch(error => {
+                console.error('Error loading family tree changes:', error);
+                this.loadData();
+            });
+    }
+    
+    /**
+     * Apply changes from the API to the loaded nodes and links
+     * @param {Object} changes - Changed and removed nodes and links
+     */
+    applyChanges(changes) {
+        const removedLinks = new Set(changes.removed_links || []);
+        const removedNodes = new Set(changes.removed_nodes || []);
+        this.links = this.links.filter(link => !removedLinks.has(link.id));
+        this.nodes = this.nodes.filter(node => !removedNodes.has(node.id));
+        for (const nodeId of removedNodes) {
+            this.expandedNodes.delete(nodeId);
+            this.nodeDepths.delete(nodeId);
+        }
+        
+        // Update changed nodes and links in place, so they keep their positions
+        for (const node of changes.nodes || []) {
+            const existing = this.nodes.find(n => n.id === node.id);
+            if (existing) {
+                Object.assign(existing, node);
+            }
+        }
+        for (const link of changes.links || []) {
+            const existing = this.links.find(l => l.id === link.id);
+            if (existing) {
+                existing.relationship = link.relationship;
+                existing.verified = link.verified;
+            }
+        }
+        this.mergeTree(changes);
+        this.treeVersion = changes.version;
+    }
+    
+    /**
+     * Update the family statistics from the loaded nodes
+     */
+    updateStats() {
+        if (typeof window.updateFamilyStats === 'function') {
+            window.updateFamilyStats({
+                totalCount: this.nodes.length - 1, // Exclude the current user
+                verifiedCount: this.nodes.filter(n => n.id !== this.currentUserId && n.verified).length,
+                pendingCount: this.nodes.filter(n => n.id !== this.currentUserId && !n.verified).length
+            });
+        }
+    }
+    
     /**
      * Process data and prepare for visualization
      * @param {Object} data - Data from the API
@@ -523,9 +676,32 @@ class FamilyTreeVisualization {
             this.expandedNodes.delete(node.id);
         } else {
             this.expandedNodes.add(node.id);
+            
+            // Expanding a node on the deepest loaded level needs the next level
+            const depth = this.nodeDepths.get(node.id) || 0;
+            if (depth >= this.loadedDepth && !this.isLoading) {
+                this.setLoading(true);
+                this.fetchLevel(depth + 1)
+                    .then(() => {
+                        this.setLoading(false);
+                        this.updateStats();
+                        this.refreshVisibleNodes();
+                    })
+                    .catch(error => {
+                        console.error('Error loading family tree level:', error);
+                        this.setLoading(false);
+                    });
+                return;
+            }
         }
         
-        // Update the visualization with the new visible nodes
+        this.refreshVisibleNodes();
+    }
+    
+    /**
+     * Update the visualization with the currently visible nodes
+     */
+    refreshVisibleNodes() {
         const visibleNodes = this.getVisibleNodes();
         const visibleLinks = this.getVisibleLinks(visibleNodes);
         this.updateVisualization(visibleNodes, visibleLinks);
@@ -606,8 +782,8 @@ class FamilyTreeVisualization {
                     this.selectedNode = null;
                 }
                 
-                // Reload the data to ensure consistency
-                this.loadData();
+                // Fetch what changed to ensure consistency
+                this.refreshChanges();
             } else {
                 throw new Error(data.message || 'Failed to verify relation');
             }
@@ -647,8 +823,8 @@ class FamilyTreeVisualization {
                 document.getElementById('node-details').style.display = 'none';
                 this.selectedNode = null;
                 
-                // Reload the data to ensure consistency
-                this.loadData();
+                // Fetch what changed to ensure consistency
+                this.refreshChanges();
             } else {
                 throw new Error(data.message || 'Failed to remove relation');
             }
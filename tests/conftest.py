@@ -5,13 +5,14 @@ Test configuration and fixtures for the Proof of Humanity application.
 import os
 import sys
 import pytest
-import tempfile
 import sqlite3
 from pathlib import Path
 
 # Add the project root directory to sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from models.database import memory_database_uri, close_all_databases
+
 # Import application after adding to path
 try:
     from app import create_app
@@ -26,11 +27,11 @@ except ImportError:
 @pytest.fixture
 def app():
     """Create and configure a Flask app for testing."""
-    # Create a temporary file to isolate the database for each test
-    db_fd, db_path = tempfile.mkstemp()
+    # Each test gets its own database, held in RAM
+    db_path = memory_database_uri()
     app = create_app({
         'TESTING': True,
-        'DATABASE_URI': f'sqlite:///{db_path}',
+        'DATABASE_PATH': db_path,
         'WTF_CSRF_ENABLED': False,
         'DEBUG': True,
         'SECRET_KEY': 'test_secret_key',
@@ -43,9 +44,8 @@ def app():
 
     yield app
 
-    # Close and remove the temporary database
-    os.close(db_fd)
-    os.unlink(db_path)
+    # Closing the pools discards the in-memory database
+    close_all_databases()
 
 @pytest.fixture
 def client(app):
@@ -116,11 +116,11 @@ def auth(client):
 @pytest.fixture
 def db_connection():
     """Create a database connection for testing."""
-    # Create a temporary file to isolate the database for each test
-    db_fd, db_path = tempfile.mkstemp()
+    # Each test gets its own database, held in RAM
+    db_path = memory_database_uri()
     
     # Create a connection to the database
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, uri=True, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     
     # Initialize the database
@@ -128,16 +128,14 @@ def db_connection():
     
     yield conn
     
-    # Close the connection and remove the temporary database
+    # Closing the last connection discards the database
     conn.close()
-    os.close(db_fd)
-    os.unlink(db_path)
 
 def init_test_database(db_path, conn=None):
     """Initialize the test database with schema and test data."""
     should_close = False
     if conn is None:
-        conn = sqlite3.connect(db_path)
+        conn = sqlite3.connect(db_path, uri=db_path.startswith('file:'))
         should_close = True
     
     cursor = conn.cursor()
@@ -179,4 +179,117 @@ def test_api_cors_headers(client):
     assert response.status_code == 200
     assert 'Access-Control-Allow-Origin' in response.headers
     assert 'Access-Control-Allow-Methods' in response.headers
-    assert 'Access-Control-Allow-Headers' in response.headers 
\ No newline at end of file
+    assert 'Access-Control-Allow-Headers' in response.headers 
+
+@pytest.fixture
+def family_client(tmp_path):
+    """A test client for an app whose database holds a small family (12 -> 1 -> 2)."""
+    from app import create_app
+    from models.database import get_database, add_family_relationship, close_all_databases
+    
+    app = create_app({
+        'TESTING': True,
+        'DATABASE_PATH': str(tmp_path / 'family.sqlite'),
+        'DATABASE_AUTO_MIGRATE': True,
+        'DATABASE_MAINTENANCE': False,
+        'SECRET_KEY': 'test_secret_key'
+    })
+    with app.app_context():
+        db = get_database()
+        for user_id in (1, 2, 3, 12):
+            db.execute_query(
+                "INSERT INTO users (id, name, email, password_hash, created_at, updated_at) VALUES (?, ?, ?, 'x', 0, 0)",
+                (user_id, f"user{user_id}", f"user{user_id}@example.com")
+            )
+        add_family_relationship(12, "user1@example.com", "parent")
+        add_family_relationship(1, "user2@example.com", "parent")
+    
+    yield app.test_client()
+    
+    close_all_databases()
+
+def test_get_family_tree_pages(family_client, auth):
+    """Test that the tree endpoint is bounded by depth and max_nodes and pages by cursor."""
+    headers = {'Authorization': f"Bearer {auth.get_token('user12@example.com')}"}
+    
+    response = family_client.get('/api/family/tree?depth=1', headers=headers)
+    assert response.status_code == 200
+    tree = response.json['family_tree']
+    assert [node['id'] for node in tree['nodes']] == [12, 1]
+    assert not tree['has_more']
+    
+    response = family_client.get('/api/family/tree?depth=3&max_nodes=1', headers=headers)
+    first = response.json['family_tree']
+    assert [node['id'] for node in first['nodes']] == [12, 1] and first['has_more']
+    response = family_client.get(f"/api/family/tree?depth=3&cursor={first['cursor']}", headers=headers)
+    rest = response.json['family_tree']
+    assert [node['id'] for node in rest['nodes']] == [2] and not rest['has_more']
+    
+    for query in ('depth=0', 'depth=99', 'max_nodes=0', 'cursor=abc', 'cursor=1'):
+        assert family_client.get(f'/api/family/tree?{query}', headers=headers).status_code == 400
+    assert family_client.get('/api/family/tree').status_code == 401
+
+def test_get_family_tree_changes(family_client, auth):
+    """Test that the changes endpoint returns the delta since a tree version."""
+    from models.database import verify_family_relationship
+    
+    headers = {'Authorization': f"Bearer {auth.get_token('user12@example.com')}"}
+    tree = family_client.get('/api/family/tree', headers=headers).json['family_tree']
+    link = next(link for link in tree['links'] if (link['source'], link['target']) == (1, 2))
+    with family_client.application.app_context():
+        verify_family_relationship(link['id'])
+    
+    response = family_client.get(f"/api/family/tree/changes?since={tree['version']}", headers=headers)
+    assert response.status_code == 200
+    changes = response.json['changes']
+    assert not changes['reset'] and int(changes['version']) > int(tree['version'])
+    assert [(l['id'], l['verified']) for l in changes['links']] == [(link['id'], 1)]
+    
+    for query in ('', '?since=abc', '?since=1.', '?since=-1'):
+        assert family_client.get(f'/api/family/tree/changes{query}', headers=headers).status_code == 400
+    assert family_client.get('/api/family/tree/changes?since=1').status_code == 401
+
+def test_get_relationship_path(family_client, auth):
+    """Test that the path endpoint returns the chain of relationships to another user."""
+    headers = {'Authorization': f"Bearer {auth.get_token('user12@example.com')}"}
+    
+    response = family_client.get('/api/family/path/2', headers=headers)
+    assert response.status_code == 200
+    path = response.json['path']
+    assert path['users'] == [{'id': 12, 'name': 'user12'}, {'id': 1, 'name': 'user1'}, {'id': 2, 'name': 'user2'}]
+    # Users along the path are named, but their contact details are not exposed
+    assert '@' not in response.get_data(as_text=True)
+    assert [step['relationship_type'] for step in path['steps']] == ['parent', 'parent']
+    
+    assert family_client.get('/api/family/path/2?max_depth=1', headers=headers).status_code == 404
+    assert family_client.get('/api/family/path/3', headers=headers).status_code == 404
+    assert family_client.get('/api/family/path/2?max_depth=99', headers=headers).status_code == 400
+    assert family_client.get('/api/family/path/2').status_code == 401
+
+def test_logged_in_request_in_row_mode(tmp_path):
+    """Test that a logged-in request loads the user when the database returns sqlite3.Row results."""
+    from app import create_app
+    from models.database import get_database, close_all_databases
+    
+    app = create_app({
+        'TESTING': True,
+        'DATABASE_PATH': str(tmp_path / 'rows.sqlite'),
+        'DATABASE_AUTO_MIGRATE': True,
+        'DATABASE_MAINTENANCE': False,
+        'DATABASE_ROW_MODE': 'row',
+        'SECRET_KEY': 'test_secret_key'
+    })
+    with app.app_context():
+        get_database().execute_query(
+            "INSERT INTO users (id, name, email, password_hash, created_at, updated_at) VALUES (1, 'user1', 'user1@example.com', 'x', 0, 0)"
+        )
+    
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    try:
+        assert client.get('/').status_code == 200
+        with client.session_transaction() as session:
+            assert session['user_id'] == 1
+    finally:
+        close_all_databases()
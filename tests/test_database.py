@@ -2,9 +2,11 @@
 Tests for the database module of the Proof of Humanity application.
 """
 
+import os
 import pytest
 import sqlite3
 import datetime
+import time
 import json
 from unittest.mock import patch, MagicMock
 
@@ -76,12 +78,1231 @@ def test_connection_pool_max_connections():
     pool.return_connection(conn3)
     pool.close_all()
 
+def test_connection_pool_fifo_handoff():
+    """Test that waiters are served in arrival order as connections are returned."""
+    import threading
+    import time
+    
+    pool = ConnectionPool(":memory:", max_connections=1, timeout=5)
+    held = pool.get_connection()
+    
+    served = []
+    
+    def worker(name):
+        conn = pool.get_connection()
+        served.append(name)
+        time.sleep(0.01)
+        pool.return_connection(conn)
+    
+    threads = []
+    for name in ("first", "second", "third"):
+        thread = threading.Thread(target=worker, args=(name,))
+        thread.start()
+        threads.append(thread)
+        # Make sure each thread is queued before starting the next one
+        while pool.stats()["queue_depth"] < len(threads):
+            time.sleep(0.001)
+    
+    pool.return_connection(held)
+    for thread in threads:
+        thread.join()
+    
+    assert served == ["first", "second", "third"]
+    
+    stats = pool.stats()
+    assert stats["waits"] == 3
+    assert stats["max_queue_depth"] == 3
+    assert stats["queue_depth"] == 0
+    assert stats["timeouts"] == 0
+    pool.close_all()
+
+def test_connection_pool_wait_timeout_stats():
+    """Test that a timed-out waiter is counted and leaves the queue."""
+    pool = ConnectionPool(":memory:", max_connections=1)
+    conn = pool.get_connection()
+    
+    with pytest.raises(DatabaseError):
+        pool.get_connection(timeout=0.05)
+    
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["queue_depth"] == 0
+    assert stats["max_wait_time"] >= 0.05
+    
+    pool.return_connection(conn)
+    pool.close_all()
+
+def test_connection_pool_applies_hardware_profile(tmp_path):
+    """Test that pools apply the selected PRAGMA profile and size 'auto' from cgroup limits."""
+    from models.hardware import _read_cgroup_limit, derive_profile
+    
+    pool = ConnectionPool(str(tmp_path / "profile.sqlite"), max_connections=1, profile="safe")
+    conn = pool.get_connection()
+    assert conn.execute("PRAGMA cache_size").fetchone()["cache_size"] == -2000
+    assert conn.execute("PRAGMA synchronous").fetchone()["synchronous"] == 2  # FULL
+    assert pool.stats()["profile"]["name"] == "safe"
+    pool.return_connection(conn)
+    pool.close_all()
+    
+    limit = tmp_path / "memory.max"
+    limit.write_text("268435456\n")
+    assert _read_cgroup_limit([str(limit)]) == 256 * 1024 ** 2
+    limit.write_text("max\n")
+    assert _read_cgroup_limit([str(limit)]) is None
+    
+    # A small container gets the minimum cache and no memory map
+    assert derive_profile(256 * 1024 ** 2, connections=5) == {
+        "synchronous": "NORMAL", "cache_size": -2048, "mmap_size": 0, "temp_store": "MEMORY"
+    }
+    assert derive_profile(64 * 1024 ** 3, connections=5)["mmap_size"] == 4 * 1024 ** 3
+    
+    with pytest.raises(ValueError):
+        ConnectionPool(":memory:", profile="unknown")
+
+def test_connection_pool_validates_only_idle_or_suspect():
+    """Test that checkouts skip the health check unless the connection is stale or errored."""
+    pool = ConnectionPool(":memory:", max_connections=1, validate_after=60)
+    
+    conn = pool.get_connection()
+    pool.return_connection(conn)
+    assert pool.get_connection() is conn
+    assert pool.stats()["validations"] == 0
+    
+    # A connection that saw an error is validated when it comes back
+    pool.report_error(conn)
+    pool.return_connection(conn)
+    assert pool.stats()["validations"] == 1
+    
+    # A connection idle for longer than validate_after is validated on checkout
+    pool.validate_after = 0
+    assert pool.get_connection() is conn
+    assert pool.stats()["validations"] == 2
+    
+    pool.return_connection(conn)
+    pool.close_all()
+
+def test_connection_pool_reap_idle():
+    """Test that stale idle connections are closed by the reaper."""
+    pool = ConnectionPool(":memory:", max_connections=2, max_idle_time=0)
+    conn1 = pool.get_connection()
+    conn2 = pool.get_connection()
+    pool.return_connection(conn1)
+    
+    assert pool.reap_idle(max_idle_time=0) == 1
+    assert len(pool.connections) == 0
+    assert pool.stats()["reaped"] == 1
+    
+    # Connections that are checked out are never reaped
+    assert conn2 in pool.in_use
+    pool.return_connection(conn2)
+    pool.close_all()
+
 def test_database_initialize(db_connection):
     """Test database initialization."""
     db = Database(database_path=":memory:")
     assert db is not None
     assert db.pool is not None
 
+def test_in_memory_database_shared_across_pooled_connections():
+    """Test that ':memory:' and named memory URIs give every pooled connection one database."""
+    import threading
+    from models.database import memory_database_uri
+    
+    db = Database(":memory:")
+    assert db.database_path.startswith("file:") and db.read_write_split
+    db.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY, value INTEGER)")
+    
+    def writer(value):
+        for _ in range(20):
+            with db.transaction():
+                db.execute_query("INSERT INTO test (value) VALUES (?)", (value,))
+            db.fetch_all("SELECT * FROM test")
+    
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert db.fetch_one("SELECT COUNT(*) AS count FROM test")["count"] == 80
+    
+    # The anchor keeps the data while the pools are idle or reaped
+    db.pool.close_all()
+    db.read_pool.close_all()
+    assert db.fetch_one("SELECT COUNT(*) AS count FROM test")["count"] == 80
+    db.close_pools()
+    
+    # A named database is shared by every Database opened on its URI
+    uri = memory_database_uri("shared-test")
+    first, second = Database(uri), Database(uri)
+    first.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY)")
+    assert second.fetch_all("SELECT name FROM sqlite_master") == [{"name": "test"}]
+    first.close_pools()
+    second.close_pools()
+    reopened = Database(uri)
+    assert reopened.fetch_all("SELECT name FROM sqlite_master") == []
+    reopened.close_pools()
+
+def test_read_query_classification():
+    """Test that statements are routed by whether they write."""
+    from models.database import is_read_query
+    
+    assert is_read_query("SELECT * FROM users WHERE id = ?")
+    assert is_read_query("  WITH RECURSIVE r(x) AS (SELECT 1) SELECT x FROM r")
+    assert is_read_query("SELECT updated_at FROM users")
+    assert not is_read_query("INSERT INTO users (name) VALUES (?)")
+    assert not is_read_query("UPDATE users SET name = ?")
+    assert not is_read_query("PRAGMA journal_mode = WAL")
+
+def test_database_read_write_split(tmp_path):
+    """Test that split mode sends writes to the writer and reads to read-only readers."""
+    db = Database(str(tmp_path / "split.sqlite"), read_write_split=True, readers=2)
+    assert db.pool.max_connections == 1
+    assert db.read_pool.read_only
+    
+    db.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY, name TEXT)")
+    db.execute_query("INSERT INTO test (name) VALUES (?)", ("test1",))
+    
+    rows = db.fetch_all("SELECT name FROM test")
+    assert rows == [{"name": "test1"}]
+    assert db.read_pool.stats()["checkouts"] == 1
+    
+    # Reader connections refuse to write
+    reader = db.read_pool.get_connection()
+    with pytest.raises(sqlite3.OperationalError):
+        reader.execute("INSERT INTO test (name) VALUES ('nope')")
+    db.read_pool.return_connection(reader)
+    
+    # Reads inside a transaction run on the writer and see uncommitted rows
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO test (name) VALUES (?)", ("test2",))
+        assert db.fetch_one("SELECT COUNT(*) AS count FROM test")["count"] == 2
+    
+    assert db.pool.stats()["in_use"] == 0
+    assert db.read_pool.stats()["in_use"] == 0
+    db.pool.close_all()
+    db.read_pool.close_all()
+
+def test_get_database_shares_pool_per_path(tmp_path, monkeypatch):
+    """Test that helpers reuse one registered pool instead of reconnecting per call."""
+    from models.database import get_database, close_all_databases, get_user_by_id
+    
+    db_path = str(tmp_path / "shared.sqlite")
+    monkeypatch.setenv("DATABASE_PATH", db_path)
+    
+    db = get_database()
+    assert get_database(db_path) is db
+    assert get_database(os.path.relpath(db_path)) is db
+    
+    db.execute_query("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+    db.execute_query("INSERT INTO users (name) VALUES (?)", ("shared",))
+    
+    for _ in range(10):
+        assert get_user_by_id(1)["name"] == "shared"
+    assert db.pool.connection_count == 1
+    
+    close_all_databases()
+    assert get_database(db_path) is not db
+    close_all_databases()
+
+def test_get_database_uses_app_settings_and_refuses_conflicts(tmp_path):
+    """Test that create_app opens the shared database with its config and conflicting requests raise."""
+    from app import create_app
+    from models.database import get_database, get_shards, close_all_databases, DatabaseError
+    
+    db_path = str(tmp_path / "configured.sqlite")
+    create_app({
+        'TESTING': True,
+        'DATABASE_PATH': db_path,
+        'DATABASE_READ_WRITE_SPLIT': True,
+        'DATABASE_GROUP_COMMIT': True,
+        'DATABASE_ROW_MODE': 'row',
+        'DATABASE_MAINTENANCE': False
+    })
+    db = get_database(db_path)
+    assert db.read_write_split and db.group_commit is not None and db.row_mode == 'row'
+    
+    assert get_database(db_path, row_mode='row') is db
+    with pytest.raises(DatabaseError, match="row_mode"):
+        get_database(db_path, row_mode='dict')
+    with pytest.raises(DatabaseError, match="shards"):
+        get_shards(db_path, shards=2)
+    close_all_databases()
+
+def test_database_request_scope_returns_connections(tmp_path):
+    """Test that connections pinned during a request go back at teardown without clobbering g.db."""
+    from flask import Flask, g
+    
+    db = Database(str(tmp_path / "scope.sqlite"))
+    app = Flask(__name__)
+    
+    with app.app_context():
+        g.db = db
+        conn = db.get_db()
+        assert db.get_db() is conn
+        assert g.db is db
+        assert len(db.pool.in_use) == 1
+        db.close()
+        assert len(db.pool.in_use) == 0
+    
+    # Outside Flask the scope is the current thread
+    with db as conn:
+        assert conn in db.pool.in_use
+    assert len(db.pool.in_use) == 0
+    db.close_pools()
+
+def test_database_reports_leaked_connections(tmp_path):
+    """Test that leak tracking reports connections still held when the scope closes."""
+    db = Database(str(tmp_path / "leak.sqlite"), track_leaks=True)
+    
+    def leaky_helper():
+        return db.pool.get_connection()
+    
+    conn = leaky_helper()
+    db.close()
+    
+    leaks = db.report_leaks()
+    assert len(leaks) == 1
+    assert "leaky_helper" in leaks[0]["stack"]
+    
+    db.pool.return_connection(conn)
+    assert db.report_leaks() == []
+    db.close_pools()
+
+def test_database_row_mode(tmp_path):
+    """Test compact sqlite3.Row results and their JSON serialization."""
+    from flask import Flask, jsonify
+    from models.database import DatabaseJSONProvider, row_to_dict
+    
+    db = Database(str(tmp_path / "rows.sqlite"), row_mode="row")
+    db.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY, name TEXT)")
+    db.execute_query("INSERT INTO test (name) VALUES (?)", ("test1",))
+    
+    rows = db.fetch_all("SELECT id, name FROM test")
+    assert isinstance(rows[0], sqlite3.Row)
+    assert rows[0]["name"] == "test1"
+    assert row_to_dict(rows[0]) == {"id": 1, "name": "test1"}
+    
+    # Per-call override back to dictionaries
+    row = db.execute_query_fetch_one("SELECT id, name FROM test", row_mode="dict")
+    assert row == {"id": 1, "name": "test1"}
+    
+    app = Flask(__name__)
+    app.json = DatabaseJSONProvider(app)
+    with app.app_context():
+        assert jsonify(rows).get_json() == [{"id": 1, "name": "test1"}]
+    
+    with pytest.raises(ValueError):
+        Database(str(tmp_path / "rows.sqlite"), row_mode="tuple")
+    db.close_pools()
+
+def test_database_fetch_iter_streams_and_releases(tmp_path):
+    """Test streaming results in batches, releasing the connection on early stop."""
+    from flask import Flask, Response, stream_with_context
+    
+    db = Database(str(tmp_path / "stream.sqlite"))
+    db.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY, value INTEGER)")
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO test (value) VALUES (?)", [(i,) for i in range(25)])
+    
+    rows = db.fetch_iter("SELECT value FROM test ORDER BY id", arraysize=10)
+    assert [row["value"] for row in rows] == list(range(25))
+    assert db.pool.stats()["in_use"] == 0
+    
+    # Stopping early hands the connection back
+    rows = db.iter_query("SELECT value FROM test ORDER BY id", arraysize=4)
+    assert next(rows)["value"] == 0
+    assert db.pool.stats()["in_use"] == 1
+    rows.close()
+    assert db.pool.stats()["in_use"] == 0
+    
+    with pytest.raises(DatabaseError):
+        list(db.iter_query("SELECT * FROM missing_table"))
+    
+    app = Flask(__name__)
+    
+    @app.route("/export")
+    def export():
+        rows = db.fetch_iter("SELECT value FROM test ORDER BY id", arraysize=5)
+        return Response(stream_with_context(f"{row['value']}\n" for row in rows), mimetype="text/plain")
+    
+    response = app.test_client().get("/export")
+    assert response.get_data(as_text=True).split() == [str(i) for i in range(25)]
+    assert db.pool.stats()["in_use"] == 0
+    db.close_pools()
+
+def test_database_bulk_insert_returns_ids_in_batches(tmp_path):
+    """Test that bulk inserts returning ids use multi-row statements and keep input order."""
+    db = Database(str(tmp_path / "bulk_ids.sqlite"))
+    db.execute_query("CREATE TABLE notifications (id INTEGER PRIMARY KEY, user_id INTEGER, message TEXT, read INTEGER)")
+    
+    statements = []
+    rows = [{"user_id": 7, "message": f"batch {i}", "read": 0} for i in range(700)]
+    with db.transaction() as conn:
+        conn.set_trace_callback(statements.append)
+        ids = db.bulk_insert("notifications", rows, chunk_size=500, return_ids=True)
+        conn.set_trace_callback(None)
+    assert ids == list(range(1, 701))
+    assert [row["message"] for row in db.fetch_all("SELECT message FROM notifications ORDER BY id")] \
+        == [row["message"] for row in rows]
+    # 333 rows of 3 parameters per statement: the 500-row chunk takes two, the rest one
+    assert sum("RETURNING" in statement for statement in statements) == 3
+    db.close_pools()
+
+def test_database_bulk_insert_and_update(tmp_path):
+    """Test bulk writes in one transaction, returning ids and rolling back on error."""
+    db = Database(str(tmp_path / "bulk.sqlite"))
+    db.execute_query("CREATE TABLE notifications (id INTEGER PRIMARY KEY, user_id INTEGER, message TEXT, read INTEGER)")
+    
+    rows = ({"user_id": i % 3, "message": f"note {i}", "read": 0} for i in range(10))
+    assert db.bulk_insert("notifications", rows, chunk_size=4) == 10
+    
+    ids = db.bulk_insert("notifications", [{"user_id": 9, "message": "a", "read": 0},
+                                           {"user_id": 9, "message": "b", "read": 0}], return_ids=True)
+    assert ids == [11, 12]
+    
+    updated = db.bulk_update("notifications", [{"id": i, "read": 1} for i in range(1, 6)], chunk_size=2)
+    assert updated == 5
+    assert db.fetch_one("SELECT COUNT(*) AS count FROM notifications WHERE read = 1")["count"] == 5
+    
+    # A failing chunk rolls back the whole batch
+    with pytest.raises(DatabaseError):
+        db.bulk_insert("notifications", [{"user_id": 1, "message": "ok", "read": 0},
+                                         {"user_id": 1, "missing": "x", "read": 0}])
+    assert db.fetch_one("SELECT COUNT(*) AS count FROM notifications")["count"] == 12
+    
+    with pytest.raises(ValueError):
+        db.bulk_insert("notifications; DROP TABLE users", [{"user_id": 1}])
+    db.close_pools()
+
+def test_database_nested_transactions_use_savepoints(tmp_path):
+    """Test that nested transactions roll back independently and helpers don't commit early."""
+    db = Database(str(tmp_path / "savepoints.sqlite"))
+    db.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY, name TEXT)")
+    
+    assert db.execute_query("INSERT INTO test (name) VALUES (?)", ("first",)) == 1
+    assert db.execute_query("INSERT INTO test (name) VALUES (?) RETURNING name", ("second",)) == "second"
+    assert db.execute_query("UPDATE test SET name = name || '!'") == 2
+    
+    with db.transaction() as conn:
+        db.execute_query("INSERT INTO test (name) VALUES (?)", ("outer",))
+        with pytest.raises(ValueError):
+            with db.transaction():
+                db.execute_query("INSERT INTO test (name) VALUES (?)", ("inner",))
+                raise ValueError("roll back the savepoint only")
+        with db.transaction():
+            db.execute_query("INSERT INTO test (name) VALUES (?)", ("kept",))
+        
+        # Nothing is visible to other connections until the outer commit
+        reader = sqlite3.connect(db.database_path)
+        assert reader.execute("SELECT COUNT(*) FROM test").fetchone()[0] == 2
+        assert conn.in_transaction
+    
+    names = [row["name"] for row in db.fetch_all("SELECT name FROM test ORDER BY id")]
+    assert names == ["first!", "second!", "outer", "kept"]
+    assert reader.execute("SELECT COUNT(*) FROM test").fetchone()[0] == 4
+    reader.close()
+    db.close_pools()
+
+def test_add_family_relationship_is_atomic(tmp_path, monkeypatch):
+    """Test that a relationship, its inverse and the notification commit together."""
+    from models.database import get_database, close_all_databases, add_family_relationship
+    
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "family.sqlite"))
+    db = get_database()
+    db.execute_query("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT)")
+    db.execute_query(
+        "CREATE TABLE family_relationships (id INTEGER PRIMARY KEY, user_id INTEGER, relative_id INTEGER, "
+        "relationship_type TEXT, verified BOOLEAN, created_at INTEGER, updated_at INTEGER)"
+    )
+    db.execute_query(
+        "CREATE TABLE notifications (id INTEGER PRIMARY KEY, user_id INTEGER, type TEXT, message TEXT, "
+        "data TEXT, read BOOLEAN, created_at INTEGER CHECK (user_id <> 3))"
+    )
+    db.execute_query(
+        "CREATE TABLE family_closure (ancestor_id INTEGER, descendant_id INTEGER, depth INTEGER, "
+        "path_type TEXT, paths INTEGER, PRIMARY KEY (ancestor_id, descendant_id, path_type))"
+    )
+    db.execute_query("INSERT INTO users (name, email) VALUES ('Ann', 'ann@example.com'), ('Bob', 'bob@example.com'), ('Cy', 'cy@example.com')")
+    
+    result = add_family_relationship(1, "bob@example.com", "parent")
+    assert result["success"] is True
+    assert result["relationship_id"] == 1 and result["inverse_id"] == 2
+    assert add_family_relationship(1, "bob@example.com", "parent")["error"] == "Relationship already exists"
+    
+    # The notification insert fails, so neither relationship row is kept
+    with pytest.raises(DatabaseError):
+        add_family_relationship(1, "cy@example.com", "sibling")
+    assert db.fetch_one("SELECT COUNT(*) AS count FROM family_relationships")["count"] == 2
+    assert db.fetch_one("SELECT COUNT(*) AS count FROM family_closure")["count"] == 2
+    close_all_databases()
+
+def test_user_cache_read_through_and_invalidation(tmp_path, monkeypatch):
+    """Test that user lookups are cached and dropped again by user writes."""
+    from models.database import (
+        get_database, close_all_databases, get_user_by_id, get_user_by_email,
+        update_user_verification_level, UserCache
+    )
+    
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "users.sqlite"))
+    db = get_database()
+    db.execute_query(
+        "CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT, verification_level INTEGER, "
+        "updated_at INTEGER)"
+    )
+    db.execute_query("INSERT INTO users (name, email, verification_level) VALUES ('Ann', 'ann@example.com', 0)")
+    
+    assert get_user_by_id(1)["verification_level"] == 0
+    assert get_user_by_email("ANN@example.com")["id"] == 1
+    get_user_by_id(1)["name"] = "mutated"
+    assert get_user_by_id(1)["name"] == "Ann"
+    assert db.pool_stats()["user_cache"]["hits"] == 3
+    assert db.pool_stats()["user_cache"]["misses"] == 1
+    
+    update_user_verification_level(1, 2)
+    assert get_user_by_email("ann@example.com")["verification_level"] == 2
+    
+    # Inside a transaction the write is only dropped from the cache once it commits
+    with db.transaction():
+        db.execute_query("UPDATE users SET name = 'Anna' WHERE id = 1")
+        db.invalidate_user(1)
+        assert get_user_by_id(1)["name"] == "Anna"
+        assert db.user_cache.entries
+    assert not db.user_cache.entries
+    assert get_user_by_id(1)["name"] == "Anna"
+    close_all_databases()
+    
+    cache = UserCache(max_size=2, ttl=60)
+    rows = {i: {"id": i, "email": f"u{i}@example.com"} for i in range(1, 4)}
+    for i in (1, 2, 1, 3):
+        cache.get(i, lambda i=i: rows[i])
+    assert list(cache.entries) == [1, 3] and "u2@example.com" not in cache.emails
+    assert cache.stats()["evictions"] == 1
+    cache.ttl = 0
+    cache.get(2, lambda: rows[2])
+    assert cache.get(2, lambda: None) is None
+
+def test_user_counters_drive_verification_level(tmp_path, monkeypatch):
+    """Test that triggers keep the users counters current for level promotion and demotion."""
+    from models.database import (
+        get_database, close_all_databases, create_user, get_user_by_id, create_did_document,
+        add_family_relationship, verify_family_relationship, remove_family_relationship
+    )
+    from models.migrations import apply_migrations
+    
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "counters.sqlite"))
+    db = get_database()
+    apply_migrations(db, pause=0)
+    ann, bob, cy = (create_user(name, f"{name}@example.com", "x") for name in ("ann", "bob", "cy"))
+    
+    first = add_family_relationship(ann, "bob@example.com", "sibling")
+    second = add_family_relationship(ann, "cy@example.com", "cousin")
+    verify_family_relationship(first["relationship_id"])
+    assert get_user_by_id(ann)["verified_relationship_count"] == 1
+    assert get_user_by_id(ann)["verification_level"] == 0
+    assert get_user_by_id(bob)["verified_relationship_count"] == 1
+    
+    verify_family_relationship(second["relationship_id"])
+    assert get_user_by_id(ann)["verified_relationship_count"] == 2
+    assert get_user_by_id(ann)["verification_level"] == 3
+    
+    remove_family_relationship(first["relationship_id"])
+    user = get_user_by_id(ann)
+    assert (user["verified_relationship_count"], user["verification_level"]) == (1, 2)
+    assert get_user_by_id(bob)["verified_relationship_count"] == 0
+    
+    create_did_document(cy, "did:poh:cy", "{}")
+    assert get_user_by_id(cy)["did_count"] == 1
+    db.execute_query("DELETE FROM did_documents")
+    db.invalidate_user()
+    assert get_user_by_id(cy)["did_count"] == 0
+    close_all_databases()
+
+def test_family_graph_index_serves_family_tree(tmp_path, monkeypatch):
+    """Test that the CSR graph index tracks committed writes and matches ids exactly."""
+    from models.database import (
+        get_database, get_shards, close_all_databases, get_family_tree,
+        add_family_relationship, verify_family_relationship, remove_family_relationship
+    )
+    from models.migrations import apply_migrations
+    
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "graph.sqlite"))
+    db = get_database()
+    apply_migrations(db, pause=0)
+    for user_id in (1, 2, 12):
+        db.execute_query(
+            "INSERT INTO users (id, name, email, password_hash, created_at, updated_at) VALUES (?, ?, ?, 'x', 0, 0)",
+            (user_id, f"user{user_id}", f"user{user_id}@example.com")
+        )
+    add_family_relationship(12, "user1@example.com", "parent")
+    add_family_relationship(1, "user2@example.com", "parent")
+    
+    # User 1's id is a substring of 12's, which must not end the walk at 1
+    router = get_shards()
+    tree = get_family_tree(12)
+    assert {node["id"] for node in tree["nodes"]} == {1, 2, 12}
+    router.family_graph_enabled = False
+    assert {node["id"] for node in get_family_tree(12)["nodes"]} == {1, 2, 12}
+    router.family_graph_enabled = True
+    
+    graph = router.family_graph()
+    assert graph.stats()["edges"] == 4
+    
+    # Writes rolled back with an outer transaction never reach the index,
+    # which is not used inside the transaction
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            add_family_relationship(2, "user12@example.com", "child")
+            assert router.family_graph() is None
+            assert {node["id"] for node in get_family_tree(2)["nodes"]} == {1, 2, 12}
+            raise RuntimeError("abort")
+    assert len(router.family_graph()) == 4
+    
+    link = next(link for link in tree["links"] if (link["source"], link["target"]) == (1, 2))
+    verify_family_relationship(link["id"])
+    graph = router.family_graph()
+    assert next(edge for edge in graph.traverse(12) if edge["relation_id"] == link["id"])["verified"] == 1
+    remove_family_relationship(link["id"])
+    assert {node["id"] for node in get_family_tree(12)["nodes"]} == {1, 12}
+    
+    # Compaction folds the overlay into the arrays without changing the graph
+    before = graph.traverse(12)
+    graph.compact()
+    assert graph.traverse(12) == before and graph.stats()["pending_changes"] == 0
+    close_all_databases()
+
+def test_family_graph_replays_changes_from_any_writer(tmp_path, monkeypatch):
+    """Test that the graph index picks up writes made outside the query helpers and this process."""
+    from models.database import get_shards, close_all_databases, get_family_tree
+    from models.migrations import apply_migrations
+    from models import maintenance
+    
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "replay.sqlite"))
+    router = get_shards()
+    db = router.primary
+    apply_migrations(db, pause=0)
+    db.bulk_insert("users", [
+        {"id": user_id, "name": f"user{user_id}", "email": f"user{user_id}@example.com",
+         "password_hash": "x", "created_at": 0, "updated_at": 0}
+        for user_id in (1, 2, 3)
+    ])
+    db.bulk_insert("family_relationships", [
+        {"user_id": 1, "relative_id": 2, "relationship_type": "parent", "verified": False, "created_at": 0, "updated_at": 0}
+    ])
+    graph = router.family_graph()
+    assert len(graph) == 1
+    
+    # Another process inserts, verifies and rewrites relationships with plain SQL
+    other = sqlite3.connect(str(tmp_path / "replay.sqlite"), isolation_level=None)
+    other.execute(
+        "INSERT INTO family_relationships (user_id, relative_id, relationship_type, verified, created_at, updated_at) "
+        "VALUES (2, 3, 'parent', 0, 0, 0)"
+    )
+    other.execute("UPDATE family_relationships SET verified = 1 WHERE user_id = 1")
+    assert [(node["id"], node["verified"]) for node in get_family_tree(1)["nodes"]] == [(1, True), (2, 1), (3, 0)]
+    other.execute("UPDATE family_relationships SET relative_id = 1, user_id = 3 WHERE user_id = 2")
+    assert {node["id"] for node in get_family_tree(1)["nodes"]} == {1, 2}
+    assert {node["id"] for node in get_family_tree(3)["nodes"]} == {1, 2, 3}
+    
+    # A graph behind the trimmed log reloads instead of missing changes
+    positions = list(router.family_graph().positions)
+    other.execute("DELETE FROM family_relationships WHERE user_id = 3")
+    monkeypatch.setattr(maintenance, "FAMILY_CHANGES_KEPT", 1)
+    other.close()
+    scheduler = maintenance.MaintenanceScheduler(db, busy_timeout=0.1)
+    assert scheduler.run("trim_family_changes")["deleted"] > 0
+    router.family_graph().positions[0] = positions[0] - 1
+    assert {node["id"] for node in get_family_tree(3)["nodes"]} == {3}
+    assert router.family_graph().positions == [positions[0] + 1]
+    close_all_databases()
+
+def test_family_tree_pages_resume_from_cursor(tmp_path, monkeypatch):
+    """Test that family tree pages stop at max_nodes and continue from their cursor."""
+    from models.database import (
+        get_database, get_shards, close_all_databases, get_family_tree, add_family_relationship,
+        remove_family_relationship
+    )
+    from models.migrations import apply_migrations
+    
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "pages.sqlite"))
+    db = get_database()
+    apply_migrations(db, pause=0)
+    for user_id in (1, 2, 12):
+        db.execute_query(
+            "INSERT INTO users (id, name, email, password_hash, created_at, updated_at) VALUES (?, ?, ?, 'x', 0, 0)",
+            (user_id, f"user{user_id}", f"user{user_id}@example.com")
+        )
+    add_family_relationship(12, "user1@example.com", "parent")
+    add_family_relationship(1, "user2@example.com", "parent")
+    
+    router = get_shards()
+    for enabled in (True, False):
+        router.family_graph_enabled = enabled
+        assert [node["id"] for node in get_family_tree(12, depth=1)["nodes"]] == [12, 1]
+        
+        first = get_family_tree(12, depth=3, max_nodes=1)
+        assert [node["id"] for node in first["nodes"]] == [12, 1]
+        assert first["has_more"] and first["cursor"] == (1, first["links"][0]["id"])
+        rest = get_family_tree(12, depth=3, max_nodes=1, cursor=first["cursor"])
+        assert [node["id"] for node in rest["nodes"]] == [2]
+        assert not rest["has_more"]
+        assert first["links"] + rest["links"] == get_family_tree(12, depth=3)["links"]
+    
+    # Relationships added between pages do not shift the cursor
+    for enabled in (True, False):
+        router.family_graph_enabled = enabled
+        first = get_family_tree(12, depth=3, max_nodes=1)
+        link = add_family_relationship(12, "user2@example.com", "grandparent")
+        rest = get_family_tree(12, depth=3, cursor=first["cursor"])
+        assert first["links"] + rest["links"] == get_family_tree(12, depth=3)["links"]
+        assert rest["links"][0]["id"] == link["relationship_id"]
+        assert [node["id"] for node in rest["nodes"]] == [2]
+        remove_family_relationship(link["relationship_id"])
+    close_all_databases()
+
+def test_family_tree_changes_since_version(tmp_path, monkeypatch):
+    """Test that family tree deltas report only what changed in the neighbourhood."""
+    from models.database import (
+        get_database, get_shards, close_all_databases, get_family_tree, get_family_tree_changes,
+        add_family_relationship, verify_family_relationship, remove_family_relationship
+    )
+    from models.migrations import apply_migrations
+    
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "changes.sqlite"))
+    db = get_database()
+    apply_migrations(db, pause=0)
+    for user_id in (1, 2, 3, 12):
+        db.execute_query(
+            "INSERT INTO users (id, name, email, password_hash, created_at, updated_at) VALUES (?, ?, ?, 'x', 0, 0)",
+            (user_id, f"user{user_id}", f"user{user_id}@example.com")
+        )
+    add_family_relationship(12, "user1@example.com", "parent")
+    add_family_relationship(1, "user2@example.com", "parent")
+    
+    tree = get_family_tree(12)
+    version = tree["version"]
+    assert get_family_tree_changes(12, version)["links"] == []
+    
+    # Verifying an edge changes the link and the node it discovers
+    link = next(link for link in tree["links"] if (link["source"], link["target"]) == (1, 2))
+    verify_family_relationship(link["id"])
+    changes = get_family_tree_changes(12, version)
+    assert [(l["id"], l["verified"]) for l in changes["links"]] == [(link["id"], 1)]
+    assert [(n["id"], n["verified"]) for n in changes["nodes"]] == [(2, 1)]
+    assert int(changes["version"]) > int(version)
+    
+    # Versions come from the database, so they stay valid for a reloaded
+    # graph (or another worker's)
+    get_shards().reset_family_graph()
+    assert get_family_tree_changes(12, version)["links"] == changes["links"]
+    
+    # Removing it drops the node; a change outside the neighbourhood is not reported
+    remove_family_relationship(link["id"])
+    add_family_relationship(2, "user3@example.com", "child")
+    changes = get_family_tree_changes(12, changes["version"])
+    assert changes["removed_links"] == [link["id"]] and changes["removed_nodes"] == [2]
+    assert changes["links"] == [] and changes["nodes"] == []
+    
+    # Versions the change log no longer covers ask the client to reload, as
+    # do versions ahead of the graph and tokens of another shard layout
+    from models.maintenance import MaintenanceScheduler
+    monkeypatch.setattr("models.maintenance.FAMILY_CHANGES_KEPT", 1)
+    MaintenanceScheduler(db, busy_timeout=0.1).run("trim_family_changes")
+    assert get_family_tree_changes(12, version)["reset"]
+    assert not get_family_tree_changes(12, changes["version"])["reset"]
+    for token in (str(int(changes["version"]) + 1), f"{changes['version']}.0", "abc"):
+        assert get_family_tree_changes(12, token)["reset"]
+    get_shards().family_graph_enabled = False
+    assert get_family_tree_changes(12, changes["version"])["reset"]
+    close_all_databases()
+
+def test_family_graph_changes_survive_compaction():
+    """Test that change log rows are undone the same way before and after a compaction."""
+    from models.family_graph import FamilyGraph
+    
+    graph = FamilyGraph()
+    graph.build([{"id": 1, "user_id": 1, "relative_id": 2, "relationship_type": "sibling", "verified": 0}], [0])
+    changes = [
+        {"version": 1, "relationship_id": 1, "user_id": 1, "relative_id": 2,
+         "relationship_type": "sibling", "verified_before": 0, "verified_after": 1},
+        {"version": 2, "relationship_id": 1, "user_id": 1, "relative_id": 2,
+         "relationship_type": "sibling", "verified_before": 1, "verified_after": 0},
+        {"version": 3, "relationship_id": 2, "user_id": 0, "relative_id": 1,
+         "relationship_type": "parent", "verified_before": None, "verified_after": 0},
+    ]
+    graph.apply(0, changes)
+    assert graph.version == "3"
+    assert graph.changes_since(1, changes)["edges"] == []
+    
+    # Compaction loads user 0's "parent" edge first, but keeps its type code
+    graph.compact()
+    assert graph.changes_since(1, changes)["edges"] == []
+    added = graph.changes_since(0, changes)["edges"]
+    assert [(edge["relation_id"], edge["relationship_type"]) for edge in added] == [(2, "parent"), (1, "sibling")]
+
+def test_family_closure_answers_kinship_queries(tmp_path, monkeypatch):
+    """Test that the closure table follows added and removed relationships."""
+    from models.database import (
+        get_database, close_all_databases, add_family_relationship, remove_family_relationship,
+        get_kinship_distance, get_relatives_by_path, rebuild_family_closure
+    )
+    from models.migrations import apply_migrations
+    
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "closure.sqlite"))
+    db = get_database()
+    apply_migrations(db, pause=0)
+    for user_id in (1, 2, 3, 4, 12):
+        db.execute_query(
+            "INSERT INTO users (id, name, email, password_hash, created_at, updated_at) VALUES (?, ?, ?, 'x', 0, 0)",
+            (user_id, f"user{user_id}", f"user{user_id}@example.com")
+        )
+    add_family_relationship(12, "user1@example.com", "parent")
+    link = add_family_relationship(1, "user2@example.com", "parent")
+    add_family_relationship(2, "user3@example.com", "parent")
+    add_family_relationship(3, "user4@example.com", "parent")
+    
+    assert [user["id"] for user in get_relatives_by_path(12, "parent", "parent")] == [2]
+    assert [user["id"] for user in get_relatives_by_path(2, "child", "child")] == [12]
+    assert get_kinship_distance(12, 3) == 3 and get_kinship_distance(3, 12) == 3
+    assert get_kinship_distance(12, 4) is None
+    
+    # The incrementally maintained rows match a full rebuild
+    snapshot = "SELECT ancestor_id, descendant_id, depth, path_type, paths FROM family_closure ORDER BY 1, 2, 4"
+    before = db.fetch_all(snapshot, row_mode='dict')
+    rebuild_family_closure()
+    assert db.fetch_all(snapshot, row_mode='dict') == before
+    
+    remove_family_relationship(link["relationship_id"])
+    assert get_relatives_by_path(12, "parent", "parent") == []
+    assert get_kinship_distance(12, 2) is None and get_kinship_distance(2, 4) == 2
+    
+    # A shortcut shortens the distance but keeps the longer paths
+    add_family_relationship(12, "user2@example.com", "grandparent")
+    assert get_kinship_distance(12, 2) == 1
+    assert get_kinship_distance(12, 4) == 3
+    
+    # The paths over a relationship are counted under the write lock, not before it
+    import models.database as database
+    count_paths = database._family_closure_edge_paths
+    locked = []
+    def paths_in_transaction(router, edges):
+        locked.append(getattr(db.local, "writer", None) is not None)
+        return count_paths(router, edges)
+    monkeypatch.setattr(database, "_family_closure_edge_paths", paths_in_transaction)
+    link = add_family_relationship(4, "user12@example.com", "sibling")
+    remove_family_relationship(link["relationship_id"])
+    assert locked == [True, True]
+    close_all_databases()
+
+def test_family_closure_updates_only_paths_over_the_edge(tmp_path, monkeypatch):
+    """Test that closure path counts follow a hub's relationships and match the migration backfill."""
+    from models.database import (
+        get_database, close_all_databases, add_family_relationship, remove_family_relationship,
+        get_relatives_by_path
+    )
+    from models.migrations import apply_migrations, FAMILY_CLOSURE_PATH_COUNTS
+    
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "hub.sqlite"))
+    db = get_database()
+    apply_migrations(db, pause=0)
+    for user_id in range(1, 42):
+        db.execute_query(
+            "INSERT INTO users (id, name, email, password_hash, created_at, updated_at) VALUES (?, ?, ?, 'x', 0, 0)",
+            (user_id, f"user{user_id}", f"user{user_id}@example.com")
+        )
+    # A parent of 40 children, two of whom are siblings
+    links = [add_family_relationship(1, f"user{child}@example.com", "child") for child in range(2, 42)]
+    add_family_relationship(2, "user3@example.com", "sibling")
+    
+    assert len(get_relatives_by_path(2, "parent", "child")) == 39
+    row = db.fetch_one(
+        "SELECT paths FROM family_closure WHERE ancestor_id = 2 AND descendant_id = 3 AND path_type = 'parent,child'",
+        row_mode='dict'
+    )
+    assert row["paths"] == 1
+    
+    # Removing a child touches the paths over its relationships, about two
+    # per sibling, not the 40 * 40 paths between the hub's children
+    import models.database as database
+    count_paths = database._family_closure_edge_paths
+    touched = []
+    def record_paths(router, edges):
+        paths = count_paths(router, edges)
+        touched.append(len(paths))
+        return paths
+    monkeypatch.setattr(database, "_family_closure_edge_paths", record_paths)
+    snapshot = "SELECT ancestor_id, descendant_id, depth, path_type, paths FROM family_closure ORDER BY 1, 2, 4"
+    remove_family_relationship(links[-1]["relationship_id"])
+    incremental = db.fetch_all(snapshot, row_mode='dict')
+    assert len(get_relatives_by_path(2, "parent", "child")) == 38
+    assert touched and touched[0] < 4 * 40
+    
+    # The rows match the migration's backfill of the same relationships
+    for statement in FAMILY_CLOSURE_PATH_COUNTS[2:]:
+        db.execute_query(statement)
+    assert db.fetch_all(snapshot, row_mode='dict') == incremental
+    close_all_databases()
+
+def test_find_relationship_path_meets_in_the_middle(tmp_path, monkeypatch):
+    """Test that the bidirectional search returns the shortest typed path."""
+    from models.database import (
+        get_database, get_shards, close_all_databases, add_family_relationship,
+        remove_family_relationship, find_relationship_path
+    )
+    from models.migrations import apply_migrations
+    
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "path.sqlite"))
+    db = get_database()
+    apply_migrations(db, pause=0)
+    for user_id in (1, 2, 3, 4, 5, 12):
+        db.execute_query(
+            "INSERT INTO users (id, name, email, password_hash, created_at, updated_at) VALUES (?, ?, ?, 'x', 0, 0)",
+            (user_id, f"user{user_id}", f"user{user_id}@example.com")
+        )
+    add_family_relationship(12, "user1@example.com", "parent")
+    link = add_family_relationship(1, "user2@example.com", "parent")
+    add_family_relationship(2, "user3@example.com", "parent")
+    add_family_relationship(3, "user4@example.com", "parent")
+    add_family_relationship(12, "user5@example.com", "sibling")
+    
+    router = get_shards()
+    for enabled in (True, False):
+        router.family_graph_enabled = enabled
+        path = find_relationship_path(12, 4)
+        assert path["length"] == 4
+        assert [user["id"] for user in path["users"]] == [12, 1, 2, 3, 4]
+        assert [(s["user_id"], s["relative_id"], s["relationship_type"]) for s in path["steps"]] == [
+            (12, 1, "parent"), (1, 2, "parent"), (2, 3, "parent"), (3, 4, "parent")
+        ]
+        assert [s["relationship_type"] for s in find_relationship_path(4, 5)["steps"]] == [
+            "child", "child", "child", "child", "sibling"
+        ]
+        assert find_relationship_path(12, 4, max_depth=3) is None
+        assert find_relationship_path(12, 12)["length"] == 0
+    
+    remove_family_relationship(link["relationship_id"])
+    assert find_relationship_path(12, 4) is None
+    close_all_databases()
+
+def test_sharded_helpers_route_by_user(tmp_path, monkeypatch):
+    """Test that per-user helpers route to shards and cross-shard work is coordinated."""
+    from models.database import (
+        get_shards, close_all_databases, create_user, get_user_by_email, get_user_by_id,
+        add_family_relationship, verify_family_relationship, get_family_relationships,
+        get_family_tree, create_did_document, get_did_by_identifier, SHARD_ID_BITS
+    )
+    
+    db_path = str(tmp_path / "poh.sqlite")
+    monkeypatch.setenv("DATABASE_PATH", db_path)
+    router = get_shards(db_path, shards=3)
+    router.migrate()
+    assert [os.path.basename(shard.database_path) for shard in router.shards] == [
+        "poh.sqlite", "poh.shard1.sqlite", "poh.shard2.sqlite"
+    ]
+    
+    ids = {name: create_user(name, f"{name}@example.com", "x") for name in ("ann", "bob", "cy", "dee", "eve")}
+    for name, user_id in ids.items():
+        assert user_id >> SHARD_ID_BITS == router.home_shard(f"{name}@example.com")
+        assert get_user_by_id(user_id)["name"] == name
+        assert get_user_by_email(f"{name.upper()}@example.com")["id"] == user_id
+    
+    # A relationship between users on different shards
+    ann = ids["ann"]
+    other = next(name for name, user_id in ids.items() if router.shard_of(user_id) != router.shard_of(ann))
+    result = add_family_relationship(ann, f"{other}@example.com", "sibling")
+    assert router.shard_of(result["relationship_id"]) == router.shard_of(ann)
+    assert router.shard_of(result["inverse_id"]) == router.shard_of(ids[other])
+    assert router.for_id(ids[other]).fetch_one(
+        "SELECT COUNT(*) AS count FROM notifications WHERE user_id = ?", (ids[other],)
+    )["count"] == 1
+    
+    verify_family_relationship(result["relationship_id"])
+    assert get_user_by_id(ids[other])["verified_relationship_count"] == 1
+    assert [(r["relative_id"], r["name"], r["verified"]) for r in get_family_relationships(ann)] == [
+        (ids[other], other, 1)
+    ]
+    third = next(name for name in ids if name not in ("ann", other))
+    add_family_relationship(ids[other], f"{third}@example.com", "parent")
+    tree = get_family_tree(ann)
+    assert {node["id"] for node in tree["nodes"]} == {ann, ids[other], ids[third]}
+    assert len(tree["links"]) == 2
+    
+    create_did_document(ids[third], "did:poh:third", "{}")
+    assert get_did_by_identifier("did:poh:third")["user_id"] == ids[third]
+    
+    # The coordinator rolls every shard back together
+    with pytest.raises(RuntimeError):
+        with router.transaction(0, 1, 2) as shards:
+            for shard in shards.values():
+                shard.execute_query("UPDATE users SET name = 'changed'")
+            raise RuntimeError("abort")
+    assert sum(len(shard.fetch_all("SELECT id FROM users WHERE name = 'changed'")) for shard in router.shards) == 0
+    close_all_databases()
+
+def test_maintenance_scheduler_runs_due_tasks(tmp_path):
+    """Test that maintenance checkpoints on WAL size, waits for idle pools and records each run."""
+    from models.maintenance import MaintenanceScheduler
+    
+    db = Database(str(tmp_path / "poh.sqlite"))
+    db.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY, value TEXT)")
+    db.bulk_insert("test", [{"value": "x" * 500} for _ in range(200)])
+    
+    scheduler = MaintenanceScheduler(db, interval=3600, wal_threshold=1024, busy_timeout=0.1)
+    assert scheduler.due(idle=False) == ["checkpoint"]
+    record = scheduler.run("checkpoint")
+    assert record["error"] is None and not record["busy"]
+    assert record["before"]["wal_size"] > 0 and record["after"]["wal_size"] == 0
+    
+    # Periodic tasks wait for an idle tick, unless they are long overdue
+    later = time.time() + 3600
+    assert scheduler.due(now=later, idle=False) == []
+    assert scheduler.due(now=later, idle=True) == ["checkpoint", "optimize", "trim_family_changes"]
+    assert "analyze" in scheduler.due(now=time.time() + 3600 * 24 * 4, idle=False)
+    assert scheduler.is_idle() is False
+    assert scheduler.is_idle() is True
+    
+    assert scheduler.run("analyze")["error"] is None
+    assert db.fetch_one("SELECT COUNT(*) AS count FROM sqlite_stat1")["count"] > 0
+    assert scheduler.run("trim_family_changes")["skipped"] is True
+    assert scheduler.stats()["runs"] == {"checkpoint": 1, "optimize": 0, "trim_family_changes": 1, "analyze": 1}
+    db.close_pools()
+    
+    # Databases opened by file: URI are maintained too
+    path = tmp_path / "uri.sqlite"
+    db = Database(f"file:{path}?cache=private")
+    db.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY, value TEXT)")
+    db.bulk_insert("test", [{"value": "x" * 500} for _ in range(200)])
+    record = MaintenanceScheduler(db, busy_timeout=0.1).run("checkpoint")
+    assert record["error"] is None and record["before"]["wal_size"] > 0 and record["after"]["wal_size"] == 0
+    assert record["after"]["file_size"] == os.path.getsize(path)
+    db.close_pools()
+
+def test_replica_serves_snapshot_until_refreshed(tmp_path):
+    """Test that the replica copies the primary incrementally and is refreshed explicitly."""
+    from models.replicas import ReplicaManager
+    
+    db = Database(str(tmp_path / "poh.sqlite"))
+    db.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY, value TEXT)")
+    db.bulk_insert("test", [{"value": "x" * 500} for _ in range(200)])
+    
+    replica = ReplicaManager(db.database_path, interval=0, pages=4)
+    assert replica.replica_path == str(tmp_path / "poh.replica.sqlite")
+    assert replica.fetch_one("SELECT COUNT(*) AS count FROM test")["count"] == 200
+    
+    # Readers keep the old snapshot, even while the primary is mid-write
+    with db.transaction():
+        db.execute_query("DELETE FROM test WHERE id > 50")
+        assert replica.fetch_one("SELECT COUNT(*) AS count FROM test")["count"] == 200
+    
+    replica.refresh()
+    assert replica.fetch_one("SELECT COUNT(*) AS count FROM test")["count"] == 50
+    stats = replica.stats()
+    assert stats["refreshes"] == 2
+    assert stats["failures"] == 0
+    replica.stop()
+    db.close_pools()
+
+def test_replica_started_with_app_and_stopped_with_databases(tmp_path):
+    """Test that the app starts the replica refresher and close_all_databases() stops it."""
+    from app import create_app
+    from models.database import close_all_databases
+    from models.replicas import get_replica
+    
+    db_path = str(tmp_path / "app.sqlite")
+    create_app({'TESTING': True, 'DATABASE_PATH': db_path, 'DATABASE_MAINTENANCE': False,
+                'DATABASE_REPLICA': True, 'DATABASE_REPLICA_INTERVAL': 60})
+    replica = get_replica(db_path)
+    thread = replica._refresher
+    deadline = time.time() + 5
+    while not replica.ready and time.time() < deadline:
+        time.sleep(0.01)
+    assert replica.ready and thread.is_alive()
+    
+    close_all_databases()
+    assert not thread.is_alive() and get_replica(db_path) is None
+
+def test_database_group_commit_batches_concurrent_writes(tmp_path):
+    """Test that concurrent writes share commits and each caller gets its own outcome."""
+    import threading
+    
+    db = Database(str(tmp_path / "group.sqlite"), group_commit=True)
+    db.group_commit.window = 0.05
+    db.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY, value INTEGER UNIQUE)")
+    
+    results = {}
+    
+    def writer(value):
+        try:
+            results[value] = db.execute_query("INSERT INTO test (value) VALUES (?)", (value % 15,))
+        except DatabaseError as e:
+            results[value] = e
+    
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    # Values 15-19 collide with 0-4: exactly one of each pair fails on its own
+    failures = [value for value, result in results.items() if isinstance(result, DatabaseError)]
+    assert len(failures) == 5
+    assert db.fetch_one("SELECT COUNT(*) AS count FROM test")["count"] == 15
+    
+    stats = db.pool_stats()["group_commit"]
+    assert stats["writes"] == 21
+    assert stats["failed_writes"] == 5
+    assert stats["batches"] < 20
+    
+    future = db.submit_write(db.execute_query, "INSERT INTO test (value) VALUES (?)", (99,))
+    assert future.result(timeout=5) == 16
+    db.close_pools()
+
+def test_database_query_stats_capture_slow_plans(tmp_path):
+    """Test per-fingerprint query stats and EXPLAIN QUERY PLAN capture for slow queries."""
+    from models.database import query_fingerprint
+    
+    assert query_fingerprint("SELECT * FROM users WHERE id IN (1, 2,  3) AND name = 'x'") == \
+        "SELECT * FROM users WHERE id IN (?+) AND name = ?"
+    
+    db = Database(str(tmp_path / "stats.sqlite"), query_stats=True)
+    db.execute_query("CREATE TABLE test (id INTEGER PRIMARY KEY, name TEXT)")
+    db.bulk_insert("test", [{"name": f"n{i}"} for i in range(10)])
+    
+    for i in range(1, 4):
+        assert db.fetch_one("SELECT * FROM test WHERE id = ?", (i,)) is not None
+    db.fetch_all("SELECT * FROM test")
+    
+    stats = {entry["fingerprint"]: entry for entry in db.query_stats.snapshot()}
+    by_id = stats["SELECT * FROM test WHERE id = ?"]
+    assert by_id["count"] == 3
+    assert by_id["total_rows"] == 3
+    assert by_id["plan"] is None
+    assert stats["SELECT * FROM test"]["max_rows"] == 10
+    
+    # Everything is slow now, so the plan is captured
+    db.query_stats.slow_threshold = 0
+    db.query_stats.reset()
+    list(db.fetch_iter("SELECT * FROM test WHERE name = ?", ("n1",)))
+    entry = db.query_stats.snapshot()[0]
+    assert entry["slow_count"] == 1
+    assert any("SCAN" in step for step in entry["plan"])
+    db.close_pools()
+
+def test_index_advisor_flags_scans_and_migration_fixes_them(tmp_path):
+    """Test that the advisor proposes indexes for scans and the index migration removes them."""
+    from models.index_advisor import build_sample_database, advise, collect_queries
+    from models.migrations import apply_migrations, current_version, MIGRATIONS
+    
+    queries = collect_queries()
+    assert any("FROM notifications" in query["sql"] for query in queries)
+    
+    db = build_sample_database(str(tmp_path / "advisor.sqlite"), users=200, target=1)
+    assert current_version(db) == 1
+    
+    report = advise(db, queries)
+    proposed = {(p["table"], tuple(p["columns"]), bool(p["where"])) for p in report["proposals"]}
+    assert ("notifications", ("user_id", "read", "created_at"), False) in proposed
+    assert ("notifications", ("user_id", "created_at"), True) in proposed
+    assert ("family_relationships", ("user_id", "verified", "created_at"), False) in proposed
+    
+    assert apply_migrations(db) == [m.version for m in MIGRATIONS if m.version > 1]
+    assert apply_migrations(db) == []
+    report = advise(db, queries)
+    assert report["proposals"] == []
+    assert not any(f["kind"] == "full_scan" for q in report["queries"] for f in q["findings"])
+    db.close_pools()
+
+def test_index_advisor_plans_templated_statements(tmp_path):
+    """Test that id-list templates and f-strings are planned with sample bindings."""
+    from models.index_advisor import build_sample_database, advise, collect_queries, main
+    
+    queries = {query["name"]: query["sql"] for query in collect_queries()}
+    assert "IN (?, ?, ?)" in queries["_users_by_id"]
+    assert "IN (?, ?, ?)" in queries["_family_edges_to"]
+    assert "bulk_update" not in queries
+    
+    db = build_sample_database(str(tmp_path / "advisor.sqlite"), users=50)
+    report = advise(db)
+    assert not [entry["name"] for entry in report["queries"] if entry["error"]]
+    db.close_pools()
+    
+    # A statement that cannot be planned fails the run
+    assert main(["--database", str(tmp_path / "empty.sqlite")]) == 1
+
+def test_migrations_reconcile_legacy_schema(tmp_path, monkeypatch):
+    """Test that databases built from the old schema definitions converge on the canonical one."""
+    from models.database import get_database, close_all_databases, get_family_relationships
+    from models.migrations import apply_migrations, MIGRATIONS
+    
+    def describe(conn):
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        return {
+            table: (
+                {row[1]: row[2:] for row in conn.execute(f"PRAGMA table_info({table})")},
+                sorted(row[1] for row in conn.execute(f"PRAGMA index_list({table})")),
+                sorted(row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (table,)
+                ))
+            )
+            for table in tables
+        }
+    
+    # Layout of the previous schema.sql, with ISO-8601 text timestamps
+    legacy_path = str(tmp_path / "legacy.sqlite")
+    conn = sqlite3.connect(legacy_path)
+    conn.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL, first_name TEXT, last_name TEXT,
+            verification_level INTEGER DEFAULT 0, email_verified BOOLEAN DEFAULT 0,
+            created_at TEXT NOT NULL, updated_at TEXT NOT NULL);
+        CREATE TABLE family_relations (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+            relative_id INTEGER NOT NULL, relationship_type TEXT NOT NULL, is_verified BOOLEAN DEFAULT 0,
+            created_at TEXT NOT NULL, updated_at TEXT NOT NULL);
+        CREATE TABLE did_documents (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+            did_identifier TEXT UNIQUE NOT NULL, document_json TEXT NOT NULL, public_key TEXT NOT NULL,
+            created_at TEXT NOT NULL, updated_at TEXT NOT NULL);
+        INSERT INTO users (username, email, password_hash, first_name, last_name, created_at, updated_at)
+            VALUES ('ann', 'Ann@Example.com', 'x', 'Ann', 'Lee', '2024-01-01T00:00:00', '2024-01-01T00:00:00'),
+                   ('bob', 'bob@example.com', 'x', NULL, NULL, '2024-01-01T00:00:00', '2024-01-01T00:00:00');
+        INSERT INTO family_relations (user_id, relative_id, relationship_type, is_verified, created_at, updated_at)
+            VALUES (1, 2, 'sibling', 1, '2024-01-01T00:00:00', '2024-01-01T00:00:00');
+        INSERT INTO did_documents (user_id, did_identifier, document_json, public_key, created_at, updated_at)
+            VALUES (1, 'did:poh:ann', '{}', 'key', '2024-01-01T00:00:00', '2024-01-01T00:00:00');
+    """)
+    conn.close()
+    
+    monkeypatch.setenv("DATABASE_PATH", legacy_path)
+    db = get_database()
+    assert apply_migrations(db, pause=0) == [m.version for m in MIGRATIONS]
+    
+    users = db.fetch_all("SELECT id, name, email, username, created_at FROM users ORDER BY id")
+    assert [(u["name"], u["email"], u["username"]) for u in users] == [
+        ("Ann Lee", "ann@example.com", "ann"), ("bob", "bob@example.com", "bob")
+    ]
+    assert users[0]["created_at"] == 1704067200
+    relationships = get_family_relationships(1)
+    assert [(r["relative_id"], r["verified"], r["name"]) for r in relationships] == [(2, 1, "bob")]
+    document = db.fetch_one("SELECT identifier, document, keys FROM did_documents")
+    assert document == {"identifier": "did:poh:ann", "document": "{}", "keys": "key"}
+    
+    # Same tables, columns and indexes as a database created from schema.sql
+    migrated = sqlite3.connect(legacy_path)
+    reference = sqlite3.connect(":memory:")
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "schema.sql")) as f:
+        reference.executescript(f.read())
+    expected = describe(reference)
+    actual = describe(migrated)
+    assert set(actual) == set(expected)
+    for table, (columns, indexes, triggers) in expected.items():
+        assert columns.items() <= actual[table][0].items()
+        assert actual[table][1:] == (indexes, triggers)
+    assert [row[0] for row in reference.execute("SELECT version FROM schema_migrations ORDER BY version")] \
+        == [m.version for m in MIGRATIONS]
+    migrated.close()
+    reference.close()
+    close_all_databases()
+
 def test_database_execute_query():
     """Test executing a simple query."""
     db = Database(db_path=":memory:")